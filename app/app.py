@@ -1,23 +1,343 @@
+import os
+import queue
+import signal
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from uuid import NAMESPACE_URL, uuid5
+
 from cloudevents.events import Event, EventAttributes, EventOutcome, PulsarBinding
 from viaa.configuration import ConfigParser
 from viaa.observability import logging
 
-from app.services.db import DbClient, DuplicateKeyError, SipDelivery
-from app.services.pulsar import PulsarClient
+from app import metrics
+from app.backpressure import BackpressureController
+from app.cache import CorrelationIdCache
+from app.decoding import decode_message
+from app.health import HealthCheck, start_health_server
+from app.log_sampling import SampledLog, ThroughputSummary
+from app.periodic import PeriodicTask
+from app.profiling import Profiler, start_profiling_server
+from app.retry import InvalidMessageError
+from app.services.db import (
+    DbClient,
+    OutboxEvent,
+    RegistrationResult,
+    RegistrationStore,
+    SipDelivery,
+)
+from app.services.pulsar import PendingAck, PulsarClient
+from app.services.stores import build_store
 
 from . import APP_NAME
 
 
-class EventListener:
-    """EventListener is responsible for listening to Pulsar events and processing them."""
+def _record_correlation_id(correlation_id: str, s3_event_data: dict) -> str:
+    """Derive a stable correlation_id for an additional record of a notification.
+
+    The same notification always yields the same ids, so a redelivered message
+    is recognised as a duplicate.
+    """
+    return str(
+        uuid5(
+            NAMESPACE_URL,
+            f"{correlation_id}/{s3_event_data['bucket']['name']}/{s3_event_data['object']['key']}",
+        )
+    )
+
+
+def _delivery_key(sip_delivery: SipDelivery) -> str:
+    """Identify a delivery by its correlation_id and S3 object."""
+    return f"{sip_delivery.correlation_id}/{sip_delivery.s3_bucket}/{sip_delivery.s3_object_key}"
+
+
+class BaseEventListener:
+    """Business rules shared by the synchronous and the asyncio listener engines."""
 
     def __init__(self):
-        """Initializes the EventListener with configuration, logging, and Pulsar client."""
-        config_parser = ConfigParser()
-        self.config = config_parser.app_cfg
-        self.db_client = DbClient(config_parser)
-        self.log = logging.get_logger(__name__, config=config_parser)
-        self.pulsar_client = PulsarClient(config_parser)
+        """Initializes the configuration, logging and the correlation_id cache."""
+        self.config_parser = ConfigParser()
+        self.config = self.config_parser.app_cfg
+        self.log = logging.get_logger(__name__, config=self.config_parser)
+        self.cache = self._build_cache(self.config.get("cache", {}))
+        self.emitted = self._build_emitted_cache(
+            self.config["pulsar"].get("deduplication", {})
+        )
+        # With the outbox, the outgoing events are written to the database
+        # and published by the relay.
+        self.outbox_enabled = self.config["db"].get("outbox", {}).get("enabled", False)
+        # A KeyShared subscription only keeps the messages of a correlation_id
+        # in order if the upstream producer keys them by it.
+        self.key_shared = (
+            self.config["pulsar"].get("subscription_type", "Exclusive") == "KeyShared"
+        )
+        self._warned_key = False
+        listener_config = self.config.get("listener", {})
+        self.fast_decode = listener_config.get("fast_decode", False)
+        self.receive_timeout_ms = listener_config.get("receive_timeout_ms", 1000)
+        self.shutdown_timeout = listener_config.get("shutdown_timeout", 30)
+        self.warm_up_timeout = listener_config.get("warm_up_timeout", 30)
+        health_config = self.config.get("health", {})
+        self.health = HealthCheck(
+            liveness_timeout=health_config.get("liveness_timeout", 60),
+            max_message_age=health_config.get("max_message_age"),
+        )
+        # Per-message lines are sampled; errors are always logged on self.log.
+        log_config = self.config.get("log", {})
+        self.sampled_log = SampledLog(
+            self.log,
+            sample_every=log_config.get("sample_every", 1),
+            max_per_second=log_config.get("max_per_second", 0),
+        )
+        self.summary = ThroughputSummary()
+        self.summary_interval = log_config.get("summary_interval", 0)
+        self._summary_task: PeriodicTask | None = None
+        self.profiler = Profiler(self.config.get("profiling", {}), self.log)
+        self._stopping = threading.Event()
+        self._shutdown_deadline: float | None = None
+        # Called on every iteration of the receive loop, e.g. by a supervisor.
+        self.on_heartbeat: Callable[[], None] | None = None
+        if self.cache is not None:
+            metrics.CACHE_HITS.set_function(lambda: self.cache.hits)
+            metrics.CACHE_MISSES.set_function(lambda: self.cache.misses)
+        self.backpressure = self._build_backpressure(
+            self.config.get("backpressure", {})
+        )
+        if self.backpressure is not None:
+            metrics.BACKPRESSURE_PAUSED.set_function(
+                lambda: int(self.backpressure.paused)
+            )
+            metrics.INSERT_LATENCY.set_function(lambda: self.backpressure.latency)
+
+    def stop(self):
+        """Stop receiving messages; the listener then drains and shuts down.
+
+        The shutdown must complete within `listener.shutdown_timeout` seconds
+        from now.
+        """
+        if self._stopping.is_set():
+            return
+        self._shutdown_deadline = time.monotonic() + self.shutdown_timeout
+        self._stopping.set()
+        self.log.info(f"Stopping, shutting down within {self.shutdown_timeout}s.")
+
+    def _heartbeat(self):
+        """Signal that the receive loop is still running."""
+        self.health.beat()
+        self.profiler.checkpoint()
+        if self.on_heartbeat is not None:
+            self.on_heartbeat()
+
+    def _start_health_server(self):
+        """Serve the liveness and readiness probes.
+
+        The readiness probe checks the database pool and the Pulsar consumer.
+        """
+        if os.environ.get(metrics.MULTIPROCESS_DIR_ENV):
+            # The supervisor serves the health of all worker processes.
+            return
+        self.health.checks = {
+            "database": self.db_client.is_healthy,
+            "pulsar": self.pulsar_client.is_connected,
+        }
+        start_health_server(
+            self.config.get("health", {}), self.health.liveness, self.health.readiness
+        )
+
+    def _start_profiling_server(self):
+        """Serve the HTTP trigger of the profiler, if enabled."""
+        if os.environ.get(metrics.MULTIPROCESS_DIR_ENV):
+            # The workers would share the port; signal a worker instead.
+            return
+        start_profiling_server(self.config.get("profiling", {}), self.profiler)
+
+    def _profiling_signal(self) -> signal.Signals | None:
+        """The signal that starts a capture, None if profiling is disabled."""
+        if not self.profiler.enabled:
+            return None
+        return signal.Signals[self.config["profiling"].get("signal", "SIGUSR1")]
+
+    def _warmed_up(self, started: float):
+        """Mark the listener ready after its warm-up, which began at `started`."""
+        self.health.warmed_up()
+        self.log.info(f"Warmed up in {time.monotonic() - started:.2f}s.")
+        self.summary.report()
+        if self.summary_interval > 0:
+            self._summary_task = PeriodicTask(
+                self.summary_interval, self._log_summary, "log-summary", self.log
+            ).start()
+
+    def _log_summary(self):
+        """Log the throughput and outcomes since the previous summary."""
+        self.log.info(self.summary.report(self.sampled_log.pop_suppressed()))
+
+    def _stop_summary(self):
+        """Stop the periodic summary, logging the last interval."""
+        if self._summary_task is not None:
+            self._summary_task.stop()
+            self._log_summary()
+
+    def _record_error(self, amount: int = 1):
+        """Count messages that could not be handled."""
+        metrics.ERROR.inc(amount)
+        self.summary.count("failed", amount)
+
+    def _time_left(self) -> float:
+        """The seconds left until the shutdown deadline."""
+        if self._shutdown_deadline is None:
+            self._shutdown_deadline = time.monotonic() + self.shutdown_timeout
+        return max(0.0, self._shutdown_deadline - time.monotonic())
+
+    def _run_before_deadline(self, function: Callable[[], None], name: str) -> bool:
+        """Run a (blocking) shutdown step, giving up on it at the shutdown deadline.
+
+        Returns:
+            bool: Whether the step completed in time.
+        """
+
+        def run():
+            try:
+                function()
+            except Exception as e:
+                self.log.error(f"Error during {name}: {e}")
+
+        thread = threading.Thread(target=run, name=name, daemon=True)
+        thread.start()
+        thread.join(self._time_left())
+        if thread.is_alive():
+            self.log.error(
+                f"Giving up on {name}: the shutdown deadline of {self.shutdown_timeout}s passed."
+            )
+            return False
+        return True
+
+    def _build_cache(self, cache_config: dict) -> CorrelationIdCache | None:
+        """Build the cache of registered correlation_ids, if it is enabled."""
+        if not cache_config.get("enabled", False):
+            return None
+        bloom_filter_config = cache_config.get("bloom_filter", {})
+        return CorrelationIdCache(
+            capacity=cache_config.get("capacity", 100_000),
+            ttl_seconds=cache_config.get("ttl_seconds"),
+            bloom_filter_error_rate=(
+                bloom_filter_config.get("error_rate", 0.01)
+                if bloom_filter_config.get("enabled", False)
+                else None
+            ),
+        )
+
+    def _build_emitted_cache(
+        self, deduplication_config: dict
+    ) -> CorrelationIdCache | None:
+        """Build the cache of the deliveries an event was emitted for, if enabled."""
+        if not deduplication_config.get("enabled", False):
+            return None
+        return CorrelationIdCache(
+            capacity=deduplication_config.get("capacity", 100_000),
+            ttl_seconds=deduplication_config.get("ttl_seconds"),
+        )
+
+    def _build_backpressure(
+        self, backpressure_config: dict
+    ) -> BackpressureController | None:
+        """Build the controller that pauses consumption, if it is enabled."""
+        if not backpressure_config.get("enabled", False):
+            return None
+        return BackpressureController(
+            max_latency=backpressure_config.get("max_insert_latency_ms", 500) / 1000,
+            resume_latency=backpressure_config.get("resume_insert_latency_ms", 100)
+            / 1000,
+            # By default, pause once more requests wait than the pool has connections.
+            max_waiting=backpressure_config.get(
+                "max_waiting_requests",
+                self.config["db"].get("pool", {}).get("max_size"),
+            ),
+            probe_interval=backpressure_config.get("probe_interval_ms", 1000) / 1000,
+            smoothing=backpressure_config.get("smoothing", 0.2),
+            log=self.log,
+        )
+
+    def _receive_delay(self) -> float:
+        """The seconds to wait before receiving the next message, to relieve the database."""
+        if self.backpressure is None:
+            return 0.0
+        return self.backpressure.delay(self.db_client.waiting_requests())
+
+    @contextmanager
+    def _db_insert(self) -> Iterator[None]:
+        """Time a database insert for the metrics and the backpressure controller."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.DB_INSERT.observe(elapsed)
+            if self.backpressure is not None:
+                self.backpressure.observe(elapsed)
+
+    def _is_cached_duplicate(self, sip_delivery: SipDelivery) -> bool:
+        """Check whether the correlation_id is known to be registered already."""
+        return self.cache is not None and sip_delivery.correlation_id in self.cache
+
+    def _remember(self, sip_delivery: SipDelivery):
+        """Remember a correlation_id that the database confirmed to exist."""
+        if self.cache is not None:
+            self.cache.add(sip_delivery.correlation_id)
+
+    def _already_emitted(
+        self, sip_delivery: SipDelivery, error: str | None = None
+    ) -> bool:
+        """Check whether this process already emitted an event for the delivery.
+
+        The delivery is identified by its correlation_id and S3 object, so a
+        redelivered message doesn't emit a second (FAIL) event, while another
+        object with the same correlation_id still does. The error of a
+        suppressed FAIL event is still logged.
+        """
+        if self.emitted is None or _delivery_key(sip_delivery) not in self.emitted:
+            return False
+        metrics.SUPPRESSED.inc()
+        if error:
+            self.log.error(f"Error: {error} (its event was emitted already)")
+        return True
+
+    def _mark_emitted(self, sip_delivery: SipDelivery):
+        """Remember a delivery whose event the broker persisted."""
+        metrics.EMITTED.inc()
+        if self.emitted is not None:
+            self.emitted.add(_delivery_key(sip_delivery))
+
+    def _check_key(self, msg, event: Event):
+        """Warn once if a message on a KeyShared subscription isn't keyed by its correlation_id.
+
+        The broker routes a message to a consumer by its ordering key, or its
+        partition key if it has none. Other messages of the same
+        correlation_id may then go to another consumer and be handled out of
+        order.
+        """
+        if not self.key_shared or self._warned_key:
+            return
+        key = msg.ordering_key() or msg.partition_key()
+        if key != event.correlation_id:
+            self._warned_key = True
+            self.log.warning(
+                f"Message key {key!r} is not its correlation_id {event.correlation_id!r}: "
+                "the KeyShared subscription doesn't keep the messages of a correlation_id in order."
+            )
+
+    def _decode_event(self, msg) -> Event:
+        """Decode a received message, using the fast path when possible.
+
+        Raises:
+            Exception: If the message is not a valid CloudEvent.
+        """
+        if self.fast_decode:
+            event = decode_message(msg)
+            if event is not None:
+                return event  # type: ignore
+        # Also reports what is wrong with messages the fast path rejected.
+        return PulsarBinding.from_protocol(msg)  # type: ignore
 
     def _build_payload_event(
         self, sip_delivery: SipDelivery, message: str | None = None
@@ -33,51 +353,331 @@ class EventListener:
 
         return payload
 
-    def handle_incoming_message(self, event: Event):
+    def _should_register(self, event: Event) -> bool:
+        """Check whether the event announces a delivery that should be registered."""
+        subject = event.get_attributes().get("subject")
+        if not event.has_successful_outcome():
+            self.log.info(f"Dropping non successful event: {subject}")
+            metrics.DROPPED.inc()
+            self.summary.count("dropped")
+            self.health.processed()
+            return False
+
+        self.sampled_log.info("Start handling of %s.", subject)
+        return True
+
+    def _parse_sip_deliveries(self, event: Event) -> list[SipDelivery]:
+        """Build a SIP delivery for every record of the S3 notification in the event.
+
+        The first record keeps the correlation_id of the event, the others get
+        one derived from it and their S3 object.
+
+        Raises:
+            InvalidMessageError: If the notification has no records, or a
+                record misses an S3 field.
         """
-        Handles an incoming Pulsar event.
+        try:
+            records = event.get_data()["s3_message"]["Records"]
+        except (KeyError, TypeError) as e:
+            raise InvalidMessageError(f"Event without S3 notification: {e!r}") from e
+        if not records:
+            raise InvalidMessageError("S3 notification without records.")
+        sip_deliveries = []
+        for index, record in enumerate(records):
+            try:
+                s3_event_data = record["s3"]
+                s3_bucket = s3_event_data["bucket"]["name"]
+                s3_object_key = s3_event_data["object"]["key"]
+                s3_domain = s3_event_data["domain"]["name"]
+            except (KeyError, TypeError) as e:
+                raise InvalidMessageError(
+                    f"S3 record {index} misses a field: {e!r}"
+                ) from e
+            sip_deliveries.append(
+                SipDelivery(
+                    correlation_id=(
+                        event.correlation_id
+                        if index == 0
+                        else _record_correlation_id(event.correlation_id, s3_event_data)
+                    ),
+                    s3_bucket=s3_bucket,
+                    s3_object_key=s3_object_key,
+                    s3_domain=s3_domain,
+                )
+            )
+        return sip_deliveries
+
+    def _uncached(self, sip_deliveries: list[SipDelivery]) -> list[SipDelivery]:
+        """The SIP deliveries that aren't known to be registered already."""
+        return [
+            sip_delivery
+            for sip_delivery in sip_deliveries
+            if not self._is_cached_duplicate(sip_delivery)
+        ]
+
+    def _batch_registration_errors(
+        self,
+        sip_deliveries: list[SipDelivery],
+        batch: list[SipDelivery],
+        duplicates: list[SipDelivery],
+    ) -> list[str | None]:
+        """Describe the outcome of registering SIP deliveries in one batch.
 
         Args:
-            event (Event): The incoming event to process.
+            sip_deliveries: All SIP deliveries to register.
+            batch: The deliveries sent to the database, the others are cached duplicates.
+            duplicates: The deliveries of the batch that were not inserted.
+
+        Returns:
+            The reason the registration failed per SIP delivery, None if it succeeded.
         """
+        for sip_delivery in batch:
+            self._remember(sip_delivery)
+        inserted = {id(sip_delivery) for sip_delivery in batch}
+        inserted.difference_update(id(sip_delivery) for sip_delivery in duplicates)
+        return [
+            None
+            if id(sip_delivery) in inserted
+            else self._duplicate_message(sip_delivery)
+            for sip_delivery in sip_deliveries
+        ]
 
-        # Producer
-        producer_topic = self.config["pulsar"]["producer_topic"]
+    def _registration_error(
+        self, sip_delivery: SipDelivery, result: RegistrationResult
+    ) -> str | None:
+        """Remember the registered correlation_id and describe a failed registration."""
+        self._remember(sip_delivery)
+        if result.inserted:
+            return None
+        return self._duplicate_message(sip_delivery, result.existing)
 
-        # Event attributes
-        attributes = event.get_attributes()
-        subject = attributes.get("subject")
+    def _record_registration(self, event: Event, error: str | None):
+        """Count the outcome of a handled registration and its end-to-end lag."""
+        if error:
+            metrics.DUPLICATE.inc()
+            self.summary.count("duplicates")
+        else:
+            metrics.SUCCESS.inc()
+            self.summary.count("registered")
+        metrics.observe_registration(event.get_event_time_as_int())
+        self.health.processed()
 
-        # Check if valid
-        if not event.has_successful_outcome():
-            self.log.info(f"Dropping non successful event: {subject}")
-            return
+    def _duplicate_message(
+        self, sip_delivery: SipDelivery, existing: SipDelivery | None = None
+    ) -> str:
+        """Describe why a SIP delivery was not registered."""
+        message = f"SIP delivery with correlation_id '{sip_delivery.correlation_id}' already exists"
+        if existing is None:
+            return f"{message}."
+        return (
+            f"{message} (s3_bucket: {existing.s3_bucket}, s3_object_key: {existing.s3_object_key}, "
+            f"status: {existing.status}, last_event_type: {existing.last_event_type})."
+        )
+
+    def _outbox_event(
+        self, event: Event, sip_delivery: SipDelivery, error: str | None = None
+    ) -> OutboxEvent:
+        """Build the outbox row of the outgoing event for a registration attempt."""
+        return OutboxEvent(
+            correlation_id=sip_delivery.correlation_id,
+            subject=event.get_attributes().get("subject"),
+            outcome=(EventOutcome.FAIL if error else EventOutcome.SUCCESS).value,
+            data=self._build_payload_event(sip_delivery, error),
+        )
 
-        self.log.info(f"Start handling of {subject}.")
+    def _build_registration_event(
+        self, event: Event, sip_delivery: SipDelivery, error: str | None = None
+    ) -> Event:
+        """Build the outgoing event for a registration attempt.
 
-        # Register SIP delivery in database
-        s3_event_data = event.get_data()["s3_message"]["Records"][0]["s3"]
-        sip_delivery = SipDelivery(
-            correlation_id=event.correlation_id,
-            s3_bucket=s3_event_data["bucket"]["name"],
-            s3_object_key=s3_event_data["object"]["key"],
-            s3_domain=s3_event_data["domain"]["name"],
+        Args:
+            event: The incoming event.
+            sip_delivery: The SIP delivery that was (or wasn't) registered.
+            error: The reason the registration failed, if it did.
+        """
+        if error:
+            self.log.error(f"Error: {error}")
+        return self._build_event(
+            self.config["pulsar"]["producer_topic"],
+            self._build_payload_event(sip_delivery, error),
+            event.get_attributes().get("subject"),
+            EventOutcome.FAIL if error else EventOutcome.SUCCESS,
+            sip_delivery.correlation_id,
         )
-        try:
-            self.db_client.insert_sip_delivery(sip_delivery)
-        except DuplicateKeyError as e:
-            self.log.error(f"Error: {str(e)}")
-            data = self._build_payload_event(sip_delivery, str(e))
-            self.produce_event(
-                producer_topic, data, subject, EventOutcome.FAIL, event.correlation_id
-            )
+
+    def _build_event(
+        self,
+        topic: str,
+        data: dict[str, str],
+        subject: str,
+        outcome: EventOutcome,
+        correlation_id: str,
+    ) -> Event:
+        attributes = EventAttributes(
+            type=topic,
+            source=APP_NAME,
+            subject=subject,
+            correlation_id=correlation_id,
+            outcome=outcome,
+        )
+        return Event(attributes, data)
+
+
+class EventListener(BaseEventListener):
+    """EventListener is responsible for listening to Pulsar events and processing them."""
+
+    def __init__(
+        self,
+        db_client: RegistrationStore | None = None,
+        pulsar_client: PulsarClient | None = None,
+    ):
+        """Initializes the EventListener with configuration, logging, and Pulsar client.
+
+        Args:
+            db_client: The store to use instead of the one selected by `db.backend`.
+            pulsar_client: The Pulsar client to use instead of a new PulsarClient.
+        """
+        super().__init__()
+        self.db_client = (
+            db_client if db_client is not None else build_store(self.config_parser)
+        )
+        self.pulsar_client = (
+            pulsar_client
+            if pulsar_client is not None
+            else PulsarClient(self.config_parser)
+        )
+        if self.outbox_enabled and not isinstance(self.db_client, DbClient):
+            raise ValueError("The outbox requires the postgres db backend.")
+        if self.outbox_enabled:
+            self.db_client.create_outbox()
+
+    def handle_incoming_message(
+        self, event: Event, pending_ack: PendingAck | None = None
+    ):
+        """
+        Handles an incoming Pulsar event.
+
+        Args:
+            event (Event): The incoming event to process.
+            pending_ack: The acknowledgement of the input message, which waits
+                for the outgoing event when it is produced asynchronously.
+        """
+
+        if not self._should_register(event):
             return
 
-        # Write successful event
-        data = self._build_payload_event(sip_delivery)
+        # Register the SIP deliveries in database
+        sip_deliveries = self._parse_sip_deliveries(event)
+        errors = self._register_sip_deliveries(
+            sip_deliveries,
+            [self._outbox_event(event, sip_delivery) for sip_delivery in sip_deliveries]
+            if self.outbox_enabled
+            else None,
+        )
+
+        for index, (sip_delivery, error) in enumerate(zip(sip_deliveries, errors)):
+            self._produce_registration_event(
+                event, sip_delivery, error, pending_ack, index
+            )
+            self._record_registration(event, error)
+
+    def _register_sip_deliveries(
+        self,
+        sip_deliveries: list[SipDelivery],
+        outbox_events: list[OutboxEvent] | None = None,
+    ) -> list[str | None]:
+        """Register SIP deliveries in a single round-trip to the database.
+
+        A single delivery is registered on its own, so a duplicate is reported
+        with the details of the existing record.
+
+        Args:
+            sip_deliveries: The SIP deliveries to register.
+            outbox_events: The SUCCESS event per delivery, to write to the
+                outbox together with the deliveries that are inserted.
+
+        Returns:
+            The reason the registration failed per SIP delivery, None if it succeeded.
+        """
+        if len(sip_deliveries) == 1:
+            (sip_delivery,) = sip_deliveries
+            if self._is_cached_duplicate(sip_delivery):
+                return [self._duplicate_message(sip_delivery)]
+            with self._db_insert():
+                result = (
+                    self.db_client.register_sip_delivery(sip_delivery)
+                    if outbox_events is None
+                    else self.db_client.register_sip_delivery(
+                        sip_delivery, outbox_event=outbox_events[0]
+                    )
+                )
+            return [self._registration_error(sip_delivery, result)]
+
+        if outbox_events is None:
+            batch = self._uncached(sip_deliveries)
+        else:
+            uncached = [
+                (sip_delivery, outbox_event)
+                for sip_delivery, outbox_event in zip(sip_deliveries, outbox_events)
+                if not self._is_cached_duplicate(sip_delivery)
+            ]
+            batch = [sip_delivery for sip_delivery, _ in uncached]
+        duplicates = []
+        if batch:
+            with self._db_insert():
+                duplicates = (
+                    self.db_client.insert_sip_deliveries(batch)
+                    if outbox_events is None
+                    else self.db_client.insert_sip_deliveries(
+                        batch, [outbox_event for _, outbox_event in uncached]
+                    )
+                )
+        return self._batch_registration_errors(sip_deliveries, batch, duplicates)
 
-        self.produce_event(
-            producer_topic, data, subject, EventOutcome.SUCCESS, event.correlation_id
+    def _produce_registration_event(
+        self,
+        event: Event,
+        sip_delivery: SipDelivery,
+        error: str | None = None,
+        pending_ack: PendingAck | None = None,
+        index: int = 0,
+    ):
+        """Produce the outgoing event for a registration attempt.
+
+        Nothing is produced if an event was already emitted for the delivery.
+
+        Args:
+            event: The incoming event.
+            sip_delivery: The SIP delivery that was (or wasn't) registered.
+            error: The reason the registration failed, if it did.
+            pending_ack: The acknowledgement of the input message.
+            index: The index of the delivery in the input message.
+        """
+        if self._already_emitted(sip_delivery, error):
+            return
+        if self.outbox_enabled:
+            # The SUCCESS event was written together with the registration.
+            # The FAIL event of a duplicate is written on its own, after the
+            # duplicate check; if that fails, the message is retried.
+            if error:
+                self.log.error(f"Error: {error}")
+                with metrics.OUTBOX_WRITE.time():
+                    self.db_client.add_to_outbox(
+                        [self._outbox_event(event, sip_delivery, error)]
+                    )
+            self._mark_emitted(sip_delivery)
+            return
+        outgoing_event = self._build_registration_event(event, sip_delivery, error)
+        self._send_event(
+            self.config["pulsar"]["producer_topic"],
+            outgoing_event,
+            pending_ack,
+            (
+                self.pulsar_client.sequence_id(pending_ack.msg, index)
+                if pending_ack is not None
+                else None
+            ),
+            lambda: self._mark_emitted(sip_delivery),
         )
 
     def produce_event(
@@ -87,41 +687,333 @@ class EventListener:
         subject: str,
         outcome: EventOutcome,
         correlation_id: str,
+        pending_ack: PendingAck | None = None,
     ):
         """Produce an event on a Pulsar topic.
+
+        When asynchronous sends are enabled and a pending acknowledgement is
+        given, the event is sent asynchronously and the input message is only
+        (n)acked once the broker persisted it.
+
         Args:
             topic: The topic to send the cloudevent to.
             data: The data payload.
             subject: The subject of the event.
             outcome: The attributes outcome of the Event.
             correlation_id: The correlation ID.
+            pending_ack: The acknowledgement of the input message.
         """
-        attributes = EventAttributes(
-            type=topic,
-            source=APP_NAME,
-            subject=subject,
-            correlation_id=correlation_id,
-            outcome=outcome,
-        )
+        event = self._build_event(topic, data, subject, outcome, correlation_id)
+        self._send_event(topic, event, pending_ack)
 
-        event = Event(attributes, data)
-        self.pulsar_client.produce_event(topic, event)
+    def _send_event(
+        self,
+        topic: str,
+        event: Event,
+        pending_ack: PendingAck | None = None,
+        sequence_id: int | None = None,
+        on_sent: Callable[[], None] | None = None,
+    ):
+        """Send a built event, asynchronously if enabled and a pending ack is given.
+
+        Args:
+            topic: The topic to send the event to.
+            event: The event.
+            pending_ack: The acknowledgement of the input message.
+            sequence_id: The sequence id for broker-side deduplication.
+            on_sent: Called once the broker persisted the event.
+        """
+        callback = None
+        if pending_ack is not None and self.pulsar_client.async_send_enabled:
+            done = pending_ack.expect()
+
+            def callback(succeeded: bool):
+                if succeeded and on_sent is not None:
+                    on_sent()
+                done(succeeded)
+
+        with metrics.PRODUCE.time():
+            try:
+                self.pulsar_client.produce_event(topic, event, callback, sequence_id)
+            except BaseException:
+                # The send was never queued, so its callback won't release
+                # the token.
+                if callback is not None:
+                    done(False)
+                raise
+        if callback is None and on_sent is not None:
+            on_sent()
 
     def receive_message(self) -> None:
-        msg = self.pulsar_client.receive()
+        with metrics.RECEIVE.time():
+            msg = self.pulsar_client.receive(self.receive_timeout_ms)
+        if msg is None:
+            return
+        with self.profiler.timed_message() as trace:
+            event = self._decode(msg)
+            if event is not None:
+                if trace is not None:
+                    trace.label = event.correlation_id
+                self.process_message(msg, event)
+
+    def _decode(self, msg) -> Event | None:
+        """Decode a received message; fail it and return None if that fails."""
         try:
-            event = PulsarBinding.from_protocol(msg)  # type: ignore
-            self.handle_incoming_message(event)
-            self.pulsar_client.acknowledge(msg)
+            with metrics.DECODE.time():
+                event = self._decode_event(msg)
+        except Exception as e:
+            self.log.error(f"Error: {e}")
+            self._record_error()
+            self.pulsar_client.fail(msg, e, permanent=True)
+            return None
+        self._check_key(msg, event)
+        return event
+
+    def process_message(self, msg, event: Event) -> None:
+        """Handle a decoded message and (n)ack it.
+
+        Args:
+            msg: The received Pulsar message.
+            event: The CloudEvent decoded from the message.
+        """
+        pending_ack = PendingAck(self.pulsar_client, msg)
+        try:
+            self.handle_incoming_message(event, pending_ack)
+            pending_ack.done()
         except Exception as e:
             # Catch and log any errors during message processing
             self.log.error(f"Error: {e}")
-            self.pulsar_client.negative_acknowledge(msg)
+            self._record_error()
+            pending_ack.done(succeeded=False, error=e)
+
+    def receive_messages(self) -> None:
+        """Receive a batch of messages and register all their records in a single transaction.
+
+        Every message in the batch is acknowledged on its own: a duplicate
+        correlation_id only results in a FAIL event for that message, and a
+        message that cannot be decoded fails without affecting the others.
+        """
+        with metrics.RECEIVE.time():
+            msgs = self.pulsar_client.batch_receive()
+        if msgs:
+            with self.profiler.timed_message(f"batch of {len(msgs)} messages"):
+                self._handle_batch(msgs)
+
+    def _handle_batch(self, msgs: list) -> None:
+        """Register the records of a received batch; see receive_messages."""
+        registrations: list[tuple[object, Event, list[SipDelivery]]] = []
+        for msg in msgs:
+            event = self._decode(msg)
+            if event is None:
+                continue
+            try:
+                if not self._should_register(event):
+                    self.pulsar_client.acknowledge(msg)
+                    continue
+                registrations.append((msg, event, self._parse_sip_deliveries(event)))
+            except Exception as e:
+                self.log.error(f"Error: {e}")
+                self._record_error()
+                self.pulsar_client.fail(msg, e)
+
+        if not registrations:
+            return
+
+        self.sampled_log.info(
+            "Start handling of batch of %d messages.", len(registrations)
+        )
+        sip_deliveries = [
+            sip_delivery
+            for _, _, message_deliveries in registrations
+            for sip_delivery in message_deliveries
+        ]
+        try:
+            errors = iter(
+                self._register_sip_deliveries(
+                    sip_deliveries,
+                    [
+                        self._outbox_event(event, sip_delivery)
+                        for _, event, message_deliveries in registrations
+                        for sip_delivery in message_deliveries
+                    ]
+                    if self.outbox_enabled
+                    else None,
+                )
+            )
+        except Exception as e:
+            self.log.error(f"Error: {e}")
+            self._record_error(len(registrations))
+            for msg, _, _ in registrations:
+                self.pulsar_client.fail(msg, e)
+            return
+
+        for msg, event, message_deliveries in registrations:
+            # Take the outcomes of this message before anything can fail.
+            message_errors = [next(errors) for _ in message_deliveries]
+            pending_ack = PendingAck(self.pulsar_client, msg)
+            try:
+                for index, (sip_delivery, error) in enumerate(
+                    zip(message_deliveries, message_errors)
+                ):
+                    self._produce_registration_event(
+                        event, sip_delivery, error, pending_ack, index
+                    )
+                    self._record_registration(event, error)
+                pending_ack.done()
+            except Exception as e:
+                self.log.error(f"Error: {e}")
+                self._record_error()
+                pending_ack.done(succeeded=False, error=e)
+
+    def listen_concurrently(self, workers: int, queue_size: int = 100) -> None:
+        """Receive messages and handle them on a pool of worker threads.
+
+        Messages are dispatched to a worker by their correlation_id, so the
+        events for one SIP are handled in order by the same worker. The workers
+        share the database connection pool. A message that can't be queued
+        before the listener stops is nacked, to be redelivered.
+
+        Args:
+            workers: The number of worker threads.
+            queue_size: The number of messages that can wait for each worker.
+        """
+        queues: list[queue.Queue] = [queue.Queue(queue_size) for _ in range(workers)]
+
+        def work(worker_queue: queue.Queue):
+            while (item := worker_queue.get()) is not None:
+                # Decoded on the receiving thread, so traced from here on.
+                with self.profiler.timed_message(item[1].correlation_id):
+                    self.process_message(*item)
+
+        threads = []
+        for index, worker_queue in enumerate(queues):
+            thread = threading.Thread(
+                target=work, args=(worker_queue,), name=f"worker-{index}", daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+        self.log.info(f"Started {workers} workers.")
+
+        while not self._stopping.is_set():
+            self._heartbeat()
+            delay = self._receive_delay()
+            if delay and self._stopping.wait(delay):
+                break
+            with metrics.RECEIVE.time():
+                msg = self.pulsar_client.receive(self.receive_timeout_ms)
+            if msg is None:
+                continue
+            event = self._decode(msg)
+            if event is not None and not self._dispatch(
+                queues[hash(event.correlation_id) % workers], (msg, event)
+            ):
+                self.pulsar_client.negative_acknowledge(msg)
+
+        # Let the workers finish the queued messages. A worker whose queue
+        # stays full until the deadline doesn't get to its end.
+        for worker_queue in queues:
+            try:
+                worker_queue.put(None, timeout=self._time_left())
+            except queue.Full:
+                pass
+        for thread in threads:
+            thread.join(self._time_left())
+        if any(thread.is_alive() for thread in threads):
+            self.log.error("Workers did not drain before the shutdown deadline.")
+
+    def _dispatch(self, worker_queue: queue.Queue, item: tuple) -> bool:
+        """Queue a message for a worker, waiting for room until the listener stops.
+
+        Returns:
+            bool: Whether the message was queued.
+        """
+        while not self._stopping.is_set():
+            try:
+                worker_queue.put(item, timeout=self.receive_timeout_ms / 1000)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _install_signal_handlers(self):
+        """Stop the listener on SIGTERM and SIGINT, and profile it on the profiling signal."""
+        # Signal handlers can only be set from the main thread.
+        if threading.current_thread() is not threading.main_thread():
+            return
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: self.stop())
+        profiling_signal = self._profiling_signal()
+        if profiling_signal is not None:
+            signal.signal(
+                profiling_signal, lambda signum, frame: self.profiler.trigger()
+            )
+
+    def shutdown(self) -> None:
+        """Flush the pending produces and acks and close the clients.
+
+        Pending asynchronous sends are flushed first, so their input messages
+        are acknowledged before the consumer closes.
+        """
+
+        def close_pulsar():
+            self.pulsar_client.flush()
+            self.pulsar_client.close()
+
+        self._stop_summary()
+        closed = self._run_before_deadline(close_pulsar, "closing Pulsar")
+        closed = (
+            self._run_before_deadline(self.db_client.close, "closing the database")
+            and closed
+        )
+        if closed:
+            self.log.info("Shut down.")
+
+    def warm_up(self) -> None:
+        """Fill the connection pool to its minimum size before consuming.
+
+        The producer for the producer topic is created with the Pulsar client.
+
+        Raises:
+            PoolTimeout: If the pool could not be filled within `listener.warm_up_timeout`.
+        """
+        started = time.monotonic()
+        self.db_client.warm_up(self.warm_up_timeout)
+        self._warmed_up(started)
 
     def start_listening(self) -> None:
         """
         Starts listening for incoming messages from the Pulsar topic.
+
+        When batch receive is enabled, messages are consumed and registered in
+        batches. Otherwise they are handled one at a time, or concurrently when
+        more than one worker is configured. Consuming starts after the warm-up.
+
+        Listens until SIGTERM or SIGINT is received, or `stop` is called. It
+        then finishes the messages in flight and shuts down.
         """
-        while True:
-            self.receive_message()
-        self.pulsar_client.close()
+        metrics.start_metrics_server(self.config.get("metrics", {}))
+        self._start_health_server()
+        self._start_profiling_server()
+        self._install_signal_handlers()
+        listener_config = self.config.get("listener", {})
+        workers = listener_config.get("workers", 1)
+        try:
+            self.warm_up()
+            if workers > 1 and not self.pulsar_client.batch_receive_enabled:
+                self.listen_concurrently(
+                    workers, listener_config.get("queue_size", 100)
+                )
+                return
+            receive = (
+                self.receive_messages
+                if self.pulsar_client.batch_receive_enabled
+                else self.receive_message
+            )
+            while not self._stopping.is_set():
+                self._heartbeat()
+                delay = self._receive_delay()
+                if delay and self._stopping.wait(delay):
+                    break
+                receive()
+        finally:
+            self.shutdown()
@@ -0,0 +1,210 @@
+import asyncio
+import signal
+import time
+from contextlib import asynccontextmanager
+
+from cloudevents.events import Event
+
+from app import metrics
+from app.app import BaseEventListener
+from app.services.db import SipDelivery
+from app.services.pulsar import AsyncPulsarClient, PulsarClient
+from app.services.stores import build_async_store
+
+
+class AsyncEventListener(BaseEventListener):
+    """Listener engine that handles many messages concurrently on one asyncio loop.
+
+    It applies the same business rules as EventListener. The database is
+    accessed through an AsyncConnectionPool and Pulsar through an asyncio
+    wrapper, so a registration waiting on I/O doesn't hold up the others.
+    """
+
+    def __init__(self):
+        """Initializes the listener with configuration, logging and the async clients."""
+        super().__init__()
+        if self.outbox_enabled:
+            raise ValueError("The outbox is only supported by the sync engine.")
+        self.db_client = build_async_store(self.config_parser)
+        self.pulsar_client = AsyncPulsarClient(
+            PulsarClient(self.config_parser),
+            self.config["pulsar"].get("async_send", {}).get("max_in_flight", 1000),
+        )
+        self.max_concurrency = self.config.get("listener", {}).get(
+            "max_concurrency", 100
+        )
+        self._key_locks: dict[str, tuple[asyncio.Lock, int]] = {}
+
+    @asynccontextmanager
+    async def _ordered(self, key: str):
+        """Handle the messages for one key (correlation_id) one after the other."""
+        lock, users = self._key_locks.get(key, (asyncio.Lock(), 0))
+        self._key_locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._key_locks[key]
+            if users == 1:
+                del self._key_locks[key]
+            else:
+                self._key_locks[key] = (lock, users - 1)
+
+    async def handle_incoming_message(self, event: Event, msg=None):
+        """
+        Handles an incoming Pulsar event.
+
+        Args:
+            event (Event): The incoming event to process.
+            msg: The received Pulsar message, to derive the sequence ids of the
+                outgoing events from.
+
+        Raises:
+            RuntimeError: If the outgoing event could not be produced.
+        """
+        if not self._should_register(event):
+            return
+
+        # Register the SIP deliveries in database
+        sip_deliveries = self._parse_sip_deliveries(event)
+        errors = await self._register_sip_deliveries(sip_deliveries)
+
+        producer_topic = self.config["pulsar"]["producer_topic"]
+        for index, (sip_delivery, error) in enumerate(zip(sip_deliveries, errors)):
+            if not self._already_emitted(sip_delivery, error):
+                outgoing_event = self._build_registration_event(
+                    event, sip_delivery, error
+                )
+                with metrics.PRODUCE.time():
+                    produced = await self.pulsar_client.produce_event(
+                        producer_topic,
+                        outgoing_event,
+                        self.pulsar_client.sequence_id(msg, index)
+                        if msg is not None
+                        else None,
+                    )
+                if not produced:
+                    raise RuntimeError(f"Failed to produce event on {producer_topic}")
+                self._mark_emitted(sip_delivery)
+            self._record_registration(event, error)
+
+    async def _register_sip_deliveries(
+        self, sip_deliveries: list[SipDelivery]
+    ) -> list[str | None]:
+        """Register SIP deliveries in a single round-trip to the database.
+
+        See EventListener._register_sip_deliveries.
+        """
+        if len(sip_deliveries) == 1:
+            (sip_delivery,) = sip_deliveries
+            if self._is_cached_duplicate(sip_delivery):
+                return [self._duplicate_message(sip_delivery)]
+            with self._db_insert():
+                result = await self.db_client.register_sip_delivery(sip_delivery)
+            return [self._registration_error(sip_delivery, result)]
+
+        batch = self._uncached(sip_deliveries)
+        duplicates = []
+        if batch:
+            with self._db_insert():
+                duplicates = await self.db_client.insert_sip_deliveries(batch)
+        return self._batch_registration_errors(sip_deliveries, batch, duplicates)
+
+    async def process_message(self, msg) -> None:
+        """Decode, handle and (n)ack a received message."""
+        # Every message runs in its own task, so traces don't mix.
+        with self.profiler.timed_message() as trace:
+            try:
+                with metrics.DECODE.time():
+                    event = self._decode_event(msg)
+            except Exception as e:
+                self.log.error(f"Error: {e}")
+                self._record_error()
+                self.pulsar_client.fail(msg, e, permanent=True)
+                return
+            self._check_key(msg, event)
+            if trace is not None:
+                trace.label = event.correlation_id
+            try:
+                async with self._ordered(event.correlation_id):
+                    await self.handle_incoming_message(event, msg)
+                self.pulsar_client.acknowledge(msg)
+            except Exception as e:
+                # Catch and log any errors during message processing
+                self.log.error(f"Error: {e}")
+                self._record_error()
+                self.pulsar_client.fail(msg, e)
+
+    async def start_listening(self) -> None:
+        """
+        Starts listening for incoming messages from the Pulsar topic.
+
+        At most `max_concurrency` messages are handled at the same time.
+        Consuming starts after the connection pool is filled.
+
+        Listens until SIGTERM or SIGINT is received, or `stop` is called. It
+        then finishes the messages in flight and shuts down.
+        """
+        metrics.start_metrics_server(self.config.get("metrics", {}))
+        self._start_health_server()
+        self._start_profiling_server()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.stop)
+        profiling_signal = self._profiling_signal()
+        if profiling_signal is not None:
+            loop.add_signal_handler(profiling_signal, self.profiler.trigger)
+        started = time.monotonic()
+        await self.db_client.open()
+        await self.db_client.warm_up(self.warm_up_timeout)
+        self._warmed_up(started)
+        slots = asyncio.Semaphore(self.max_concurrency)
+        tasks: set[asyncio.Task] = set()
+
+        def finish(task: asyncio.Task):
+            tasks.discard(task)
+            slots.release()
+
+        try:
+            while not self._stopping.is_set():
+                self._heartbeat()
+                delay = self._receive_delay()
+                if delay:
+                    await asyncio.sleep(delay)
+                    if self._stopping.is_set():
+                        break
+                await slots.acquire()
+                with metrics.RECEIVE.time():
+                    msg = await self.pulsar_client.receive(self.receive_timeout_ms)
+                if msg is None:
+                    slots.release()
+                    continue
+                task = asyncio.create_task(self.process_message(msg))
+                tasks.add(task)
+                task.add_done_callback(finish)
+        finally:
+            await self.shutdown(tasks)
+
+    async def shutdown(self, tasks: set[asyncio.Task]) -> None:
+        """Finish the messages in flight, then flush and close the clients.
+
+        Args:
+            tasks: The tasks handling the messages in flight.
+        """
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=self._time_left())
+            if pending:
+                self.log.error(
+                    f"{len(pending)} messages were not handled before the shutdown deadline."
+                )
+        self._stop_summary()
+        closed = self._run_before_deadline(self.pulsar_client.close, "closing Pulsar")
+        try:
+            await asyncio.wait_for(self.db_client.close(), self._time_left())
+        except TimeoutError:
+            self.log.error(
+                f"Giving up on closing the database: the shutdown deadline of {self.shutdown_timeout}s passed."
+            )
+            closed = False
+        if closed:
+            self.log.info("Shut down.")
@@ -0,0 +1,217 @@
+"""Re-registration of historical SIP deliveries in bulk.
+
+After an incident the deliveries of past events can be registered again by
+replaying the input topic from a timestamp, or by loading a file with one
+exported event per line. The events go through the same decoding and
+parsing as the listener, but are registered in large batches that are
+bulk loaded with COPY. Deliveries that are registered already are skipped.
+"""
+
+import time
+from collections.abc import Iterable, Iterator
+from datetime import datetime
+
+from cloudevents.events import CEMessageMode, Event, PulsarBinding
+from pulsar import Client, MessageId, Result
+
+from app.app import BaseEventListener
+from app.periodic import PeriodicTask
+from app.services.db import SipDelivery
+from app.services.pulsar import _producer_settings
+from app.services.stores import build_store
+
+
+class FileMessage:
+    """A line of an exported events file, posing as a received Pulsar message.
+
+    The line holds a CloudEvent in structured mode: the attributes next to
+    the data in one JSON object, as on the input topic.
+    """
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def data(self) -> bytes:
+        return self._data
+
+    def properties(self) -> dict:
+        return {}
+
+    def event_timestamp(self) -> int:
+        return 0
+
+
+def read_file(path: str) -> Iterator[FileMessage]:
+    """Read the events of a file with one event per line, skipping empty lines."""
+    with open(path, "rb") as file:
+        for line in file:
+            if line.strip():
+                yield FileMessage(line)
+
+
+def read_topic(client: Client, topic: str, since: datetime) -> Iterator:
+    """Read the messages published on a topic since a timestamp, up to its current end.
+
+    A reader doesn't use a subscription, so the listener's subscription is
+    left alone.
+    """
+    reader = client.create_reader(topic, MessageId.earliest)
+    try:
+        reader.seek(int(since.timestamp() * 1000))
+        while reader.has_message_available():
+            yield reader.read_next()
+    finally:
+        reader.close()
+
+
+class Backfill(BaseEventListener):
+    """Registers the SIP deliveries of historical events in bulk."""
+
+    def __init__(
+        self,
+        batch_size: int = 1000,
+        produce: bool = False,
+        progress_interval: float = 10,
+        replay: bool = False,
+    ):
+        """Initialize the backfill with its own store, and Pulsar client if needed.
+
+        Args:
+            batch_size: The number of SIP deliveries to register per COPY.
+            produce: Whether to produce the outgoing events of the newly
+                registered deliveries.
+            progress_interval: The seconds between two progress lines.
+            replay: Whether the events are replayed from a topic.
+        """
+        super().__init__()
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        pulsar_config = self.config["pulsar"]
+        self.db_client = build_store(self.config_parser)
+        self.client = None
+        if produce or replay:
+            self.client = Client(
+                f"pulsar://{pulsar_config['host']}:{pulsar_config['port']}"
+            )
+        self.producer = None
+        if produce:
+            # Batching pays off for the large number of sends; block instead
+            # of failing when the producer can't keep up.
+            self.producer = self.client.create_producer(
+                pulsar_config["producer_topic"],
+                **{
+                    **_producer_settings(pulsar_config.get("producer", {})),
+                    "batching_enabled": True,
+                    "block_if_queue_full": True,
+                },
+            )
+        self.read = 0
+        self.failed_sends = 0
+
+    def run(self, messages: Iterable):
+        """Register the SIP deliveries of the messages, then close the clients.
+
+        Args:
+            messages: The Pulsar messages, or FileMessages, to register.
+        """
+        started = time.monotonic()
+        self.summary.report()
+        progress = PeriodicTask(
+            self.progress_interval, self._log_progress, "backfill-progress", self.log
+        ).start()
+        registrations: list[tuple[Event, list[SipDelivery]]] = []
+        count = 0
+        try:
+            for msg in messages:
+                self.read += 1
+                registration = self._parse(msg)
+                if registration is None:
+                    continue
+                registrations.append(registration)
+                count += len(registration[1])
+                if count >= self.batch_size:
+                    self._register(registrations)
+                    registrations = []
+                    count = 0
+            self._register(registrations)
+        finally:
+            progress.stop()
+            self._log_progress()
+            self.close()
+        self.log.info(
+            f"Backfill done: read {self.read} messages in {time.monotonic() - started:.0f}s, "
+            f"{self.failed_sends} outgoing events failed."
+        )
+
+    def _log_progress(self):
+        self.log.info(
+            f"Backfill read {self.read} messages. "
+            + self.summary.report(self.sampled_log.pop_suppressed())
+        )
+
+    def _parse(self, msg) -> tuple[Event, list[SipDelivery]] | None:
+        """Decode a message and parse its SIP deliveries; None if there are none."""
+        try:
+            event = self._decode_event(msg)
+            if not self._should_register(event):
+                return None
+            return event, self._parse_sip_deliveries(event)
+        except Exception as e:
+            self.log.error(f"Error: {e}")
+            self._record_error()
+            return None
+
+    def _register(self, registrations: list[tuple[Event, list[SipDelivery]]]):
+        """Register the SIP deliveries of a batch of events with one COPY."""
+        if not registrations:
+            return
+        sip_deliveries = [
+            sip_delivery
+            for _, message_deliveries in registrations
+            for sip_delivery in message_deliveries
+        ]
+        batch = self._uncached(sip_deliveries)
+        duplicates = []
+        if batch:
+            with self._db_insert():
+                duplicates = self.db_client.copy_sip_deliveries(batch)
+        errors = iter(
+            self._batch_registration_errors(sip_deliveries, batch, duplicates)
+        )
+        for event, message_deliveries in registrations:
+            for sip_delivery in message_deliveries:
+                error = next(errors)
+                # Deliveries that were registered already get no event again.
+                if self.producer is not None and error is None:
+                    self._produce(self._build_registration_event(event, sip_delivery))
+                self._record_registration(event, error)
+        if self.producer is not None:
+            self.producer.flush()
+
+    def _produce(self, event: Event):
+        """Send an outgoing event without waiting for the broker."""
+        msg = PulsarBinding.to_protocol(event, CEMessageMode.STRUCTURED)
+        self.producer.send_async(
+            msg.data,
+            self._on_send,
+            properties=msg.attributes,
+            partition_key=event.correlation_id,
+            event_timestamp=event.get_event_time_as_int(),
+        )
+
+    def _on_send(self, result: Result, msg_id):
+        # An exception escaping a send callback terminates the process.
+        if result != Result.Ok:
+            self.failed_sends += 1
+            self.log.error(f"Failed to produce event: {result}")
+
+    def close(self):
+        """Flush the outgoing events and close the clients."""
+        if self.producer is not None:
+            self.producer.flush()
+            self.producer.close()
+        if self.client is not None:
+            self.client.close()
+        self.db_client.close()
@@ -0,0 +1,76 @@
+import threading
+
+
+class BackpressureController:
+    """Decides when to stop receiving messages because the database is saturated.
+
+    The database counts as saturated when the smoothed insert latency exceeds
+    `max_latency`, or when more than `max_waiting` requests wait for a pooled
+    connection, unless `max_waiting` is None. Consumption resumes once the
+    smoothed latency has dropped to `resume_latency` and the pool keeps up
+    again.
+
+    While paused, one message is let through per probe interval, so the
+    insert latency keeps being measured. No work piles up on pool checkouts.
+    The client keeps prefetching up to `pulsar.consumer.receiver_queue_size`
+    messages, though; only the messages beyond those stay with the broker,
+    where other consumers of a shared subscription can take them.
+    """
+
+    def __init__(
+        self,
+        max_latency: float,
+        resume_latency: float,
+        max_waiting: int | None,
+        probe_interval: float,
+        smoothing: float = 0.2,
+        log=None,
+    ):
+        """Initialize the controller in the unpaused state.
+
+        Args:
+            max_latency: The smoothed insert latency (seconds) that pauses consumption.
+            resume_latency: The smoothed insert latency (seconds) that resumes it.
+            max_waiting: The number of waiting pool requests that pauses
+                consumption, None to not pause on waiting requests.
+            probe_interval: The seconds between two messages while paused.
+            smoothing: The weight of a new latency in the moving average.
+            log: The logger to report pauses and resumes on.
+        """
+        self.max_latency = max_latency
+        self.resume_latency = resume_latency
+        self.max_waiting = max_waiting
+        self.probe_interval = probe_interval
+        self.smoothing = smoothing
+        self.log = log
+        self.latency = 0.0
+        self.paused = False
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        """Account for the duration of a database insert."""
+        with self._lock:
+            self.latency += self.smoothing * (seconds - self.latency)
+
+    def delay(self, waiting: int) -> float:
+        """Return how long to wait before receiving the next message.
+
+        Args:
+            waiting: The number of requests waiting for a pooled connection.
+        """
+        queued = self.max_waiting is not None and waiting > self.max_waiting
+        with self._lock:
+            if not self.paused and (self.latency > self.max_latency or queued):
+                self.paused = True
+                if self.log is not None:
+                    self.log.warning(
+                        f"Database saturated (insert latency {self.latency * 1000:.1f}ms, "
+                        f"{waiting} waiting for a connection), pausing consumption."
+                    )
+            elif self.paused and self.latency <= self.resume_latency and not queued:
+                self.paused = False
+                if self.log is not None:
+                    self.log.info(
+                        f"Database recovered (insert latency {self.latency * 1000:.1f}ms), resuming consumption."
+                    )
+            return self.probe_interval if self.paused else 0.0
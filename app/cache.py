@@ -0,0 +1,144 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter for strings.
+
+    A negative answer is definite, a positive answer may be a false positive
+    with (approximately) the configured error rate. The positions are derived
+    from the built-in string hash, which a string computes only once.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        """Size the filter for the expected number of items and error rate.
+
+        Args:
+            capacity: The expected number of items.
+            error_rate: The accepted false positive rate.
+        """
+        self.capacity = capacity
+        self.num_bits = max(
+            8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        )
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        # Double hashing on the two halves of the 64-bit hash.
+        digest = hash(item) & 0xFFFFFFFFFFFFFFFF
+        h1 = digest & 0xFFFFFFFF
+        h2 = (digest >> 32) | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, item: str):
+        """Add an item to the filter."""
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+    def clear(self):
+        """Remove all items from the filter."""
+        self.bits = bytearray(len(self.bits))
+        self.count = 0
+
+
+class CorrelationIdCache:
+    """Bounded cache of correlation_ids that are known to be registered.
+
+    Only correlation_ids that the database confirmed to exist may be added, so
+    a hit is always a real duplicate. Entries are evicted least recently used
+    first once the capacity is reached, and expire after the TTL.
+
+    An optional Bloom filter in front of the cache answers most misses without
+    touching the cache itself. Because a Bloom filter cannot forget items, it
+    is rebuilt from the cache once it has seen its capacity of additions. It
+    is sized for twice the cache, so a full cache is rebuilt at most once
+    every `capacity` additions.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        ttl_seconds: float | None = None,
+        bloom_filter_error_rate: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Initialize an empty cache.
+
+        Args:
+            capacity: The maximum number of correlation_ids to keep.
+            ttl_seconds: How long a correlation_id is kept, None to keep it until evicted.
+            bloom_filter_error_rate: The error rate of the Bloom filter, None to disable it.
+            clock: The time source for expiring entries.
+        """
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.bloom_filter = (
+            BloomFilter(2 * capacity, bloom_filter_error_rate)
+            if bloom_filter_error_rate
+            else None
+        )
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, correlation_id: str):
+        """Remember a correlation_id that the database confirmed to exist.
+
+        Args:
+            correlation_id: The registered correlation_id.
+        """
+        with self._lock:
+            self._entries[correlation_id] = self.clock()
+            self._entries.move_to_end(correlation_id)
+            if len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+            if self.bloom_filter is not None:
+                if self.bloom_filter.count >= self.bloom_filter.capacity:
+                    self.bloom_filter.clear()
+                    for key in self._entries:
+                        self.bloom_filter.add(key)
+                else:
+                    self.bloom_filter.add(correlation_id)
+
+    def __contains__(self, correlation_id: str) -> bool:
+        with self._lock:
+            found = self._lookup(correlation_id)
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return found
+
+    def _lookup(self, correlation_id: str) -> bool:
+        if self.bloom_filter is not None and correlation_id not in self.bloom_filter:
+            return False
+        added_at = self._entries.get(correlation_id)
+        if added_at is None:
+            return False
+        if self.ttl_seconds is not None and self.clock() - added_at > self.ttl_seconds:
+            del self._entries[correlation_id]
+            return False
+        self._entries.move_to_end(correlation_id)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict[str, int]:
+        """Return the hit and miss counters and the current size."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
@@ -0,0 +1,161 @@
+"""Fast decoding of incoming S3 notification events.
+
+Building a full CloudEvent for every message is relatively expensive, while
+only a few attributes and S3 fields are used. `decode_message` reads just
+those from the Pulsar message. It returns None for anything it doesn't
+recognise, so the caller can fall back to `PulsarBinding.from_protocol`,
+which also reports what is wrong with a malformed message.
+"""
+
+import json
+from datetime import UTC, datetime, timedelta
+
+from cloudevents.events import EventOutcome
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+    _DECODE_ERRORS: tuple[type[Exception], ...] = (orjson.JSONDecodeError,)
+except ImportError:  # pragma: no cover - orjson is an optional dependency
+    _loads = json.loads
+    _DECODE_ERRORS = (ValueError,)
+
+# Prefixes of the CloudEvent attributes in the properties of a binary mode
+# message. tests/test_decoding.py checks them against PulsarBinding.
+_PREFIXES = ("ce_", "ce-", "")
+_OUTCOMES = frozenset(outcome.value for outcome in EventOutcome)
+_EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+_MILLISECOND = timedelta(milliseconds=1)
+
+
+class LeanEvent:
+    """The subset of a CloudEvent that the registration needs.
+
+    It supports the methods of `cloudevents.events.Event` that the listener uses.
+    """
+
+    __slots__ = ("correlation_id", "data", "outcome", "subject", "time_ms")
+
+    def __init__(
+        self,
+        correlation_id: str,
+        subject: str | None,
+        outcome: str,
+        time_ms: int | None,
+        data: dict,
+    ):
+        self.correlation_id = correlation_id
+        self.subject = subject
+        self.outcome = outcome
+        self.time_ms = time_ms
+        self.data = data
+
+    def get_attributes(self) -> dict:
+        return {
+            "correlation_id": self.correlation_id,
+            "subject": self.subject,
+            "outcome": self.outcome,
+        }
+
+    def get_data(self) -> dict:
+        return self.data
+
+    def has_successful_outcome(self) -> bool:
+        return self.outcome == EventOutcome.SUCCESS.value
+
+    def get_event_time_as_int(self) -> int | None:
+        return self.time_ms
+
+
+def _attribute(source: dict, name: str):
+    for prefix in _PREFIXES:
+        value = source.get(f"{prefix}{name}")
+        if value is not None:
+            return value
+    return None
+
+
+def _time_ms(value) -> int | None:
+    """The milliseconds since the epoch of a CloudEvent time attribute.
+
+    Returns:
+        The time, None if it isn't an RFC 3339 timestamp with a time zone.
+    """
+    if not isinstance(value, str):
+        return None
+    try:
+        time = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if time.tzinfo is None:
+        return None
+    return (time - _EPOCH) // _MILLISECOND
+
+
+def _has_s3_fields(data: dict) -> bool:
+    try:
+        records = data["s3_message"]["Records"]
+        return bool(records) and all(
+            isinstance(value, str)
+            for record in records
+            for value in (
+                record["s3"]["bucket"]["name"],
+                record["s3"]["object"]["key"],
+                record["s3"]["domain"]["name"],
+            )
+        )
+    except (KeyError, TypeError):
+        return False
+
+
+def decode_message(msg) -> LeanEvent | None:
+    """Decode the attributes and data of an S3 notification event.
+
+    Both binary mode (attributes in the message properties) and structured
+    mode (attributes next to the data in the JSON body) are supported.
+
+    Args:
+        msg: The received Pulsar message.
+
+    Returns:
+        The decoded event, or None if the message must take the full decode
+        path, e.g. because it has no (valid) CloudEvent time.
+    """
+    try:
+        body = _loads(msg.data())
+    except _DECODE_ERRORS:
+        return None
+    if not isinstance(body, dict):
+        return None
+
+    properties = msg.properties()
+    attributes = properties
+    data = body
+    if _attribute(properties, "correlation_id") is None:
+        # Structured mode
+        attributes = body
+        data = body.get("data")
+        if not isinstance(data, dict):
+            return None
+
+    correlation_id = _attribute(attributes, "correlation_id")
+    outcome = _attribute(attributes, "outcome")
+    # The time of the CloudEvent, like the full decoder; the event timestamp
+    # of the Pulsar message may differ.
+    time_ms = _time_ms(_attribute(attributes, "time"))
+    if (
+        correlation_id is None
+        or outcome not in _OUTCOMES
+        or time_ms is None
+        or not _has_s3_fields(data)
+    ):
+        return None
+
+    return LeanEvent(
+        correlation_id=correlation_id,
+        subject=_attribute(attributes, "subject"),
+        outcome=outcome,
+        time_ms=time_ms,
+        data=data,
+    )
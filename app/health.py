@@ -0,0 +1,139 @@
+import json
+import threading
+import time
+from collections.abc import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A probe returns whether the process passes it, and details for humans.
+Probe = Callable[[], tuple[bool, dict]]
+
+
+class HealthCheck:
+    """Tracks the health of a listener for the liveness and readiness probes.
+
+    The listener is live as long as its receive loop keeps running. It is
+    ready once it has warmed up, while all of its dependencies are healthy
+    and, if configured, it handled a message recently enough.
+    """
+
+    def __init__(
+        self,
+        liveness_timeout: float,
+        max_message_age: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Initialize the health check of a listener that hasn't warmed up yet.
+
+        Args:
+            liveness_timeout: The seconds the receive loop may be silent.
+            max_message_age: The seconds since the last handled message after
+                which the listener is no longer ready, None to not check it.
+            clock: The time source.
+        """
+        self.liveness_timeout = liveness_timeout
+        self.max_message_age = max_message_age
+        self.clock = clock
+        self.checks: dict[str, Callable[[], bool]] = {}
+        self._started = clock()
+        self._ready = False
+        self._last_beat: float | None = None
+        self._last_message: float | None = None
+
+    def warmed_up(self):
+        """Mark the listener as ready to consume."""
+        self._ready = True
+        self._last_beat = self.clock()
+
+    def beat(self):
+        """Signal that the receive loop is still running."""
+        self._last_beat = self.clock()
+
+    def processed(self):
+        """Signal that a message was handled."""
+        self._last_message = self.clock()
+
+    def _age(self, timestamp: float | None) -> float | None:
+        return None if timestamp is None else round(self.clock() - timestamp, 3)
+
+    def liveness(self) -> tuple[bool, dict]:
+        """Whether the receive loop runs, or the listener is still warming up."""
+        last_beat = self._last_beat if self._last_beat is not None else self._started
+        live = self.clock() - last_beat <= self.liveness_timeout
+        return live, {"live": live, "seconds_since_heartbeat": self._age(last_beat)}
+
+    def readiness(self) -> tuple[bool, dict]:
+        """Whether the listener warmed up and its dependencies are healthy."""
+        details: dict = {"warmed_up": self._ready}
+        ready = self._ready
+        for name, check in self.checks.items():
+            try:
+                healthy = bool(check())
+            except Exception:
+                healthy = False
+            details[name] = healthy
+            ready = ready and healthy
+        details["seconds_since_message"] = self._age(self._last_message)
+        if self.max_message_age is not None:
+            last_message = (
+                self._last_message
+                if self._last_message is not None
+                else self._last_beat
+            )
+            recent = (
+                last_message is not None
+                and self.clock() - last_message <= self.max_message_age
+            )
+            ready = ready and recent
+        details["ready"] = ready
+        return ready, details
+
+
+def _handler(probes: dict[str, Probe]) -> type[BaseHTTPRequestHandler]:
+    class HealthHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            probe = probes.get(self.path.rstrip("/"))
+            if probe is None:
+                self.send_error(404)
+                return
+            healthy, details = probe()
+            body = json.dumps(details).encode()
+            self.send_response(200 if healthy else 503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Probes are frequent; don't log every request.
+            pass
+
+    return HealthHandler
+
+
+def start_health_server(
+    health_config: dict, liveness: Probe, readiness: Probe
+) -> ThreadingHTTPServer | None:
+    """Serve /health/live and /health/ready over HTTP on a daemon thread, if enabled.
+
+    A probe answers 200 when it passes and 503 when it doesn't, with its
+    details as JSON.
+
+    Args:
+        health_config: The `health` section of the configuration.
+        liveness: The liveness probe.
+        readiness: The readiness probe.
+
+    Returns:
+        The running server, None if it is disabled.
+    """
+    if not health_config.get("enabled", False):
+        return None
+    server = ThreadingHTTPServer(
+        (health_config.get("address", "0.0.0.0"), health_config.get("port", 8080)),
+        _handler({"/health/live": liveness, "/health/ready": readiness}),
+    )
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="health-server", daemon=True
+    ).start()
+    return server
@@ -0,0 +1,104 @@
+import itertools
+import threading
+import time
+from collections.abc import Callable
+
+# The outcomes counted in the summary line, in the order they are reported.
+_OUTCOMES = ("registered", "duplicates", "dropped", "failed")
+
+
+class SampledLog:
+    """Logs a sample of the per-message lines, within a rate limit.
+
+    Only every `sample_every`-th line is considered, and of those at most
+    `max_per_second` are logged. The message is only formatted (`%`-style)
+    when it is logged. Errors and failed outcomes must be logged on the
+    logger itself, so they are never dropped.
+    """
+
+    def __init__(
+        self,
+        log,
+        sample_every: int = 1,
+        max_per_second: float = 0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Initialize the sampler.
+
+        Args:
+            log: The logger to log the sampled lines on.
+            sample_every: Log one out of this many lines.
+            max_per_second: The maximum number of lines per second, 0 for no limit.
+            clock: The time source.
+        """
+        self.log = log
+        self.sample_every = max(1, sample_every)
+        self.max_per_second = max_per_second
+        self.clock = clock
+        self.suppressed = 0
+        self._seen = itertools.count()
+        self._tokens = float(max_per_second)
+        self._refilled = clock()
+        self._lock = threading.Lock()
+
+    def info(self, message: str, *args):
+        """Log a line at INFO level if it is sampled and within the rate limit."""
+        if self._admit():
+            self.log.info(message % args if args else message)
+
+    def _admit(self) -> bool:
+        sampled = next(self._seen) % self.sample_every == 0
+        with self._lock:
+            if sampled and self.max_per_second:
+                # Token bucket holding at most one second worth of lines.
+                now = self.clock()
+                self._tokens = min(
+                    self.max_per_second,
+                    self._tokens + (now - self._refilled) * self.max_per_second,
+                )
+                self._refilled = now
+                sampled = self._tokens >= 1
+                if sampled:
+                    self._tokens -= 1
+            if not sampled:
+                self.suppressed += 1
+        return sampled
+
+    def pop_suppressed(self) -> int:
+        """Return the number of lines suppressed since the previous call."""
+        with self._lock:
+            suppressed, self.suppressed = self.suppressed, 0
+        return suppressed
+
+
+class ThroughputSummary:
+    """Counts the outcomes of the handled messages for a periodic summary line."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._counts = dict.fromkeys(_OUTCOMES, 0)
+        self._since = clock()
+        self._lock = threading.Lock()
+
+    def count(self, outcome: str, amount: int = 1):
+        """Count an outcome: registered, duplicates, dropped or failed."""
+        with self._lock:
+            self._counts[outcome] += amount
+
+    def report(self, suppressed: int = 0) -> str:
+        """Describe the outcomes since the previous report and start a new interval.
+
+        Args:
+            suppressed: The number of log lines suppressed in the interval.
+        """
+        now = self.clock()
+        with self._lock:
+            counts, self._counts = self._counts, dict.fromkeys(_OUTCOMES, 0)
+            elapsed, self._since = now - self._since, now
+        handled = sum(counts.values())
+        rate = handled / elapsed if elapsed > 0 else 0.0
+        outcomes = ", ".join(f"{counts[outcome]} {outcome}" for outcome in _OUTCOMES)
+        return (
+            f"Handled {handled} in {elapsed:.0f}s ({rate:.1f}/s): {outcomes}; "
+            f"{suppressed} log lines suppressed."
+        )
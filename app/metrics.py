@@ -0,0 +1,256 @@
+import os
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    multiprocess,
+    start_http_server,
+)
+
+from app.profiling import current_trace
+
+# Set for the worker processes of a supervisor; they write their metrics to
+# this directory and the supervisor serves them together.
+MULTIPROCESS_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+# Several stages take well under a millisecond, so the buckets start lower
+# than the Prometheus defaults.
+_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+STAGE_SECONDS = Histogram(
+    "sip_delivery_registrator_stage_seconds",
+    "Time spent per message processing stage.",
+    ["stage"],
+    buckets=_BUCKETS,
+)
+MESSAGES = Counter(
+    "sip_delivery_registrator_messages_total",
+    "Handled incoming messages by outcome.",
+    ["outcome"],
+)
+ACK_REQUESTS = Counter(
+    "sip_delivery_registrator_ack_requests_total",
+    "Acknowledgements sent to the broker by kind.",
+    ["kind"],
+)
+ACKED_MESSAGES = Counter(
+    "sip_delivery_registrator_acked_messages_total",
+    "Messages covered by the acknowledgements sent to the broker.",
+)
+PENDING_ACKS = Gauge(
+    "sip_delivery_registrator_pending_acks",
+    "Handled messages whose acknowledgement is held back by the ack strategy.",
+)
+FAILED_MESSAGES = Counter(
+    "sip_delivery_registrator_failed_messages_total",
+    "Messages that could not be handled, by what was done with them.",
+    ["action"],
+)
+OUTGOING_EVENTS = Counter(
+    "sip_delivery_registrator_outgoing_events_total",
+    "Outgoing events by whether they were emitted or suppressed as already emitted.",
+    ["action"],
+)
+OUTBOX_RELAYED = Counter(
+    "sip_delivery_registrator_outbox_relayed_events_total",
+    "Outbox events the relay published and marked as sent.",
+)
+OUTBOX_BACKLOG = Gauge(
+    "sip_delivery_registrator_outbox_backlog",
+    "Outbox events that were not published yet, as last measured by the relay.",
+)
+OUTBOX_OLDEST = Gauge(
+    "sip_delivery_registrator_outbox_oldest_unsent_seconds",
+    "Age of the oldest outbox event that was not published yet, as last measured by the relay.",
+)
+REGISTRATION_LAG = Gauge(
+    "sip_delivery_registrator_registration_lag_seconds",
+    "Time between the incoming event and its registration, for the last registered event.",
+)
+
+
+class Stage:
+    """A processing stage, timed in the stage histogram.
+
+    While the profiler traces the current message, the time is also added
+    to its trace.
+    """
+
+    __slots__ = ("_histogram", "name")
+
+    def __init__(self, name: str):
+        self.name = name
+        # Bind the label once; looking it up per message isn't free.
+        self._histogram = STAGE_SECONDS.labels(name)
+
+    def observe(self, seconds: float):
+        self._histogram.observe(seconds)
+        trace = current_trace()
+        if trace is not None:
+            trace.add(self.name, seconds)
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+RECEIVE = Stage("receive")
+DECODE = Stage("decode")
+DB_INSERT = Stage("db_insert")
+PRODUCE = Stage("produce")
+ACK = Stage("ack")
+NACK = Stage("nack")
+OUTBOX_WRITE = Stage("outbox_write")
+RELAY = Stage("relay")
+
+SUCCESS = MESSAGES.labels("success")
+DUPLICATE = MESSAGES.labels("duplicate")
+DROPPED = MESSAGES.labels("dropped_non_successful")
+ERROR = MESSAGES.labels("error")
+
+NACKED = FAILED_MESSAGES.labels("nacked")
+RETRIED = FAILED_MESSAGES.labels("retried")
+DEAD_LETTERED = FAILED_MESSAGES.labels("dead_lettered")
+
+EMITTED = OUTGOING_EVENTS.labels("emitted")
+SUPPRESSED = OUTGOING_EVENTS.labels("suppressed")
+
+INDIVIDUAL_ACKS = ACK_REQUESTS.labels("individual")
+CUMULATIVE_ACKS = ACK_REQUESTS.labels("cumulative")
+NEGATIVE_ACKS = ACK_REQUESTS.labels("negative")
+
+# Computed when scraped; the owners of the cache and the pool set the functions.
+CACHE_HITS = Gauge(
+    "sip_delivery_registrator_cache_hits",
+    "Lookups of a correlation_id that was found in the cache.",
+)
+CACHE_MISSES = Gauge(
+    "sip_delivery_registrator_cache_misses",
+    "Lookups of a correlation_id that was not found in the cache.",
+)
+POOL_SIZE = Gauge(
+    "sip_delivery_registrator_pool_connections",
+    "Connections in the database connection pool.",
+)
+POOL_IN_USE = Gauge(
+    "sip_delivery_registrator_pool_connections_in_use",
+    "Connections of the database connection pool that are checked out.",
+)
+POOL_WAITING = Gauge(
+    "sip_delivery_registrator_pool_requests_waiting",
+    "Requests waiting for a connection of the database connection pool.",
+)
+BACKPRESSURE_PAUSED = Gauge(
+    "sip_delivery_registrator_backpressure_paused",
+    "Whether consumption is paused because the database is saturated.",
+)
+INSERT_LATENCY = Gauge(
+    "sip_delivery_registrator_insert_latency_seconds",
+    "Moving average of the database insert latency, as seen by the backpressure controller.",
+)
+
+_server_started = False
+
+
+def observe_registration(event_time_ms: int | None):
+    """Record the lag between an incoming event and its registration.
+
+    Args:
+        event_time_ms: The time of the incoming event in milliseconds since the epoch.
+    """
+    if event_time_ms:
+        REGISTRATION_LAG.set(time.time() - event_time_ms / 1000)
+
+
+def observe_pool(pool):
+    """Expose the gauges of a (sync or async) connection pool."""
+    POOL_SIZE.set_function(lambda: pool.get_stats().get("pool_size", 0))
+    POOL_IN_USE.set_function(
+        lambda: (
+            pool.get_stats().get("pool_size", 0)
+            - pool.get_stats().get("pool_available", 0)
+        )
+    )
+    POOL_WAITING.set_function(lambda: pool.get_stats().get("requests_waiting", 0))
+
+
+def start_metrics_server(metrics_config: dict) -> bool:
+    """Serve the metrics over HTTP if enabled, at most once per process.
+
+    Args:
+        metrics_config: The `metrics` section of the configuration.
+
+    Returns:
+        bool: Whether the server is running.
+    """
+    global _server_started
+    if not metrics_config.get("enabled", False):
+        return False
+    if os.environ.get(MULTIPROCESS_DIR_ENV):
+        # The supervisor serves the metrics of all worker processes.
+        return False
+    if not _server_started:
+        start_http_server(
+            metrics_config.get("port", 8000), metrics_config.get("address", "0.0.0.0")
+        )
+        _server_started = True
+    return True
+
+
+def start_multiprocess_metrics_server(metrics_config: dict, collector) -> bool:
+    """Serve the metrics of all worker processes together, if enabled.
+
+    Counters and histograms are summed over the workers and gauges are
+    reported per worker. Gauges computed when scraped (cache and pool) are
+    only available in single process mode.
+
+    Args:
+        metrics_config: The `metrics` section of the configuration.
+        collector: Reports metrics of the supervisor itself.
+
+    Returns:
+        bool: Whether the server is running.
+    """
+    if not metrics_config.get("enabled", False):
+        return False
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(collector)
+    start_http_server(
+        metrics_config.get("port", 8000),
+        metrics_config.get("address", "0.0.0.0"),
+        registry=registry,
+    )
+    return True
+
+
+def mark_process_dead(pid: int | None):
+    """Drop the live gauges of a worker process that exited."""
+    if pid is not None and os.environ.get(MULTIPROCESS_DIR_ENV):
+        multiprocess.mark_process_dead(pid)
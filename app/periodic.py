@@ -0,0 +1,41 @@
+import threading
+from collections.abc import Callable
+
+
+class PeriodicTask:
+    """Runs a function at a fixed interval on a daemon thread.
+
+    Exceptions raised by the function are logged and don't stop the task.
+    """
+
+    def __init__(self, interval: float, function: Callable[[], None], name: str, log):
+        """Initialize the task without starting it.
+
+        Args:
+            interval: The number of seconds between two runs.
+            function: The function to run.
+            name: The name of the thread, also used in log messages.
+            log: The logger to report errors on.
+        """
+        self.interval = interval
+        self.function = function
+        self.name = name
+        self.log = log
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.function()
+            except Exception as e:
+                self.log.error(f"Error in periodic task {self.name}: {e}")
+
+    def start(self) -> "PeriodicTask":
+        """Start running the function; returns the task itself."""
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop running the function after the current run, if any."""
+        self._stopped.set()
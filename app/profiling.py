@@ -0,0 +1,388 @@
+"""On-demand profiling of a running listener.
+
+A capture is started by a signal or an HTTP request and runs for a bounded
+time. It samples the stacks of all threads into a flamegraph-compatible
+folded stack dump and, in `cprofile` mode, runs cProfile on the receive
+loop. While it runs, it also times every message per stage and reports the
+slowest ones. While no capture runs, the hooks in the message path only
+check an attribute or a context variable.
+"""
+
+import cProfile
+import heapq
+import io
+import itertools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+_MODES = ("sample", "cprofile")
+# The seconds a capture waits for the receive loop to stop cProfile.
+_CPROFILE_STOP_TIMEOUT = 10
+
+# The trace of the message being handled, in this thread or asyncio task.
+_TRACE: ContextVar["MessageTrace | None"] = ContextVar("message_trace", default=None)
+
+_IDLE = nullcontext()
+
+
+def current_trace() -> "MessageTrace | None":
+    """The trace of the message being handled, None while no capture runs."""
+    return _TRACE.get()
+
+
+class MessageTrace:
+    """The time a message spent in total and in each stage."""
+
+    __slots__ = ("elapsed", "label", "stages")
+
+    def __init__(self, label: str):
+        self.label = label
+        self.stages: dict[str, float] = {}
+        self.elapsed = 0.0
+
+    def add(self, stage: str, seconds: float):
+        """Account time spent in a stage."""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def describe(self) -> str:
+        """One line with the total and the per-stage times in milliseconds."""
+        other = self.elapsed - sum(self.stages.values())
+        stages = ", ".join(
+            f"{stage}={seconds * 1000:.1f}ms"
+            for stage, seconds in sorted(self.stages.items(), key=lambda item: -item[1])
+        )
+        return f"{self.elapsed * 1000:.1f}ms {self.label}: {stages or 'no stages'}, other={other * 1000:.1f}ms"
+
+
+class _TimedMessage:
+    """Traces a message while it is handled; see Profiler.timed_message."""
+
+    __slots__ = ("slowest", "started", "token", "trace")
+
+    def __init__(self, slowest: "SlowestMessages", label: str):
+        self.slowest = slowest
+        self.trace = MessageTrace(label)
+
+    def __enter__(self) -> MessageTrace:
+        self.token = _TRACE.set(self.trace)
+        self.started = time.perf_counter()
+        return self.trace
+
+    def __exit__(self, *exc_info):
+        self.trace.elapsed = time.perf_counter() - self.started
+        _TRACE.reset(self.token)
+        self.slowest.add(self.trace)
+
+
+class SlowestMessages:
+    """Keeps the N slowest traced messages."""
+
+    def __init__(self, count: int):
+        self.count = count
+        self._heap: list[tuple[float, int, MessageTrace]] = []
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, trace: MessageTrace):
+        entry = (trace.elapsed, next(self._order), trace)
+        with self._lock:
+            if len(self._heap) < self.count:
+                heapq.heappush(self._heap, entry)
+            elif entry > self._heap[0]:
+                heapq.heapreplace(self._heap, entry)
+
+    def slowest(self) -> list[MessageTrace]:
+        """The kept messages, the slowest first."""
+        with self._lock:
+            return [trace for _, _, trace in sorted(self._heap, reverse=True)]
+
+
+def _folded_stack(frame) -> str:
+    """The stack of a frame, outermost first, in the folded format of flamegraph.pl."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _sample_stacks(stacks: Counter, skip: int):
+    """Count the current stack of every thread but `skip`, prefixed with the thread name."""
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    for ident, frame in sys._current_frames().items():
+        if ident != skip:
+            stacks[f"{names.get(ident, ident)};{_folded_stack(frame)}"] += 1
+
+
+def _sample_report(stacks: Counter, top: int = 30) -> str:
+    """The functions that were sampled most, on top of the stack and anywhere in it."""
+    total = sum(stacks.values())
+    own: Counter = Counter()
+    inclusive: Counter = Counter()
+    for stack, count in stacks.items():
+        functions = stack.split(";")[1:]
+        if functions:
+            own[functions[-1]] += count
+        for function in set(functions):
+            inclusive[function] += count
+    lines = [f"{total} samples of all threads."]
+    for title, counts in (("Own samples", own), ("Inclusive samples", inclusive)):
+        lines.append(f"\n{title}:")
+        lines.extend(
+            f"{count:8d} {count / total:6.1%}  {function}"
+            for function, count in counts.most_common(top)
+        )
+    return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    """Captures a profile of the listener on demand.
+
+    A capture samples the stacks of all threads every `sample_interval_ms`
+    for `duration_seconds`. In `cprofile` mode, the receive loop also runs
+    under cProfile, from its first iteration after the trigger until its
+    first after the capture ended; with several workers, cProfile only
+    sees the receive thread. Only one capture runs at a time.
+    """
+
+    def __init__(self, profiling_config: dict, log):
+        """Initialize an idle profiler.
+
+        Args:
+            profiling_config: The `profiling` section of the configuration.
+            log: The logger to report the captures on.
+        """
+        self.enabled = profiling_config.get("enabled", False)
+        self.mode = profiling_config.get("mode", "sample")
+        if self.mode not in _MODES:
+            raise ValueError(f"Unknown profiling mode: {self.mode}")
+        self.duration = profiling_config.get("duration_seconds", 30)
+        self.sample_interval = profiling_config.get("sample_interval_ms", 10) / 1000
+        self.output_dir = Path(
+            profiling_config.get("output_dir", "/tmp/sip-delivery-registrator-profiles")
+        )
+        self.slowest_count = profiling_config.get("slowest_messages", 10)
+        self.log = log
+        self._lock = threading.Lock()
+        self._running = False
+        self._slowest: SlowestMessages | None = None
+        # Set while the receive loop must run under cProfile.
+        self._cprofile_until: float | None = None
+        self._cprofile: cProfile.Profile | None = None
+        self._cprofile_done = threading.Event()
+
+    def trigger(
+        self, mode: str | None = None, duration: float | None = None
+    ) -> str | None:
+        """Start a capture, unless one is running.
+
+        Args:
+            mode: `sample` or `cprofile`, `profiling.mode` by default.
+            duration: The seconds to capture, `profiling.duration_seconds` by default.
+
+        Returns:
+            The name of the capture, None if a capture is running already.
+
+        Raises:
+            ValueError: If the mode is unknown.
+        """
+        mode = mode or self.mode
+        if mode not in _MODES:
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        duration = duration or self.duration
+        # Don't block: a signal handler may interrupt a thread holding the lock.
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            if self._running:
+                return None
+            self._running = True
+        finally:
+            self._lock.release()
+        if mode == "cprofile" and self._cprofile_until is not None:
+            self.log.error("cProfile of a previous capture is still running.")
+            mode = "sample"
+        # Start tracing right away; the capture thread stops it.
+        if self.slowest_count > 0:
+            self._slowest = SlowestMessages(self.slowest_count)
+        if mode == "cprofile":
+            self._cprofile_done.clear()
+            self._cprofile_until = time.monotonic() + duration
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{mode}"
+        self.log.info(f"Profiling for {duration}s in {mode} mode as {name}.")
+        threading.Thread(
+            target=self._capture,
+            args=(name, mode, duration),
+            name="profiler",
+            daemon=True,
+        ).start()
+        return name
+
+    def checkpoint(self):
+        """Start or stop cProfile on the calling loop; called on every iteration."""
+        if self._cprofile_until is None:
+            return
+        # The capture may give up on the loop at the same time.
+        with self._lock:
+            if self._cprofile_until is None:
+                return
+            if self._cprofile is None:
+                self._cprofile = cProfile.Profile()
+                self._cprofile.enable()
+            elif time.monotonic() >= self._cprofile_until:
+                self._cprofile.disable()
+                self._cprofile_until = None
+                self._cprofile_done.set()
+
+    def timed_message(self, label: str = "message"):
+        """A context manager that traces a message while a capture runs.
+
+        The stage timings of the metrics are added to the trace, which the
+        context manager returns; None while no capture runs. A message
+        handled within another traced message is part of that one.
+
+        Args:
+            label: Describes the message in the report.
+        """
+        slowest = self._slowest
+        if slowest is None or _TRACE.get() is not None:
+            return _IDLE
+        return _TimedMessage(slowest, label)
+
+    def _capture(self, name: str, mode: str, duration: float):
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            stacks: Counter = Counter()
+            deadline = time.monotonic() + duration
+            me = threading.get_ident()
+            while time.monotonic() < deadline:
+                _sample_stacks(stacks, me)
+                time.sleep(self.sample_interval)
+            slowest, self._slowest = self._slowest, None
+            self._write(
+                name,
+                "folded",
+                "".join(f"{stack} {count}\n" for stack, count in stacks.items()),
+            )
+            self._write(
+                name,
+                "samples.txt",
+                _sample_report(stacks) if stacks else "No samples.\n",
+            )
+            if mode == "cprofile":
+                self._write_cprofile(name)
+            if slowest is not None:
+                self._report_slowest(name, slowest.slowest())
+            self.log.info(f"Profile {name} written to {self.output_dir}.")
+        except Exception as e:
+            self.log.error(f"Error while profiling: {e}")
+        finally:
+            self._slowest = None
+            with self._lock:
+                self._running = False
+
+    def _write_cprofile(self, name: str):
+        # The loop stops cProfile on its next iteration; it may be waiting
+        # for a message, or not be running at all.
+        if not self._cprofile_done.wait(_CPROFILE_STOP_TIMEOUT):
+            with self._lock:
+                # Give up on the loop, so a later capture starts afresh.
+                stale, self._cprofile = self._cprofile, None
+                self._cprofile_until = None
+            if stale is not None:
+                stale.disable()
+            self.log.error("The receive loop did not stop cProfile; no cProfile stats.")
+            return
+        profile, self._cprofile = self._cprofile, None
+        profile.dump_stats(self.output_dir / f"{name}.prof")
+        report = io.StringIO()
+        pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(50)
+        self._write(name, "cprofile.txt", report.getvalue())
+
+    def _report_slowest(self, name: str, slowest: list[MessageTrace]):
+        lines = [trace.describe() for trace in slowest]
+        self._write(name, "slowest.txt", "".join(f"{line}\n" for line in lines))
+        self.log.info(f"Slowest {len(lines)} messages of profile {name}:")
+        for line in lines:
+            self.log.info(line)
+
+    def _write(self, name: str, suffix: str, content: str):
+        (self.output_dir / f"{name}.{suffix}").write_text(content, encoding="utf-8")
+
+
+def _handler(profiler: Profiler) -> type[BaseHTTPRequestHandler]:
+    class ProfileHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            url = urlsplit(self.path)
+            if url.path.rstrip("/") != "/profile":
+                self.send_error(404)
+                return
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            try:
+                name = profiler.trigger(
+                    query.get("mode"),
+                    float(query["seconds"]) if "seconds" in query else None,
+                )
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            status = 202 if name is not None else 409
+            body = json.dumps(
+                {
+                    "started": name is not None,
+                    "name": name,
+                    "output_dir": str(profiler.output_dir),
+                }
+            ).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # The capture itself is logged.
+            pass
+
+    return ProfileHandler
+
+
+def start_profiling_server(
+    profiling_config: dict, profiler: Profiler
+) -> ThreadingHTTPServer | None:
+    """Start a capture on POST /profile over HTTP on a daemon thread, if enabled.
+
+    The optional query parameters `mode` and `seconds` override the
+    configured mode and duration. It answers 202 when the capture started
+    and 409 when one is running already.
+
+    Args:
+        profiling_config: The `profiling` section of the configuration.
+        profiler: The profiler to trigger.
+
+    Returns:
+        The running server, None if it is disabled.
+    """
+    http_config = profiling_config.get("http", {})
+    if not (profiler.enabled and http_config.get("enabled", False)):
+        return None
+    server = ThreadingHTTPServer(
+        (http_config.get("address", "127.0.0.1"), http_config.get("port", 8082)),
+        _handler(profiler),
+    )
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="profiling-server", daemon=True
+    ).start()
+    return server
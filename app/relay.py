@@ -0,0 +1,159 @@
+import signal
+import threading
+
+from cloudevents.events import (
+    CEMessageMode,
+    Event,
+    EventAttributes,
+    EventOutcome,
+    PulsarBinding,
+)
+from pulsar import Client, Result
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+from app import APP_NAME, metrics
+from app.periodic import PeriodicTask
+from app.services.db import DbClient
+from app.services.pulsar import _producer_settings
+
+
+class OutboxRelay:
+    """Publishes the outgoing events that the listener wrote to the outbox.
+
+    The oldest unsent rows are published in batches on the producer topic
+    and marked as sent once the broker persisted them. Rows that failed are
+    published again with a later batch. Several relays can run at the same
+    time; they lock the rows they publish.
+    """
+
+    def __init__(self):
+        """Initialize the relay with its own database and Pulsar clients."""
+        self.config_parser = ConfigParser()
+        self.config = self.config_parser.app_cfg
+        self.log = logging.get_logger(__name__, config=self.config_parser)
+        outbox_config = self.config["db"].get("outbox", {})
+        self.batch_size = outbox_config.get("batch_size", 500)
+        self.poll_interval = outbox_config.get("poll_interval_ms", 500) / 1000
+        self.keep_sent_hours = outbox_config.get("keep_sent_hours", 24)
+        self.stats_interval = outbox_config.get("stats_interval", 10)
+        self.send_timeout = (
+            self.config["pulsar"].get("producer", {}).get("send_timeout_ms", 30_000)
+            / 1000
+        )
+        self._stopping = threading.Event()
+
+        self.db_client = DbClient(self.config_parser)
+        self.db_client.create_outbox()
+        pulsar_config = self.config["pulsar"]
+        self.topic = pulsar_config["producer_topic"]
+        self.client = Client(
+            f"pulsar://{pulsar_config['host']}:{pulsar_config['port']}"
+        )
+        self.producer = self.client.create_producer(
+            self.topic, **_producer_settings(pulsar_config.get("producer", {}))
+        )
+
+    def stop(self):
+        """Stop relaying after the current batch."""
+        self._stopping.set()
+
+    def _publish(self, rows: list[tuple]) -> list[int]:
+        """Publish outbox rows and wait for the broker.
+
+        Returns:
+            The ids of the rows the broker persisted.
+        """
+        sent: list[int] = []
+        completed = threading.Semaphore(0)
+
+        def on_send(row_id: int):
+            def callback(result: Result, msg_id):
+                # An exception escaping a send callback terminates the process.
+                if result == Result.Ok:
+                    sent.append(row_id)
+                else:
+                    self.log.error(f"Failed to relay outbox event {row_id}: {result}")
+                completed.release()
+
+            return callback
+
+        for row_id, correlation_id, subject, outcome, data, time in rows:
+            # The event carries the time of the registration, not of the relay.
+            event = Event(
+                EventAttributes(
+                    type=self.topic,
+                    source=APP_NAME,
+                    subject=subject,
+                    correlation_id=correlation_id,
+                    outcome=EventOutcome(outcome),
+                    time=time.isoformat(),
+                ),
+                data,
+            )
+            msg = PulsarBinding.to_protocol(event, CEMessageMode.STRUCTURED)
+            self.producer.send_async(
+                msg.data,
+                on_send(row_id),
+                properties=msg.attributes,
+                partition_key=correlation_id,
+                event_timestamp=event.get_event_time_as_int(),
+            )
+        self.producer.flush()
+        for _ in rows:
+            if not completed.acquire(timeout=self.send_timeout):
+                self.log.error("Timed out waiting for the broker.")
+                break
+        return list(sent)
+
+    def relay_batch(self) -> int:
+        """Publish one batch of unsent outbox rows.
+
+        Returns:
+            The number of published rows.
+        """
+        with metrics.RELAY.time():
+            sent = self.db_client.relay_outbox(self.batch_size, self._publish)
+        metrics.OUTBOX_RELAYED.inc(sent)
+        return sent
+
+    def observe_backlog(self):
+        """Measure and log the unsent rows, and clean up the old sent ones."""
+        count, age = self.db_client.outbox_backlog()
+        metrics.OUTBOX_BACKLOG.set(count)
+        metrics.OUTBOX_OLDEST.set(age)
+        deleted = (
+            self.db_client.delete_sent_outbox(self.keep_sent_hours)
+            if self.keep_sent_hours
+            else 0
+        )
+        self.log.info(
+            f"Outbox backlog: {count} unsent events, the oldest {age:.1f}s old; "
+            f"deleted {deleted} sent events."
+        )
+
+    def run(self):
+        """Relay until SIGTERM or SIGINT is received, then close the clients."""
+        metrics.start_metrics_server(self.config.get("metrics", {}))
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: self.stop())
+        stats_task = PeriodicTask(
+            self.stats_interval, self.observe_backlog, "outbox-stats", self.log
+        ).start()
+        self.log.info(f"Relaying the outbox {self.db_client.outbox_table}.")
+        try:
+            while not self._stopping.is_set():
+                try:
+                    full = self.relay_batch() >= self.batch_size
+                except Exception as e:
+                    self.log.error(f"Error: {e}")
+                    full = False
+                # Keep going while there is a backlog, poll otherwise.
+                if not full:
+                    self._stopping.wait(self.poll_interval)
+        finally:
+            stats_task.stop()
+            self.producer.close()
+            self.client.close()
+            self.db_client.close()
+            self.log.info("Shut down.")
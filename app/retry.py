@@ -0,0 +1,120 @@
+import heapq
+import itertools
+import threading
+import time
+from collections.abc import Callable
+
+from psycopg import DataError, IntegrityError
+
+
+class InvalidMessageError(Exception):
+    """Error for a message whose content can't be registered, e.g. missing S3 fields."""
+
+
+# Errors that a redelivery cannot fix: invalid messages and rows the database
+# refuses. Anything else (lost connections, pool timeouts, failed produces,
+# but also bugs) counts as transient.
+PERMANENT_ERRORS: tuple[type[Exception], ...] = (
+    InvalidMessageError,
+    DataError,
+    IntegrityError,
+)
+
+
+def is_permanent(error: Exception | None) -> bool:
+    """Check whether retrying the message that raised the error is pointless."""
+    return isinstance(error, PERMANENT_ERRORS)
+
+
+class RetryPolicy:
+    """Exponential backoff with a maximum number of attempts."""
+
+    def __init__(
+        self,
+        max_attempts: int,
+        initial_backoff: float,
+        max_backoff: float,
+        multiplier: float = 2.0,
+    ):
+        """Initialize the policy.
+
+        Args:
+            max_attempts: The number of attempts before a message is dead-lettered.
+            initial_backoff: The seconds to wait before the first retry.
+            max_backoff: The maximum seconds to wait before a retry.
+            multiplier: The factor the backoff grows with per attempt.
+        """
+        self.max_attempts = max_attempts
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.multiplier = multiplier
+
+    def should_retry(self, attempt: int, error: Exception | None) -> bool:
+        """Check whether a failed attempt (counting from 1) deserves another one."""
+        return attempt < self.max_attempts and not is_permanent(error)
+
+    def backoff(self, attempt: int) -> float:
+        """The seconds to wait before retrying after the given failed attempt."""
+        return min(
+            self.max_backoff, self.initial_backoff * self.multiplier ** (attempt - 1)
+        )
+
+
+class Scheduler:
+    """Runs functions after a delay, in order of their due time, on one daemon thread.
+
+    Exceptions raised by the functions are logged and don't stop the scheduler.
+    """
+
+    def __init__(self, name: str, log, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.log = log
+        self.clock = clock
+        self._due: list[tuple[float, int, Callable[[], None]]] = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def call_later(self, delay: float, function: Callable[[], None]):
+        """Run a function after `delay` seconds."""
+        with self._condition:
+            heapq.heappush(
+                self._due, (self.clock() + delay, next(self._order), function)
+            )
+            self._condition.notify()
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (
+                    not self._due or self._due[0][0] > self.clock()
+                ):
+                    self._condition.wait(
+                        self._due[0][0] - self.clock() if self._due else None
+                    )
+                if self._stopped:
+                    return
+                _, _, function = heapq.heappop(self._due)
+            try:
+                function()
+            except Exception as e:
+                self.log.error(f"Error in scheduled task {self.name}: {e}")
+
+    def close(self, run_pending: bool = True):
+        """Stop the scheduler, running the pending functions right away if requested."""
+        with self._condition:
+            self._stopped = True
+            pending = [function for _, _, function in sorted(self._due)]
+            self._due.clear()
+            self._condition.notify()
+        if run_pending:
+            for function in pending:
+                try:
+                    function()
+                except Exception as e:
+                    self.log.error(f"Error in scheduled task {self.name}: {e}")
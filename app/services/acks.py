@@ -0,0 +1,242 @@
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from app import metrics
+from app.periodic import PeriodicTask
+
+# Cumulative acknowledgements are only allowed on these subscription types.
+_CUMULATIVE_SUBSCRIPTION_TYPES = ("Exclusive", "Failover")
+
+_PENDING = 0
+_ACKED = 1
+_NACKED = 2
+
+
+def _message_key(msg) -> tuple[int, int, int]:
+    # The message ids of the client are not hashable.
+    msg_id = msg.message_id()
+    return (msg_id.ledger_id(), msg_id.entry_id(), msg_id.batch_index())
+
+
+class Acknowledger:
+    """Acknowledges every message individually, right away."""
+
+    def __init__(self, consumer):
+        self.consumer = consumer
+
+    def track(self, msg):
+        """Register a received message, in the order in which it was received."""
+
+    def acknowledge(self, msg):
+        self.consumer.acknowledge(msg)
+        metrics.INDIVIDUAL_ACKS.inc()
+        metrics.ACKED_MESSAGES.inc()
+
+    def negative_acknowledge(self, msg):
+        self.consumer.negative_acknowledge(msg)
+        metrics.NEGATIVE_ACKS.inc()
+
+    def flush(self):
+        """Send the acknowledgements that are held back."""
+
+    def close(self):
+        """Send the acknowledgements that are held back and stop flushing."""
+        self.flush()
+
+
+class _HoldingAcknowledger(Acknowledger, ABC):
+    """Holds back acknowledgements until enough are waiting or the delay passed."""
+
+    def __init__(self, consumer, max_count: int, max_delay_ms: int, log):
+        """Initialize the acknowledger and start flushing periodically.
+
+        Args:
+            consumer: The consumer of the messages.
+            max_count: The number of waiting acknowledgements that triggers a flush.
+            max_delay_ms: The maximum time an acknowledgement is held back.
+            log: The logger to report flush errors on.
+        """
+        super().__init__(consumer)
+        self.max_count = max_count
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self._flush_task = PeriodicTask(
+            max_delay_ms / 1000, self.flush, "ack-flush", log
+        ).start()
+
+    def acknowledge(self, msg):
+        with self._lock:
+            if not self._hold(msg):
+                super().acknowledge(msg)
+                return
+            self._waiting += 1
+            metrics.PENDING_ACKS.inc()
+            if self._waiting >= self.max_count:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self._flush_task.stop()
+        self.flush()
+
+    @abstractmethod
+    def _hold(self, msg) -> bool:
+        """Hold back the acknowledgement; False if it must be sent right away."""
+
+    @abstractmethod
+    def _flush(self):
+        """Send the held back acknowledgements; called with the lock held."""
+
+    def _sent(self, count: int):
+        """Account for held back acknowledgements that were sent."""
+        self._waiting -= count
+        metrics.PENDING_ACKS.dec(count)
+        metrics.ACKED_MESSAGES.inc(count)
+
+
+class GroupedAcknowledger(_HoldingAcknowledger):
+    """Sends the acknowledgements in groups, by count or by time.
+
+    The acknowledgements are still individual, but the client combines the
+    ones sent together into fewer requests, and the handling of a message no
+    longer waits for its acknowledgement.
+    """
+
+    def __init__(self, consumer, max_count: int, max_delay_ms: int, log):
+        self._held: list = []
+        super().__init__(consumer, max_count, max_delay_ms, log)
+
+    def _hold(self, msg) -> bool:
+        self._held.append(msg)
+        return True
+
+    def _flush(self):
+        held, self._held = self._held, []
+        for msg in held:
+            self.consumer.acknowledge(msg)
+        metrics.INDIVIDUAL_ACKS.inc(len(held))
+        self._sent(len(held))
+
+
+class CumulativeAcknowledger(_HoldingAcknowledger):
+    """Acknowledges cumulatively, up to the last contiguous handled message.
+
+    The messages are tracked per partition in the order in which they were
+    received. A flush acknowledges the longest prefix of handled messages with
+    a single cumulative acknowledgement.
+
+    A negatively acknowledged message blocks the prefix until its redelivery
+    is acknowledged; a cumulative acknowledgement beyond it would drop it.
+    In the meantime the handled messages behind it are acknowledged
+    individually, so they are not redelivered. So are the ones behind a
+    message that is still pending, such as one waiting to be retried, once
+    `max_count` acknowledgements are held back.
+    """
+
+    def __init__(self, consumer, max_count: int, max_delay_ms: int, log):
+        self._partitions: dict[int, OrderedDict[tuple, list]] = {}
+        super().__init__(consumer, max_count, max_delay_ms, log)
+
+    def track(self, msg):
+        with self._lock:
+            received = self._partitions.setdefault(
+                msg.message_id().partition(), OrderedDict()
+            )
+            entry = received.get(_message_key(msg))
+            if entry is None:
+                received[_message_key(msg)] = [_PENDING, msg]
+            else:
+                # A redelivery keeps the position of the original message.
+                entry[:] = [_PENDING, msg]
+
+    def _entry(self, msg) -> list | None:
+        received = self._partitions.get(msg.message_id().partition())
+        return None if received is None else received.get(_message_key(msg))
+
+    def _hold(self, msg) -> bool:
+        entry = self._entry(msg)
+        if entry is None:
+            # Not received through this client; nothing to keep in order.
+            return False
+        entry[:] = [_ACKED, msg]
+        return True
+
+    def negative_acknowledge(self, msg):
+        with self._lock:
+            entry = self._entry(msg)
+            if entry is not None:
+                entry[0] = _NACKED
+        super().negative_acknowledge(msg)
+
+    def _flush(self):
+        for received in self._partitions.values():
+            last = None
+            count = 0
+            while received:
+                key, (state, msg) = next(iter(received.items()))
+                if state != _ACKED:
+                    break
+                del received[key]
+                last = msg
+                count += 1
+            if last is not None:
+                self.consumer.acknowledge_cumulative(last)
+                metrics.CUMULATIVE_ACKS.inc()
+                self._sent(count)
+
+            # Don't hold back more than max_count behind a message that
+            # stays pending, so each flush handles a bounded number of them.
+            if received and (
+                next(iter(received.values()))[0] == _NACKED
+                or self._waiting >= self.max_count
+            ):
+                handled = [
+                    key for key, (state, _) in received.items() if state == _ACKED
+                ]
+                for key in handled:
+                    self.consumer.acknowledge(received.pop(key)[1])
+                metrics.INDIVIDUAL_ACKS.inc(len(handled))
+                self._sent(len(handled))
+
+
+def build_acknowledger(
+    consumer, ack_config: dict, subscription_type: str, log
+) -> Acknowledger:
+    """Build the acknowledger for the configured ack strategy.
+
+    Args:
+        consumer: The consumer of the messages.
+        ack_config: The `pulsar.ack` section of the configuration.
+        subscription_type: The type of the consumer's subscription.
+        log: The logger.
+
+    Raises:
+        ValueError: If the strategy is unknown.
+    """
+    strategy = ack_config.get("strategy", "individual")
+    cumulative_allowed = subscription_type in _CUMULATIVE_SUBSCRIPTION_TYPES
+    if strategy == "cumulative" and not cumulative_allowed:
+        log.warning(
+            f"Cumulative acks are not allowed on a {subscription_type} subscription, grouping them instead."
+        )
+        strategy = "grouped"
+
+    if strategy == "individual":
+        return Acknowledger(consumer)
+    acknowledgers = {
+        "grouped": GroupedAcknowledger,
+        "cumulative": CumulativeAcknowledger,
+    }
+    if strategy not in acknowledgers:
+        raise ValueError(f"Unknown ack strategy: {strategy}")
+    log.info(f"Using {strategy} acks.")
+    return acknowledgers[strategy](
+        consumer,
+        ack_config.get("max_count", 100),
+        ack_config.get("max_delay_ms", 100),
+        log,
+    )
@@ -1,13 +1,22 @@
 # Standard
+from abc import ABC, abstractmethod
+from collections import Counter
+from collections.abc import Callable
 from dataclasses import dataclass, field
 from datetime import UTC, datetime
 from enum import StrEnum
+from uuid import UUID
 
 from psycopg.errors import UniqueViolation
-from psycopg_pool import ConnectionPool
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
 from viaa.configuration import ConfigParser
 from viaa.observability import logging
 
+from app import metrics
+from app.periodic import PeriodicTask
+from app.services.partitions import PartitionManager
+
 
 class SipStatus(StrEnum):
     IN_PROGRESS = "in_progress"
@@ -15,7 +24,7 @@ class SipStatus(StrEnum):
     FAILURE = "failure"
 
 
-@dataclass
+@dataclass(slots=True)
 class SipDelivery:
     correlation_id: str
     s3_bucket: str
@@ -28,6 +37,41 @@ class SipDelivery:
     last_event_occurred_at: datetime = field(default_factory=lambda: datetime.now(UTC))
 
 
+@dataclass(slots=True)
+class RegistrationResult:
+    """Outcome of registering a SIP delivery.
+
+    Attributes:
+        inserted: Whether a new record was inserted.
+        existing: The already registered delivery with the same correlation_id,
+            if it was not inserted and the existing record was requested.
+            The S3 domain is not stored, so it is left empty.
+    """
+
+    inserted: bool
+    existing: SipDelivery | None = field(default=None)
+
+
+@dataclass(slots=True)
+class OutboxEvent:
+    """An outgoing event, written to the outbox to be published by the relay.
+
+    Attributes:
+        correlation_id: The correlation_id of the event.
+        subject: The subject of the event.
+        outcome: The value of the EventOutcome of the event.
+        data: The payload of the event.
+        time: When the event occurred, the time of the registration attempt.
+            The relay publishes the event with this time, however late.
+    """
+
+    correlation_id: str
+    subject: str | None
+    outcome: str
+    data: dict
+    time: datetime = field(default_factory=lambda: datetime.now(UTC))
+
+
 class DuplicateKeyError(Exception):
     """Error when inserting with a duplicate key (correlation_id)
 
@@ -37,15 +81,340 @@ class DuplicateKeyError(Exception):
     pass
 
 
-class DbClient:
+def _conninfo(db_config: dict) -> str:
+    return f"host={db_config['host']} port={db_config['port']} dbname={db_config['dbname']} user={db_config['username']} password={db_config['password']}"
+
+
+def _pool_kwargs(db_config: dict) -> dict:
+    """The sizing, lifetime and timeout settings for the connection pool."""
+    pool_config = db_config.get("pool", {})
+    return {
+        key: pool_config[key]
+        for key in (
+            "min_size",
+            "max_size",
+            "timeout",
+            "max_waiting",
+            "max_idle",
+            "max_lifetime",
+        )
+        if key in pool_config
+    }
+
+
+def _start_partition_maintenance(
+    config_parser: ConfigParser, log
+) -> PeriodicTask | None:
+    """Maintain the partitions of the table if `db.partitioning` is enabled.
+
+    The first maintenance runs right away, so the current partitions exist
+    before anything is inserted; the next ones every `check_interval_hours`.
+    """
+    db_config = config_parser.app_cfg["db"]
+    partitioning_config = db_config.get("partitioning", {})
+    if not partitioning_config.get("enabled", False):
+        return None
+    manager = PartitionManager(
+        _conninfo(db_config), db_config["table"], partitioning_config, log
+    )
+    manager.maintain()
+    return PeriodicTask(
+        partitioning_config.get("check_interval_hours", 6) * 3600,
+        manager.maintain,
+        "partition-maintenance",
+        log,
+    ).start()
+
+
+def _pool_stats_message(stats: dict[str, int]) -> str:
+    requests = stats.get("requests_num", 0)
+    wait_ms = stats.get("requests_wait_ms", 0) / requests if requests else 0.0
+    in_use = stats.get("pool_size", 0) - stats.get("pool_available", 0)
+    return (
+        f"Pool stats: size={stats.get('pool_size', 0)}, in use={in_use}, "
+        f"waiting={stats.get('requests_waiting', 0)}, requests={requests}, "
+        f"avg checkout wait={wait_ms:.1f}ms, timeouts={stats.get('requests_errors', 0)}"
+    )
+
+
+def _insert_params(sip_delivery: SipDelivery) -> tuple:
+    return (
+        sip_delivery.correlation_id,
+        sip_delivery.s3_bucket,
+        sip_delivery.s3_object_key,
+        sip_delivery.last_event_type,
+        sip_delivery.last_event_occurred_at,
+    )
+
+
+def _register_query(table: str, fetch_existing: bool) -> str:
+    """Build the non-raising insert, optionally returning the existing record."""
+    insert = f"INSERT INTO public.{table} (correlation_id, s3_bucket, s3_object_key, last_event_type, last_event_occurred_at) VALUES (%s, %s, %s, %s, %s) ON CONFLICT DO NOTHING RETURNING correlation_id"
+    if not fetch_existing:
+        return f"{insert};"
+    return (
+        f"WITH inserted AS ({insert}) "
+        "SELECT true, NULL, NULL, NULL, NULL, NULL, NULL, NULL FROM inserted "
+        "UNION ALL "
+        "SELECT false, s3_bucket, s3_object_key, pid, status, failure_message, last_event_type, last_event_occurred_at "
+        f"FROM public.{table} WHERE correlation_id = %s AND NOT EXISTS (SELECT 1 FROM inserted);"
+    )
+
+
+def _register_params(sip_delivery: SipDelivery, fetch_existing: bool) -> tuple:
+    params = _insert_params(sip_delivery)
+    if not fetch_existing:
+        return params
+    return (*params, sip_delivery.correlation_id)
+
+
+def _insert_many_query(table: str, count: int) -> str:
+    """Build the multi-row insert that skips duplicate correlation_ids."""
+    placeholders = ", ".join(["(%s, %s, %s, %s, %s)"] * count)
+    return f"INSERT INTO public.{table} (correlation_id, s3_bucket, s3_object_key, last_event_type, last_event_occurred_at) VALUES {placeholders} ON CONFLICT DO NOTHING RETURNING correlation_id;"
+
+
+def _insert_many_params(batch: list[SipDelivery]) -> list:
+    params = []
+    for sip_delivery in batch:
+        params.extend(_insert_params(sip_delivery))
+    return params
+
+
+# Session-local table that bulk loads are copied into before they are merged.
+_STAGING_TABLE = "sip_deliveries_staging"
+_COLUMNS = (
+    "correlation_id, s3_bucket, s3_object_key, last_event_type, last_event_occurred_at"
+)
+
+
+def _create_staging_query(table: str) -> str:
+    """Build the statement that creates the staging table, with the column types of the table.
+
+    The rows are deleted at the end of every transaction; the table itself
+    lives as long as the (pooled) connection.
+    """
+    return (
+        f"CREATE TEMPORARY TABLE IF NOT EXISTS {_STAGING_TABLE} ON COMMIT DELETE ROWS AS "
+        f"SELECT 0 AS position, {_COLUMNS} FROM public.{table} WITH NO DATA;"
+    )
+
+
+def _merge_staging_query(table: str) -> str:
+    """Build the insert of the staged rows that skips duplicate correlation_ids.
+
+    Of the staged rows with the same correlation_id only the first is inserted.
+    """
+    return (
+        f"INSERT INTO public.{table} ({_COLUMNS}) "
+        f"SELECT DISTINCT ON (correlation_id) {_COLUMNS} FROM {_STAGING_TABLE} "
+        "ORDER BY correlation_id, position "
+        "ON CONFLICT DO NOTHING RETURNING correlation_id;"
+    )
+
+
+def _outbox_table(db_config: dict) -> str:
+    return db_config.get("outbox", {}).get("table") or f"{db_config['table']}_outbox"
+
+
+def _create_outbox_query(outbox_table: str) -> str:
+    """Build the statements that create the outbox table, if it doesn't exist.
+
+    The partial index keeps finding the unsent rows cheap while the sent
+    ones wait for their cleanup. The event_time column is added to a table
+    created without it; its rows fall back to created_at.
+    """
+    return (
+        f"CREATE TABLE IF NOT EXISTS public.{outbox_table} ("
+        "id bigserial PRIMARY KEY, correlation_id text NOT NULL, subject text, "
+        "outcome text NOT NULL, data jsonb NOT NULL, event_time timestamptz, "
+        "created_at timestamptz NOT NULL DEFAULT now(), sent_at timestamptz); "
+        f"ALTER TABLE public.{outbox_table} "
+        "ADD COLUMN IF NOT EXISTS event_time timestamptz; "
+        f"CREATE INDEX IF NOT EXISTS {outbox_table}_unsent "
+        f"ON public.{outbox_table} (id) WHERE sent_at IS NULL;"
+    )
+
+
+def _outbox_params(outbox_event: OutboxEvent) -> tuple:
+    return (
+        outbox_event.correlation_id,
+        outbox_event.subject,
+        outbox_event.outcome,
+        Jsonb(outbox_event.data),
+        outbox_event.time,
+    )
+
+
+def _correlation_key(correlation_id) -> str:
+    """Normalize a correlation_id the way a uuid column stores it.
+
+    A uuid column returns the lowercase, hyphenated form, whatever form
+    was inserted. Other correlation_ids are kept as they are.
+    """
+    try:
+        return str(UUID(str(correlation_id)))
+    except ValueError:
+        return str(correlation_id)
+
+
+def _batch_duplicates(batch: list[SipDelivery], rows: list[tuple]) -> list[SipDelivery]:
+    """The deliveries of the batch whose row was not inserted."""
+    inserted = Counter(_correlation_key(row[0]) for row in rows)
+    # Only the first occurrence of an inserted correlation_id got its row.
+    duplicates = []
+    for sip_delivery in batch:
+        key = _correlation_key(sip_delivery.correlation_id)
+        if inserted[key] > 0:
+            inserted[key] -= 1
+        else:
+            duplicates.append(sip_delivery)
+    return duplicates
+
+
+def _registration_result(
+    sip_delivery: SipDelivery, row: tuple | None, fetch_existing: bool
+) -> RegistrationResult:
+    """Translate the row returned by the register query."""
+    if not fetch_existing:
+        return RegistrationResult(inserted=row is not None)
+    # No row means the insert conflicted on another unique constraint.
+    if row is None:
+        return RegistrationResult(inserted=False)
+    if row[0]:
+        return RegistrationResult(inserted=True)
+    return RegistrationResult(
+        inserted=False,
+        existing=SipDelivery(
+            correlation_id=sip_delivery.correlation_id,
+            s3_bucket=row[1],
+            s3_object_key=row[2],
+            s3_domain="",
+            pid=row[3],
+            status=SipStatus(row[4]),
+            failure_message=row[5],
+            last_event_type=row[6],
+            last_event_occurred_at=row[7],
+        ),
+    )
+
+
+class RegistrationStore(ABC):
+    """Where the SIP deliveries are registered.
+
+    A correlation_id is registered at most once: registering it again is
+    reported as a duplicate, never as an error. DbClient stores in Postgres;
+    the other backends (see app.services.stores) mimic its semantics for
+    local runs and profiling.
+    """
+
+    def insert_sip_delivery(self, sip_delivery: SipDelivery):
+        """Insert a delivery of a SIP.
+
+        Raises:
+            DuplicateKeyError: If the correlation_id is registered already.
+        """
+        if not self.register_sip_delivery(sip_delivery, fetch_existing=False).inserted:
+            raise DuplicateKeyError(
+                f"Duplicate correlation_id: {sip_delivery.correlation_id}"
+            )
+
+    @abstractmethod
+    def register_sip_delivery(
+        self, sip_delivery: SipDelivery, fetch_existing: bool = True
+    ) -> RegistrationResult:
+        """Register a delivery of a SIP without raising on a duplicate correlation_id.
+
+        Args:
+            sip_delivery: A delivered SIP.
+            fetch_existing: Whether to return the existing record on a duplicate.
+
+        Returns:
+            Whether the delivery was inserted and, optionally, the existing record.
+        """
+
+    @abstractmethod
+    def insert_sip_deliveries(self, batch: list[SipDelivery]) -> list[SipDelivery]:
+        """Insert a batch of SIP deliveries, skipping duplicate correlation_ids.
+
+        Of the deliveries with the same correlation_id in the batch only the
+        first is inserted.
+
+        Returns:
+            The deliveries that were not inserted because of a duplicate correlation_id.
+        """
+
+    def copy_sip_deliveries(self, batch: list[SipDelivery]) -> list[SipDelivery]:
+        """Bulk load a large batch of SIP deliveries; see insert_sip_deliveries."""
+        return self.insert_sip_deliveries(batch)
+
+    def waiting_requests(self) -> int:
+        """The number of requests waiting for a connection."""
+        return 0
+
+    def is_healthy(self) -> bool:
+        """Whether the store can register deliveries."""
+        return True
+
+    def warm_up(self, timeout: float):
+        """Get ready to register deliveries within `timeout` seconds."""
+
+    def close(self):
+        """Write what is pending and release the resources."""
+
+
+class DbClient(RegistrationStore):
+    """Registers the SIP deliveries in a Postgres table, through a connection pool."""
+
     def __init__(self, config_parser: ConfigParser):
         self.log = logging.get_logger(__name__, config=config_parser)
         self.db_config: dict = config_parser.app_cfg["db"]
+        self.table = self.db_config["table"]
+        # Compile the registration statements once; they are executed as
+        # server-side prepared statements on every pooled connection,
+        # prepared on their first use there.
+        self._insert_query = f"INSERT INTO public.{self.table} (correlation_id, s3_bucket, s3_object_key, last_event_type, last_event_occurred_at) VALUES (%s, %s, %s, %s, %s);"
+        self._register_queries = {
+            fetch_existing: _register_query(self.table, fetch_existing)
+            for fetch_existing in (True, False)
+        }
+        self.outbox_table = _outbox_table(self.db_config)
+        self._outbox_insert_query = f"INSERT INTO public.{self.outbox_table} (correlation_id, subject, outcome, data, event_time) VALUES (%s, %s, %s, %s, %s);"
         self.pool = ConnectionPool(
-            f"host={self.db_config['host']} port={self.db_config['port']} dbname={self.db_config['dbname']} user={self.db_config['username']} password={self.db_config['password']}",
+            _conninfo(self.db_config),
             open=True,
+            **_pool_kwargs(self.db_config),
         )
-        self.table = self.db_config["table"]
+        metrics.observe_pool(self.pool)
+        stats_interval = self.db_config.get("pool_stats_interval", 0)
+        self._stats_task = (
+            PeriodicTask(
+                stats_interval, self.log_pool_stats, "pool-stats", self.log
+            ).start()
+            if stats_interval
+            else None
+        )
+        self._partition_task = _start_partition_maintenance(config_parser, self.log)
+
+    def log_pool_stats(self):
+        """Log the connection pool statistics gathered since the previous call."""
+        self.log.info(_pool_stats_message(self.pool.pop_stats()))
+
+    def waiting_requests(self) -> int:
+        """The number of requests waiting for a connection of the pool."""
+        return self.pool.get_stats().get("requests_waiting", 0)
+
+    def is_healthy(self) -> bool:
+        """Whether the pool is open and holds connections."""
+        return not self.pool.closed and self.pool.get_stats().get("pool_size", 0) > 0
+
+    def warm_up(self, timeout: float):
+        """Wait until the pool holds its minimum number of connections.
+
+        Raises:
+            PoolTimeout: If the connections were not made within `timeout` seconds.
+        """
+        self.pool.wait(timeout)
 
     def insert_sip_delivery(self, sip_delivery: SipDelivery):
         """Insert a delivery of a SIP into the database.
@@ -56,23 +425,322 @@ class DbClient:
         Raises:
             DuplicateKeyError: If the record cannot be inserted because of duplicate correlation_id.
         """
+        if self._partition_task is not None:
+            # The registry trigger skips a duplicate instead of raising.
+            return super().insert_sip_delivery(sip_delivery)
         try:
             with self.pool.connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute(
-                        f"INSERT INTO public.{self.table} (correlation_id, s3_bucket, s3_object_key, last_event_type, last_event_occurred_at) VALUES (%s, %s, %s, %s, %s);",
-                        (
-                            sip_delivery.correlation_id,
-                            sip_delivery.s3_bucket,
-                            sip_delivery.s3_object_key,
-                            sip_delivery.last_event_type,
-                            sip_delivery.last_event_occurred_at,
-                        ),
+                        self._insert_query, _insert_params(sip_delivery), prepare=True
                     )
                     conn.commit()
         except UniqueViolation as e:
             raise DuplicateKeyError(str(e)) from e
 
+    def register_sip_delivery(
+        self,
+        sip_delivery: SipDelivery,
+        fetch_existing: bool = True,
+        outbox_event: OutboxEvent | None = None,
+    ) -> RegistrationResult:
+        """Register a delivery of a SIP without raising on a duplicate correlation_id.
+
+        The insert uses ON CONFLICT DO NOTHING, so a duplicate neither aborts
+        the transaction nor logs an error on the server. When requested, the
+        existing record is fetched in the same statement.
+
+        Args:
+            sip_delivery: A delivered SIP.
+            fetch_existing: Whether to return the existing record on a duplicate.
+            outbox_event: The event to write to the outbox in the same
+                transaction, if the delivery is inserted.
+
+        Returns:
+            Whether the delivery was inserted and, optionally, the existing record.
+        """
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    self._register_queries[fetch_existing],
+                    _register_params(sip_delivery, fetch_existing),
+                    prepare=True,
+                )
+                result = _registration_result(
+                    sip_delivery, cur.fetchone(), fetch_existing
+                )
+                if outbox_event is not None and result.inserted:
+                    cur.execute(
+                        self._outbox_insert_query,
+                        _outbox_params(outbox_event),
+                        prepare=True,
+                    )
+                conn.commit()
+        return result
+
+    def insert_sip_deliveries(
+        self,
+        batch: list[SipDelivery],
+        outbox_events: list[OutboxEvent] | None = None,
+    ) -> list[SipDelivery]:
+        """Insert a batch of SIP deliveries into the database in one transaction.
+
+        All rows are written with a single multi-row INSERT. Rows whose
+        correlation_id already exists, either in the table or earlier in the
+        same batch, are skipped instead of aborting the transaction.
+
+        Args:
+            batch: The delivered SIPs.
+            outbox_events: The event per delivery to write to the outbox in
+                the same transaction, if the delivery is inserted.
+
+        Returns:
+            The deliveries that were not inserted because of a duplicate correlation_id.
+        """
+        if not batch:
+            return []
+
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    _insert_many_query(self.table, len(batch)),
+                    _insert_many_params(batch),
+                )
+                duplicates = _batch_duplicates(batch, cur.fetchall())
+                if outbox_events is not None:
+                    skipped = {id(sip_delivery) for sip_delivery in duplicates}
+                    cur.executemany(
+                        self._outbox_insert_query,
+                        [
+                            _outbox_params(outbox_event)
+                            for sip_delivery, outbox_event in zip(batch, outbox_events)
+                            if id(sip_delivery) not in skipped
+                        ],
+                    )
+                conn.commit()
+        return duplicates
+
+    def add_to_outbox(self, outbox_events: list[OutboxEvent]):
+        """Write events to the outbox, in one transaction.
+
+        Unlike the events written by register_sip_delivery and
+        insert_sip_deliveries, these are not atomic with a registration. The
+        listener writes the FAIL event of a duplicate this way, after the
+        duplicate check; if the write fails, the message is retried and the
+        check repeated, so the event is written at least once.
+        """
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.executemany(
+                    self._outbox_insert_query,
+                    [_outbox_params(outbox_event) for outbox_event in outbox_events],
+                )
+                conn.commit()
+
+    def create_outbox(self):
+        """Create the outbox table, if it doesn't exist."""
+        with self.pool.connection() as conn:
+            conn.execute(_create_outbox_query(self.outbox_table))
+            conn.commit()
+
+    def relay_outbox(
+        self, limit: int, publish: Callable[[list[tuple]], list[int]]
+    ) -> int:
+        """Publish the oldest unsent outbox rows and mark the published ones as sent.
+
+        The rows are locked while they are published; other relays skip
+        them and take the next ones.
+
+        Args:
+            limit: The maximum number of rows to publish.
+            publish: Publishes the rows (id, correlation_id, subject, outcome,
+                data, event time) and returns the ids of the published ones.
+
+        Returns:
+            The number of rows that were published.
+        """
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT id, correlation_id, subject, outcome, data, "
+                    f"COALESCE(event_time, created_at) FROM public.{self.outbox_table} "
+                    "WHERE sent_at IS NULL ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED;",
+                    (limit,),
+                )
+                rows = cur.fetchall()
+                sent = publish(rows) if rows else []
+                if sent:
+                    cur.execute(
+                        f"UPDATE public.{self.outbox_table} SET sent_at = now() WHERE id = ANY(%s);",
+                        (sent,),
+                    )
+                conn.commit()
+        return len(sent)
+
+    def outbox_backlog(self) -> tuple[int, float]:
+        """The number of unsent outbox rows and the age in seconds of the oldest."""
+        with self.pool.connection() as conn:
+            count, age = conn.execute(
+                "SELECT count(*), coalesce(extract(epoch FROM now() - min(created_at)), 0) "
+                f"FROM public.{self.outbox_table} WHERE sent_at IS NULL;"
+            ).fetchone()
+            conn.commit()
+        return count, float(age)
+
+    def delete_sent_outbox(self, older_than_hours: float) -> int:
+        """Delete the outbox rows that were sent longer ago than the given hours.
+
+        Returns:
+            The number of deleted rows.
+        """
+        with self.pool.connection() as conn:
+            cur = conn.execute(
+                f"DELETE FROM public.{self.outbox_table} "
+                "WHERE sent_at < now() - make_interval(secs => %s);",
+                (older_than_hours * 3600,),
+            )
+            conn.commit()
+            return cur.rowcount
+
+    def copy_sip_deliveries(self, batch: list[SipDelivery]) -> list[SipDelivery]:
+        """Bulk load SIP deliveries with COPY and merge them into the table.
+
+        The rows are copied into a temporary staging table and inserted from
+        there in the same transaction, skipping the correlation_ids that
+        already exist. Meant for large batches, such as a backfill; COPY
+        avoids the parameter limit and parsing cost of a multi-row INSERT.
+
+        Args:
+            batch: The delivered SIPs.
+
+        Returns:
+            The deliveries that were not inserted because of a duplicate correlation_id.
+        """
+        if not batch:
+            return []
+
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(_create_staging_query(self.table))
+                with cur.copy(
+                    f"COPY {_STAGING_TABLE} (position, {_COLUMNS}) FROM STDIN"
+                ) as copy:
+                    for position, sip_delivery in enumerate(batch):
+                        copy.write_row((position, *_insert_params(sip_delivery)))
+                cur.execute(_merge_staging_query(self.table))
+                rows = cur.fetchall()
+                conn.commit()
+        return _batch_duplicates(batch, rows)
+
     def close(self):
         """Close the connection (pool)"""
+        if self._stats_task is not None:
+            self._stats_task.stop()
+        if self._partition_task is not None:
+            self._partition_task.stop()
         self.pool.close()
+
+
+class AsyncDbClient:
+    """asyncio counterpart of DbClient, backed by an AsyncConnectionPool."""
+
+    def __init__(self, config_parser: ConfigParser):
+        self.log = logging.get_logger(__name__, config=config_parser)
+        self.config_parser = config_parser
+        self.db_config: dict = config_parser.app_cfg["db"]
+        self.table = self.db_config["table"]
+        self._register_queries = {
+            fetch_existing: _register_query(self.table, fetch_existing)
+            for fetch_existing in (True, False)
+        }
+        # An async pool can only be opened from within a running event loop.
+        self.pool = AsyncConnectionPool(
+            _conninfo(self.db_config),
+            open=False,
+            **_pool_kwargs(self.db_config),
+        )
+        metrics.observe_pool(self.pool)
+        self._stats_task: PeriodicTask | None = None
+        self._partition_task: PeriodicTask | None = None
+
+    def log_pool_stats(self):
+        """Log the connection pool statistics gathered since the previous call."""
+        self.log.info(_pool_stats_message(self.pool.pop_stats()))
+
+    def waiting_requests(self) -> int:
+        """The number of requests waiting for a connection of the pool."""
+        return self.pool.get_stats().get("requests_waiting", 0)
+
+    def is_healthy(self) -> bool:
+        """Whether the pool is open and holds connections."""
+        return not self.pool.closed and self.pool.get_stats().get("pool_size", 0) > 0
+
+    async def warm_up(self, timeout: float):
+        """Wait until the pool holds its minimum number of connections.
+
+        Raises:
+            PoolTimeout: If the connections were not made within `timeout` seconds.
+        """
+        await self.pool.wait(timeout)
+
+    async def open(self):
+        """Open the connection (pool)"""
+        await self.pool.open()
+        stats_interval = self.db_config.get("pool_stats_interval", 0)
+        self._stats_task = (
+            PeriodicTask(
+                stats_interval, self.log_pool_stats, "pool-stats", self.log
+            ).start()
+            if stats_interval
+            else None
+        )
+        # Blocks the event loop, but only once at startup.
+        self._partition_task = _start_partition_maintenance(
+            self.config_parser, self.log
+        )
+
+    async def register_sip_delivery(
+        self, sip_delivery: SipDelivery, fetch_existing: bool = True
+    ) -> RegistrationResult:
+        """Register a delivery of a SIP without raising on a duplicate correlation_id.
+
+        See DbClient.register_sip_delivery.
+        """
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    self._register_queries[fetch_existing],
+                    _register_params(sip_delivery, fetch_existing),
+                    prepare=True,
+                )
+                row = await cur.fetchone()
+                await conn.commit()
+        return _registration_result(sip_delivery, row, fetch_existing)
+
+    async def insert_sip_deliveries(
+        self, batch: list[SipDelivery]
+    ) -> list[SipDelivery]:
+        """Insert a batch of SIP deliveries into the database in one transaction.
+
+        See DbClient.insert_sip_deliveries.
+        """
+        if not batch:
+            return []
+
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    _insert_many_query(self.table, len(batch)),
+                    _insert_many_params(batch),
+                )
+                rows = await cur.fetchall()
+                await conn.commit()
+        return _batch_duplicates(batch, rows)
+
+    async def close(self):
+        """Close the connection (pool)"""
+        if self._stats_task is not None:
+            self._stats_task.stop()
+        if self._partition_task is not None:
+            self._partition_task.stop()
+        await self.pool.close()
@@ -0,0 +1,224 @@
+"""Maintenance of a deliveries table that is range partitioned by month.
+
+A unique index on a partitioned table must include the partition key, so
+it can't keep a correlation_id unique across partitions. A narrow registry
+table holds every registered correlation_id instead: a trigger on the
+deliveries table registers the correlation_id of each new row and skips
+the row when it is registered already. Skipped rows aren't returned by the
+inserts, so duplicates are reported exactly as with an unpartitioned table.
+The correlation_ids of a partition are removed from the registry when it is
+detached, so the registry doesn't outgrow the retained partitions.
+"""
+
+import re
+from datetime import UTC, date, datetime
+
+from psycopg import Connection
+
+
+def _add_months(month: date, months: int) -> date:
+    """The first day of the month `months` after (or before) `month`."""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def _month_partitions(
+    table: str, month: date, premake_months: int
+) -> list[tuple[str, date, date]]:
+    """The partitions from `month` up to `premake_months` months ahead.
+
+    Returns:
+        The name, lower bound and (exclusive) upper bound of each partition.
+    """
+    return [
+        (
+            _partition_name(table, _add_months(month, offset)),
+            _add_months(month, offset),
+            _add_months(month, offset + 1),
+        )
+        for offset in range(premake_months + 1)
+    ]
+
+
+def _expired_partitions(table: str, names: list[str], cutoff: date) -> list[str]:
+    """The monthly partitions, by their name, that end on or before `cutoff`."""
+    pattern = re.compile(rf"{re.escape(table)}_p(\d{{4}})(\d{{2}})")
+    expired = []
+    for name in names:
+        match = pattern.fullmatch(name)
+        if match is None:
+            continue
+        month = date(int(match[1]), int(match[2]), 1)
+        if _add_months(month, 1) <= cutoff:
+            expired.append(name)
+    return sorted(expired)
+
+
+class PartitionManager:
+    """Creates the upcoming monthly partitions and detaches the expired ones.
+
+    The deliveries table itself must be created range partitioned, on
+    `created_at` or `last_event_occurred_at`. Maintenance takes an advisory
+    lock, so only one of several processes or replicas does it at a time.
+    Expired partitions are detached concurrently, which requires PostgreSQL
+    14 or later and rules out a DEFAULT partition: a row outside the
+    partitions is rejected with a CheckViolation.
+    Detached partitions are left in place as ordinary tables. Their
+    correlation_ids are removed from the registry, so they are no longer
+    duplicates.
+    """
+
+    def __init__(self, conninfo: str, table: str, partitioning_config: dict, log):
+        """Initialize the manager.
+
+        Args:
+            conninfo: The connection string of the database.
+            table: The partitioned deliveries table.
+            partitioning_config: The `db.partitioning` settings.
+            log: The logger to report the maintenance on.
+        """
+        self.conninfo = conninfo
+        self.table = table
+        self.registry_table = (
+            partitioning_config.get("registry_table") or f"{table}_keys"
+        )
+        self.premake_months = partitioning_config.get("premake_months", 3)
+        self.retention_months = partitioning_config.get("retention_months", 0)
+        self.log = log
+
+    def maintain(self, today: date | None = None):
+        """Set up the registry, create the upcoming partitions and detach the expired ones.
+
+        Args:
+            today: The current date, in UTC by default.
+
+        Raises:
+            ValueError: If the table is not range partitioned.
+        """
+        month = (today or datetime.now(UTC).date()).replace(day=1)
+        # Autocommit: partitions are detached concurrently, outside a
+        # transaction. The session lock is released when the connection closes.
+        with Connection.connect(self.conninfo, autocommit=True) as conn:
+            locked = conn.execute(
+                "SELECT pg_try_advisory_lock(hashtext(%s));",
+                (f"{self.table}-partitions",),
+            ).fetchone()[0]
+            if not locked:
+                self.log.info("Partition maintenance is running elsewhere.")
+                return
+            with conn.transaction():
+                partition_key = self._partition_key(conn)
+                self._ensure_registry(conn)
+                created = self._create_partitions(conn, month)
+            detached = (
+                self._detach_partitions(
+                    conn, _add_months(month, -self.retention_months)
+                )
+                if self.retention_months
+                else []
+            )
+        self.log.info(
+            f"Partitions of {self.table} ({partition_key}): created {created or 'none'}, "
+            f"detached {detached or 'none'}."
+        )
+
+    def _partition_key(self, conn: Connection) -> str:
+        row = conn.execute(
+            "SELECT pg_get_partkeydef(c.oid) FROM pg_class c "
+            "JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE n.nspname = 'public' AND c.relname = %s AND c.relkind = 'p';",
+            (self.table,),
+        ).fetchone()
+        if row is None or not row[0].startswith("RANGE"):
+            raise ValueError(f"public.{self.table} is not range partitioned.")
+        return row[0]
+
+    def _ensure_registry(self, conn: Connection):
+        """Create the registry, filled with the registered correlation_ids, and its trigger."""
+        exists = conn.execute(
+            "SELECT to_regclass(%s) IS NOT NULL;", (f"public.{self.registry_table}",)
+        ).fetchone()[0]
+        if not exists:
+            # Copies the column type along with the existing correlation_ids.
+            cur = conn.execute(
+                f"CREATE TABLE public.{self.registry_table} AS "
+                f"SELECT DISTINCT correlation_id FROM public.{self.table};"
+            )
+            conn.execute(
+                f"ALTER TABLE public.{self.registry_table} ADD PRIMARY KEY (correlation_id);"
+            )
+            self.log.info(
+                f"Created {self.registry_table} with {cur.rowcount} correlation_ids."
+            )
+        conn.execute(
+            f"CREATE OR REPLACE FUNCTION public.{self.table}_register_key() "
+            "RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+            f"INSERT INTO public.{self.registry_table} (correlation_id) "
+            "VALUES (NEW.correlation_id) ON CONFLICT DO NOTHING; "
+            "IF NOT FOUND THEN RETURN NULL; END IF; "
+            "RETURN NEW; END $$;"
+        )
+        has_trigger = conn.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_trigger "
+            "WHERE tgrelid = to_regclass(%s) AND tgname = %s);",
+            (f"public.{self.table}", f"{self.table}_register_key"),
+        ).fetchone()[0]
+        if not has_trigger:
+            conn.execute(
+                f"CREATE TRIGGER {self.table}_register_key "
+                f"BEFORE INSERT ON public.{self.table} FOR EACH ROW "
+                f"EXECUTE FUNCTION public.{self.table}_register_key();"
+            )
+
+    def _create_partitions(self, conn: Connection, month: date) -> list[str]:
+        existing = self._partitions(conn)
+        created = []
+        for name, start, end in _month_partitions(
+            self.table, month, self.premake_months
+        ):
+            if name in existing:
+                continue
+            conn.execute(
+                f"CREATE TABLE public.{name} PARTITION OF public.{self.table} "
+                f"FOR VALUES FROM ('{start.isoformat()} 00:00:00+00') "
+                f"TO ('{end.isoformat()} 00:00:00+00');"
+            )
+            created.append(name)
+        return created
+
+    def _detach_partitions(self, conn: Connection, cutoff: date) -> list[str]:
+        """Detach the expired partitions without blocking the inserts.
+
+        A detach that was interrupted leaves the partition pending; it is
+        finalized instead.
+        """
+        partitions = self._partitions(conn)
+        expired = _expired_partitions(self.table, list(partitions), cutoff)
+        for name in expired:
+            detach = "FINALIZE" if partitions[name] else "CONCURRENTLY"
+            conn.execute(
+                f"ALTER TABLE public.{self.table} DETACH PARTITION public.{name} {detach};"
+            )
+            cur = conn.execute(
+                f"DELETE FROM public.{self.registry_table} r USING public.{name} p "
+                "WHERE r.correlation_id = p.correlation_id;"
+            )
+            self.log.info(
+                f"Removed {cur.rowcount} correlation_ids of {name} from {self.registry_table}."
+            )
+        return expired
+
+    def _partitions(self, conn: Connection) -> dict[str, bool]:
+        """The partitions of the table, and whether they are pending detach."""
+        return dict(
+            conn.execute(
+                "SELECT c.relname, i.inhdetachpending FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass(%s);",
+                (f"public.{self.table}",),
+            ).fetchall()
+        )
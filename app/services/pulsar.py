@@ -1,9 +1,141 @@
+import asyncio
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+
 from cloudevents.events import CEMessageMode, Event, PulsarBinding
-from pulsar import Client
+from pulsar import (
+    BatchingType,
+    Client,
+    CompressionType,
+    ConsumerBatchReceivePolicy,
+    ConsumerType,
+    Result,
+    Timeout,
+)
 from viaa.configuration import ConfigParser
 from viaa.observability import logging
 
-from .. import APP_NAME
+from .. import APP_NAME, metrics
+from ..retry import RetryPolicy, Scheduler
+from .acks import build_acknowledger
+
+# With retries enabled the backoff happens before the nack, so the broker
+# should redeliver right after it.
+_RETRY_REDELIVERY_DELAY_MS = 100
+# Error messages in the properties of dead-lettered messages are truncated.
+_MAX_ERROR_LENGTH = 1000
+# Broker-side deduplication needs the input message ids to increase, which
+# only holds for a single consumer of a non-partitioned topic.
+_DEDUPLICATION_SUBSCRIPTION_TYPES = ("Exclusive", "Failover")
+
+
+# The bits of a derived sequence id: ledger (27), entry (20), batch index
+# plus one (10) and the index of the outgoing event (6). Together they stay
+# below 2^63, the largest sequence id.
+_LEDGER_BITS, _ENTRY_BITS, _BATCH_BITS, _INDEX_BITS = 27, 20, 10, 6
+
+
+def _sequence_id(msg_id, index: int) -> int | None:
+    """Derive the sequence id of the index-th outgoing event for an input message.
+
+    The ids increase with the position of the input message in its topic:
+    its ledger, its entry and its index in a batch.
+
+    Returns:
+        The sequence id, None if a part of the position or the index doesn't
+        fit in its bits.
+    """
+    ledger_id = msg_id.ledger_id()
+    entry_id = msg_id.entry_id()
+    batch_index = msg_id.batch_index() + 1
+    if not (
+        0 <= ledger_id < 1 << _LEDGER_BITS
+        and 0 <= entry_id < 1 << _ENTRY_BITS
+        and 0 <= batch_index < 1 << _BATCH_BITS
+        and 0 <= index < 1 << _INDEX_BITS
+    ):
+        return None
+    return (
+        ledger_id << (_ENTRY_BITS + _BATCH_BITS + _INDEX_BITS)
+        | entry_id << (_BATCH_BITS + _INDEX_BITS)
+        | batch_index << _INDEX_BITS
+        | index
+    )
+
+
+def _producer_settings(producer_config: dict) -> dict:
+    """Translate the `pulsar.producer` section into `create_producer` arguments.
+
+    The defaults are those of the client library.
+
+    Raises:
+        ValueError: If the compression or batching type is unknown.
+    """
+    compression = producer_config.get("compression", "NONE")
+    batching_config = producer_config.get("batching", {})
+    batching_type = batching_config.get("type", "Default")
+    if compression not in CompressionType.__members__:
+        raise ValueError(f"Unknown compression type: {compression}")
+    if batching_type not in BatchingType.__members__:
+        raise ValueError(f"Unknown batching type: {batching_type}")
+    return {
+        "compression_type": getattr(CompressionType, compression),
+        "max_pending_messages": producer_config.get("max_pending_messages", 1000),
+        "block_if_queue_full": producer_config.get("block_if_queue_full", False),
+        "send_timeout_millis": producer_config.get("send_timeout_ms", 30_000),
+        "batching_enabled": batching_config.get("enabled", False),
+        "batching_type": getattr(BatchingType, batching_type),
+        "batching_max_messages": batching_config.get("max_messages", 1000),
+        "batching_max_allowed_size_in_bytes": batching_config.get(
+            "max_size_bytes", 128 * 1024
+        ),
+        "batching_max_publish_delay_ms": batching_config.get(
+            "max_publish_delay_ms", 10
+        ),
+    }
+
+
+class PendingAck:
+    """Acknowledges an input message once all of its outgoing events are persisted.
+
+    The message starts with one outstanding token for its own handling. Every
+    asynchronous send adds a token via `expect`. When the last token is
+    released the message is acknowledged, or handed to `PulsarClient.fail` if
+    any of them failed.
+    """
+
+    def __init__(self, pulsar_client: "PulsarClient", msg):
+        self.pulsar_client = pulsar_client
+        self.msg = msg
+        self._pending = 1
+        self._failed = False
+        self._error: Exception | None = None
+        self._lock = threading.Lock()
+
+    def expect(self) -> Callable[[bool], None]:
+        """Register an outstanding send and return the callback that completes it."""
+        with self._lock:
+            self._pending += 1
+        return self.done
+
+    def done(self, succeeded: bool = True, error: Exception | None = None):
+        """Release a token; (n)ack the message when it was the last one.
+
+        Args:
+            succeeded: Whether the handling or send that held the token succeeded.
+            error: The error the handling failed with, if known.
+        """
+        with self._lock:
+            self._pending -= 1
+            self._failed = self._failed or not succeeded
+            self._error = self._error or error
+            if self._pending > 0:
+                return
+        if self._failed:
+            self.pulsar_client.fail(self.msg, self._error)
+        else:
+            self.pulsar_client.acknowledge(self.msg)
 
 
 class PulsarClient:
@@ -19,48 +151,342 @@ class PulsarClient:
         self.client = Client(
             f"pulsar://{self.pulsar_config['host']}:{self.pulsar_config['port']}"
         )
-        self.consumer = self.client.subscribe(
-            self.pulsar_config["consumer_topic"], APP_NAME
+        # Every producer, including the ones created on first use, gets the
+        # same settings.
+        self.producer_settings = _producer_settings(
+            self.pulsar_config.get("producer", {})
         )
+        # Use KeyShared to spread a topic over several consumers while keeping
+        # the messages for one key in order. That key must be the
+        # correlation_id, set by the upstream producer; see
+        # BaseEventListener._check_key.
+        subscription_type = self.pulsar_config.get("subscription_type", "Exclusive")
+        dedup_config = self.pulsar_config.get("deduplication", {})
+        self.producer_name: str | None = None
+        if dedup_config.get("broker", False):
+            if subscription_type not in _DEDUPLICATION_SUBSCRIPTION_TYPES:
+                raise ValueError(
+                    f"Broker-side deduplication requires an Exclusive or Failover subscription, not {subscription_type}."
+                )
+            self.producer_name = dedup_config.get("producer_name") or APP_NAME
+            self.log.info(
+                f"Producing with broker-side deduplication as {self.producer_name}."
+            )
+        # The broker drops an event of the named producer whose sequence id
+        # isn't above the last one. Events that can't get a higher id, such
+        # as those of a redelivered message, go through an unnamed producer.
+        # The last id is seeded from the broker when the named producer is
+        # created; see _get_producer.
+        self._last_sequence_id = -1
+        self._sequence_lock = threading.Lock()
+        self._unsequenced_producer = None
         self.log.info(
-            f"Started consuming topic: {self.pulsar_config['consumer_topic']}"
+            "Producer settings: "
+            + ", ".join(
+                f"{name}={getattr(value, 'name', value)}"
+                for name, value in self.producer_settings.items()
+            )
         )
+        # Create the producer for the outgoing events before consuming, so the
+        # first message doesn't wait for it.
         self.producers = {}
+        self._producers_lock = threading.Lock()
+        self._get_producer(self.pulsar_config["producer_topic"])
+        if self.producer_name is not None:
+            self._unsequenced_producer = self.client.create_producer(
+                self.pulsar_config["producer_topic"], **self.producer_settings
+            )
 
-    def produce_event(self, topic: str, event: Event):
+        batch_config = self.pulsar_config.get("batch_receive", {})
+        self.batch_receive_enabled = batch_config.get("enabled", False)
+        consumer_config = self.pulsar_config.get("consumer", {})
+        # The number of messages the client prefetches from the broker.
+        subscribe_kwargs = {
+            "receiver_queue_size": consumer_config.get("receiver_queue_size", 1000)
+        }
+        if self.batch_receive_enabled:
+            subscribe_kwargs["batch_receive_policy"] = ConsumerBatchReceivePolicy(
+                batch_config.get("max_num_messages", 100),
+                batch_config.get("max_num_bytes", 10 * 1024 * 1024),
+                batch_config.get("timeout_ms", 100),
+            )
+        retry_config = self.pulsar_config.get("retry", {})
+        self.retry_policy: RetryPolicy | None = None
+        if retry_config.get("enabled", False):
+            self.retry_policy = RetryPolicy(
+                max_attempts=retry_config.get("max_attempts", 5),
+                initial_backoff=retry_config.get("initial_backoff_ms", 1000) / 1000,
+                max_backoff=retry_config.get("max_backoff_ms", 60_000) / 1000,
+                multiplier=retry_config.get("multiplier", 2.0),
+            )
+            self.dead_letter_topic = (
+                retry_config.get("dead_letter_topic")
+                or f"{self.pulsar_config['consumer_topic']}-{APP_NAME}-DLQ"
+            )
+            self._retries = Scheduler("retry", self.log)
+            subscribe_kwargs["negative_ack_redelivery_delay_ms"] = (
+                _RETRY_REDELIVERY_DELAY_MS
+            )
+        self.consumer = self.client.subscribe(
+            self.pulsar_config["consumer_topic"],
+            APP_NAME,
+            consumer_type=getattr(ConsumerType, subscription_type),
+            **subscribe_kwargs,
+        )
+        self.log.info(
+            f"Started consuming topic: {self.pulsar_config['consumer_topic']} ({subscription_type} subscription, "
+            f"receiver_queue_size={subscribe_kwargs['receiver_queue_size']})"
+        )
+        self.acknowledger = build_acknowledger(
+            self.consumer,
+            self.pulsar_config.get("ack", {}),
+            subscription_type,
+            self.log,
+        )
+
+        async_send_config = self.pulsar_config.get("async_send", {})
+        self.async_send_enabled = async_send_config.get("enabled", False)
+        self._in_flight = threading.BoundedSemaphore(
+            async_send_config.get("max_in_flight", 1000)
+        )
+
+    def produce_event(
+        self,
+        topic: str,
+        event: Event,
+        callback: Callable[[bool], None] | None = None,
+        sequence_id: int | None = None,
+    ):
         """Produce a CloudEvent on a specified topic.
 
-        If no producer exists for the topic, a new one is created.
+        If no producer exists for the topic, a new one is created. The
+        correlation_id is used as the message key, so consumers of the topic
+        can use a KeyShared subscription.
+
+        Without a callback the send blocks until the broker persisted the
+        event. With a callback the send is asynchronous and the callback is
+        called with whether the broker persisted the event. The number of
+        asynchronous sends in flight is capped; when the cap is reached this
+        blocks until a send completes.
+
+        With broker-side deduplication, the broker drops an event whose
+        sequence id isn't higher than that of the last event it persisted
+        from the named producer; see `sequence_id`. An event without a
+        sequence id, or with one that isn't above the last one sent, is sent
+        through an unnamed producer instead, so it is never dropped.
+
+        Args:
+            topic (str): The topic to send the CloudEvent to.
+            event (Event): The CloudEvent to send.
+            callback: Called with the result of an asynchronous send.
+            sequence_id: The sequence id of the event, None to let the producer
+                assign the next one.
+        """
+        if callback is None:
+            self._produce(topic, event, None, sequence_id)
+            return
+
+        def release(succeeded: bool):
+            self._in_flight.release()
+            callback(succeeded)
+
+        self._in_flight.acquire()
+        try:
+            self.send_event(topic, event, release, sequence_id)
+        except BaseException:
+            self._in_flight.release()
+            raise
+
+    def send_event(
+        self,
+        topic: str,
+        event: Event,
+        callback: Callable[[bool], None],
+        sequence_id: int | None = None,
+    ):
+        """Send a CloudEvent asynchronously, without capping the sends in flight.
+
+        For callers that cap the sends themselves, such as AsyncPulsarClient;
+        see produce_event.
 
         Args:
             topic (str): The topic to send the CloudEvent to.
             event (Event): The CloudEvent to send.
+            callback: Called with whether the broker persisted the event.
+            sequence_id: The sequence id of the event, None to let the producer
+                assign the next one.
         """
-        if topic not in self.producers:
-            self.producers[topic] = self.client.create_producer(topic)
+        self._produce(topic, event, callback, sequence_id)
 
+    def _produce(
+        self,
+        topic: str,
+        event: Event,
+        callback: Callable[[bool], None] | None,
+        sequence_id: int | None,
+    ):
+        """Encode an event and send it through the right producer; see produce_event."""
+        producer = self._get_producer(topic)
         msg = PulsarBinding.to_protocol(event, CEMessageMode.STRUCTURED)
-        self.producers[topic].send(
+        if self.producer_name is None or topic != self.pulsar_config["producer_topic"]:
+            self._send(producer, topic, event, msg, callback, None)
+            return
+        # Choose the id and enqueue the send atomically, so the named
+        # producer sends its ids in increasing order. The send is always
+        # enqueued asynchronously; a blocking send would hold up the others.
+        sent: Future[bool] | None = None
+        if callback is None:
+            sent = Future()
+            callback = sent.set_result
+        with self._sequence_lock:
+            if sequence_id is not None and sequence_id > self._last_sequence_id:
+                self._last_sequence_id = sequence_id
+            else:
+                producer, sequence_id = self._unsequenced_producer, None
+            self._send(producer, topic, event, msg, callback, sequence_id)
+        if sent is not None and not sent.result():
+            raise RuntimeError(f"Failed to produce event on {topic}")
+
+    def _send(
+        self,
+        producer,
+        topic: str,
+        event: Event,
+        msg,
+        callback: Callable[[bool], None] | None,
+        sequence_id: int | None,
+    ):
+        """Send an encoded event; see produce_event."""
+        if callback is None:
+            producer.send(
+                msg.data,
+                properties=msg.attributes,
+                partition_key=event.correlation_id,
+                event_timestamp=event.get_event_time_as_int(),
+                sequence_id=sequence_id,
+            )
+            return
+
+        def on_send(result: Result, msg_id):
+            if result != Result.Ok:
+                self.log.error(f"Failed to produce event on {topic}: {result}")
+            try:
+                callback(result == Result.Ok)
+            except Exception as e:
+                # An exception escaping a send callback terminates the process.
+                self.log.error(f"Error in send callback: {e}")
+
+        producer.send_async(
             msg.data,
+            on_send,
             properties=msg.attributes,
+            partition_key=event.correlation_id,
             event_timestamp=event.get_event_time_as_int(),
+            sequence_id=sequence_id,
         )
 
-    def receive(self):
+    def _get_producer(self, topic: str):
+        """Return the producer for a topic, creating it on first use."""
+        producer = self.producers.get(topic)
+        if producer is None:
+            with self._producers_lock:
+                producer = self.producers.get(topic)
+                if producer is None:
+                    # Deduplication applies to the outgoing events only.
+                    producer = self.client.create_producer(
+                        topic,
+                        producer_name=(
+                            self.producer_name
+                            if topic == self.pulsar_config["producer_topic"]
+                            else None
+                        ),
+                        **self.producer_settings,
+                    )
+                    if (
+                        self.producer_name is not None
+                        and topic == self.pulsar_config["producer_topic"]
+                    ):
+                        # Continue from the last id the broker persisted from
+                        # this producer name, also before a restart. A message
+                        # redelivered from below it would be dropped otherwise.
+                        with self._sequence_lock:
+                            self._last_sequence_id = max(
+                                self._last_sequence_id, producer.last_sequence_id()
+                            )
+                    self.producers[topic] = producer
+        return producer
+
+    def sequence_id(self, msg, index: int = 0) -> int | None:
+        """The sequence id of the index-th outgoing event for an input message.
+
+        The id is derived from the position of the input message. The
+        broker drops an event whose id isn't above the last one it persisted
+        from the named producer, also one sent before a restart. A redelivered
+        message gets ids that aren't above those, so its events are sent
+        without them and are never dropped; see produce_event.
+
+        Returns:
+            The sequence id, None without broker-side deduplication, for a
+            message of a partitioned topic, or if the position or index don't
+            fit in a sequence id.
+        """
+        if self.producer_name is None:
+            return None
+        msg_id = msg.message_id()
+        if msg_id.partition() >= 0:
+            return None
+        return _sequence_id(msg_id, index)
+
+    def is_connected(self) -> bool:
+        """Whether the consumer is connected to the broker."""
+        return self.consumer.is_connected()
+
+    def flush(self):
+        """Flush all producers, waiting for their pending sends to complete."""
+        for producer in self.producers.values():
+            producer.flush()
+        if self._unsequenced_producer is not None:
+            self._unsequenced_producer.flush()
+
+    def receive(self, timeout_millis: int | None = None):
         """Receive a message from the consumer.
 
+        Args:
+            timeout_millis: The maximum time to wait for a message, None to wait
+                until one arrives.
+
+        Returns:
+            Message | None: The received message, None if none arrived in time.
+        """
+        try:
+            msg = self.consumer.receive(timeout_millis)
+        except Timeout:
+            return None
+        self.acknowledger.track(msg)
+        return msg
+
+    def batch_receive(self):
+        """Receive a batch of messages from the consumer.
+
+        Blocks until the batch receive policy is satisfied: either enough
+        messages have arrived or the configured timeout has passed.
+
         Returns:
-            Message: The received message.
+            list[Message]: The received messages, possibly empty.
         """
-        return self.consumer.receive()
+        msgs = self.consumer.batch_receive()
+        for msg in msgs:
+            self.acknowledger.track(msg)
+        return msgs
 
     def acknowledge(self, msg):
-        """Acknowledge a message on the consumer.
+        """Acknowledge a message on the consumer, according to the ack strategy.
 
         Args:
             msg: The message to acknowledge.
         """
-        self.consumer.acknowledge(msg)
+        with metrics.ACK.time():
+            self.acknowledger.acknowledge(msg)
 
     def negative_acknowledge(self, msg):
         """Send a negative acknowledgment (nack) for a message.
@@ -68,10 +494,179 @@ class PulsarClient:
         Args:
             msg: The message to nack.
         """
-        self.consumer.negative_acknowledge(msg)
+        with metrics.NACK.time():
+            self.acknowledger.negative_acknowledge(msg)
+
+    def fail(self, msg, error: Exception | None = None, permanent: bool = False):
+        """Handle a message that could not be handled.
+
+        Without a retry policy the message is nacked right away. With one, a
+        transient failure is retried by nacking the message after an
+        exponential backoff. A permanent failure, or the failure of the last
+        attempt, sends the message to the dead-letter topic.
+
+        Both happen on the retry thread: this may be called from a send
+        callback, on the I/O thread of the client, which must not block.
+
+        Args:
+            msg: The message that failed.
+            error: The error the handling failed with, if known.
+            permanent: Whether the failure is known to be permanent, e.g. the
+                message cannot be decoded.
+        """
+        if self.retry_policy is None:
+            metrics.NACKED.inc()
+            self.negative_acknowledge(msg)
+            return
+
+        attempt = msg.redelivery_count() + 1
+        if not permanent and self.retry_policy.should_retry(attempt, error):
+            metrics.RETRIED.inc()
+            self._retries.call_later(
+                self.retry_policy.backoff(attempt),
+                lambda: self.negative_acknowledge(msg),
+            )
+            return
+        self._retries.call_later(0, lambda: self.dead_letter(msg, error, attempt))
+
+    def dead_letter(self, msg, error: Exception | None, attempts: int):
+        """Send a message to the dead-letter topic and acknowledge it.
+
+        The data and properties of the message are kept, so it can be
+        replayed. The error is added to the properties.
+
+        Args:
+            msg: The message that failed.
+            error: The error the handling failed with, if known.
+            attempts: The number of times the message was handled.
+        """
+        properties = dict(msg.properties())
+        properties.update(
+            {
+                "dead_letter_error_type": type(error).__name__ if error else "",
+                "dead_letter_error": str(error)[:_MAX_ERROR_LENGTH] if error else "",
+                "dead_letter_attempts": str(attempts),
+                "dead_letter_original_topic": msg.topic_name(),
+                "dead_letter_original_message_id": str(msg.message_id()),
+            }
+        )
+        try:
+            self._get_producer(self.dead_letter_topic).send(
+                msg.data(),
+                properties=properties,
+                partition_key=msg.partition_key() or None,
+                event_timestamp=msg.event_timestamp() or None,
+            )
+        except Exception as e:
+            self.log.error(f"Failed to dead-letter message {msg.message_id()}: {e}")
+            self.negative_acknowledge(msg)
+            return
+        self.log.error(
+            f"Dead-lettered message {msg.message_id()} to {self.dead_letter_topic} after {attempts} attempt(s): {error}"
+        )
+        metrics.DEAD_LETTERED.inc()
+        self.acknowledge(msg)
 
     def close(self):
-        """Close all producers and the consumer."""
+        """Close all producers, the consumer and the client.
+
+        Closing a producer waits for its pending sends, and the held back
+        acks are sent before the consumer closes. Messages waiting for a
+        retry are nacked right away.
+        """
+        if self.retry_policy is not None:
+            self._retries.close()
         for producer in self.producers.values():
             producer.close()
+        if self._unsequenced_producer is not None:
+            self._unsequenced_producer.close()
+        self.acknowledger.close()
         self.consumer.close()
+        self.client.close()
+
+
+class AsyncPulsarClient:
+    """asyncio wrapper around a PulsarClient.
+
+    Receiving runs on a dedicated thread and producing uses the asynchronous
+    send of the underlying producers, so neither blocks the event loop.
+    """
+
+    def __init__(self, pulsar_client: PulsarClient, max_in_flight: int = 1000):
+        """Wrap a PulsarClient.
+
+        Args:
+            pulsar_client: The client to wrap.
+            max_in_flight: The maximum number of sends waiting for the broker.
+        """
+        self.pulsar_client = pulsar_client
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._receiver = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="pulsar-receive"
+        )
+
+    async def receive(self, timeout_millis: int | None = None):
+        """Receive a message from the consumer without blocking the event loop.
+
+        Args:
+            timeout_millis: The maximum time to wait for a message, None to wait
+                until one arrives.
+
+        Returns:
+            Message | None: The received message, None if none arrived in time.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._receiver, self.pulsar_client.receive, timeout_millis
+        )
+
+    async def produce_event(
+        self, topic: str, event: Event, sequence_id: int | None = None
+    ) -> bool:
+        """Produce a CloudEvent and wait until the broker persisted it.
+
+        Args:
+            topic (str): The topic to send the CloudEvent to.
+            event (Event): The CloudEvent to send.
+            sequence_id: The sequence id of the event; see PulsarClient.produce_event.
+
+        Returns:
+            bool: Whether the broker persisted the event.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def callback(succeeded: bool):
+            loop.call_soon_threadsafe(future.set_result, succeeded)
+
+        # Capped by the asyncio semaphore; the cap of the wrapped client would
+        # block the event loop.
+        async with self._in_flight:
+            self.pulsar_client.send_event(topic, event, callback, sequence_id)
+            return await future
+
+    def sequence_id(self, msg, index: int = 0) -> int | None:
+        """The sequence id of an outgoing event; see PulsarClient.sequence_id."""
+        return self.pulsar_client.sequence_id(msg, index)
+
+    def acknowledge(self, msg):
+        """Acknowledge a message on the consumer."""
+        self.pulsar_client.acknowledge(msg)
+
+    def negative_acknowledge(self, msg):
+        """Send a negative acknowledgment (nack) for a message."""
+        self.pulsar_client.negative_acknowledge(msg)
+
+    def fail(self, msg, error: Exception | None = None, permanent: bool = False):
+        """Handle a message that could not be handled; see PulsarClient.fail."""
+        self.pulsar_client.fail(msg, error, permanent)
+
+    def is_connected(self) -> bool:
+        """Whether the consumer is connected to the broker."""
+        return self.pulsar_client.is_connected()
+
+    def close(self):
+        """Close the wrapped client and the receiving thread."""
+        self.pulsar_client.flush()
+        self.pulsar_client.close()
+        self._receiver.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,288 @@
+"""Registration stores that don't need Postgres.
+
+They keep the duplicate semantics of DbClient, so the listener can run,
+be profiled and replay large volumes locally. `db.backend` in config.yml
+selects the store: `postgres` (default), `memory` or `sqlite`.
+"""
+
+import asyncio
+import dataclasses
+import sqlite3
+import threading
+from datetime import datetime
+
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+from app.periodic import PeriodicTask
+from app.services.db import (
+    AsyncDbClient,
+    DbClient,
+    RegistrationResult,
+    RegistrationStore,
+    SipDelivery,
+    SipStatus,
+)
+
+
+def _stored(sip_delivery: SipDelivery) -> SipDelivery:
+    # Like the Postgres table, the stores don't keep the S3 domain.
+    return dataclasses.replace(sip_delivery, s3_domain="")
+
+
+class MemoryStore(RegistrationStore):
+    """Keeps the registered deliveries in a dict indexed by correlation_id."""
+
+    def __init__(self):
+        self.deliveries: dict[str, SipDelivery] = {}
+        self._lock = threading.Lock()
+
+    def register_sip_delivery(
+        self, sip_delivery: SipDelivery, fetch_existing: bool = True
+    ) -> RegistrationResult:
+        stored = _stored(sip_delivery)
+        with self._lock:
+            existing = self.deliveries.setdefault(sip_delivery.correlation_id, stored)
+        if existing is stored:
+            return RegistrationResult(inserted=True)
+        return RegistrationResult(
+            inserted=False, existing=existing if fetch_existing else None
+        )
+
+    def insert_sip_deliveries(self, batch: list[SipDelivery]) -> list[SipDelivery]:
+        duplicates = []
+        with self._lock:
+            for sip_delivery in batch:
+                if sip_delivery.correlation_id in self.deliveries:
+                    duplicates.append(sip_delivery)
+                else:
+                    self.deliveries[sip_delivery.correlation_id] = _stored(sip_delivery)
+        return duplicates
+
+
+_SQLITE_COLUMNS = "correlation_id, s3_bucket, s3_object_key, pid, status, failure_message, last_event_type, last_event_occurred_at"
+
+
+class SqliteStore(RegistrationStore):
+    """Keeps the registered deliveries in an SQLite database in WAL mode.
+
+    All threads share one connection. Writes are committed in groups: after
+    `commit_every` registrations or `commit_interval_ms`, whichever comes
+    first. Registrations that are not committed yet are still seen as
+    duplicates, but are lost when the process crashes.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        table: str,
+        commit_every: int = 100,
+        commit_interval_ms: int = 100,
+        log=None,
+    ):
+        """Open (or create) the database and its table.
+
+        Args:
+            path: The database file, `:memory:` for a private in-memory database.
+            table: The table to register the deliveries in.
+            commit_every: The number of registrations per commit.
+            commit_interval_ms: The maximum time a registration waits for its commit.
+            log: The logger to report commit errors on.
+        """
+        self.table = table
+        self.commit_every = commit_every
+        self._uncommitted = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only syncs at checkpoints; a commit stays atomic.
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "correlation_id TEXT PRIMARY KEY, s3_bucket TEXT NOT NULL, "
+            "s3_object_key TEXT NOT NULL, pid TEXT, status TEXT NOT NULL, "
+            "failure_message TEXT, last_event_type TEXT NOT NULL, "
+            "last_event_occurred_at TEXT NOT NULL)"
+        )
+        self.conn.commit()
+        # Only a duplicate correlation_id is skipped; OR IGNORE would also
+        # skip rows that violate a NOT NULL constraint.
+        self._insert_query = (
+            f"INSERT INTO {table} ({_SQLITE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (correlation_id) DO NOTHING"
+        )
+        self._select_query = (
+            f"SELECT {_SQLITE_COLUMNS} FROM {table} WHERE correlation_id = ?"
+        )
+        self._commit_task = (
+            PeriodicTask(
+                commit_interval_ms / 1000, self.commit, "sqlite-commit", log
+            ).start()
+            if commit_every > 1
+            else None
+        )
+
+    def _insert(self, sip_delivery: SipDelivery) -> bool:
+        """Insert a row in the current transaction; False if the correlation_id exists."""
+        cursor = self.conn.execute(
+            self._insert_query,
+            (
+                sip_delivery.correlation_id,
+                sip_delivery.s3_bucket,
+                sip_delivery.s3_object_key,
+                sip_delivery.pid,
+                sip_delivery.status.value,
+                sip_delivery.failure_message,
+                sip_delivery.last_event_type,
+                sip_delivery.last_event_occurred_at.isoformat(),
+            ),
+        )
+        return cursor.rowcount == 1
+
+    def _written(self, count: int):
+        """Account for written registrations, committing when enough are waiting."""
+        self._uncommitted += count
+        if self._uncommitted >= self.commit_every:
+            self.conn.commit()
+            self._uncommitted = 0
+
+    def register_sip_delivery(
+        self, sip_delivery: SipDelivery, fetch_existing: bool = True
+    ) -> RegistrationResult:
+        with self._lock:
+            if self._insert(sip_delivery):
+                self._written(1)
+                return RegistrationResult(inserted=True)
+            if not fetch_existing:
+                return RegistrationResult(inserted=False)
+            row = self.conn.execute(
+                self._select_query, (sip_delivery.correlation_id,)
+            ).fetchone()
+        return RegistrationResult(
+            inserted=False,
+            existing=SipDelivery(
+                correlation_id=row[0],
+                s3_bucket=row[1],
+                s3_object_key=row[2],
+                s3_domain="",
+                pid=row[3],
+                status=SipStatus(row[4]),
+                failure_message=row[5],
+                last_event_type=row[6],
+                last_event_occurred_at=datetime.fromisoformat(row[7]),
+            ),
+        )
+
+    def insert_sip_deliveries(self, batch: list[SipDelivery]) -> list[SipDelivery]:
+        with self._lock:
+            duplicates = [
+                sip_delivery for sip_delivery in batch if not self._insert(sip_delivery)
+            ]
+            self._written(len(batch) - len(duplicates))
+        return duplicates
+
+    def commit(self):
+        """Commit the registrations written so far."""
+        with self._lock:
+            if self._uncommitted:
+                self.conn.commit()
+                self._uncommitted = 0
+
+    def close(self):
+        if self._commit_task is not None:
+            self._commit_task.stop()
+        self.commit()
+        self.conn.close()
+
+
+class AsyncStore:
+    """asyncio interface to a RegistrationStore, for the `asyncio` engine.
+
+    The memory store answers from memory, so its calls are made on the event
+    loop directly. The calls of a store that blocks on I/O, like the SQLite
+    store with its file and commit lock, are made on a worker thread.
+    """
+
+    def __init__(self, store: RegistrationStore, blocking: bool = False):
+        """Wrap a store.
+
+        Args:
+            store: The store to wrap.
+            blocking: Whether the calls of the store block, and so must not
+                be made on the event loop.
+        """
+        self.store = store
+        self.blocking = blocking
+
+    async def _call(self, function, *args):
+        if self.blocking:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    async def open(self):
+        """Nothing to open; the store is ready."""
+
+    async def warm_up(self, timeout: float):
+        await self._call(self.store.warm_up, timeout)
+
+    async def register_sip_delivery(
+        self, sip_delivery: SipDelivery, fetch_existing: bool = True
+    ) -> RegistrationResult:
+        return await self._call(
+            self.store.register_sip_delivery, sip_delivery, fetch_existing
+        )
+
+    async def insert_sip_deliveries(
+        self, batch: list[SipDelivery]
+    ) -> list[SipDelivery]:
+        return await self._call(self.store.insert_sip_deliveries, batch)
+
+    def waiting_requests(self) -> int:
+        return self.store.waiting_requests()
+
+    def is_healthy(self) -> bool:
+        return self.store.is_healthy()
+
+    async def close(self):
+        await self._call(self.store.close)
+
+
+def _build_local_store(config_parser: ConfigParser, backend: str) -> RegistrationStore:
+    db_config = config_parser.app_cfg["db"]
+    if backend == "memory":
+        return MemoryStore()
+    if backend == "sqlite":
+        sqlite_config = db_config.get("sqlite", {})
+        return SqliteStore(
+            sqlite_config.get("path", "sip_deliveries.sqlite3"),
+            db_config.get("table") or "sip_deliveries",
+            commit_every=sqlite_config.get("commit_every", 100),
+            commit_interval_ms=sqlite_config.get("commit_interval_ms", 100),
+            log=logging.get_logger(__name__, config=config_parser),
+        )
+    raise ValueError(f"Unknown db backend: {backend}")
+
+
+def build_store(config_parser: ConfigParser) -> RegistrationStore:
+    """Build the store selected by `db.backend`.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    backend = config_parser.app_cfg["db"].get("backend", "postgres")
+    if backend == "postgres":
+        return DbClient(config_parser)
+    return _build_local_store(config_parser, backend)
+
+
+def build_async_store(config_parser: ConfigParser) -> AsyncDbClient | AsyncStore:
+    """Build the store selected by `db.backend` for the `asyncio` engine.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    backend = config_parser.app_cfg["db"].get("backend", "postgres")
+    if backend == "postgres":
+        return AsyncDbClient(config_parser)
+    store = _build_local_store(config_parser, backend)
+    return AsyncStore(store, blocking=isinstance(store, SqliteStore))
@@ -0,0 +1,286 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+from app import metrics
+from app.health import start_health_server
+
+# Running several consumers on one subscription needs a shared subscription.
+_SHARED_SUBSCRIPTION_TYPES = ("Shared", "KeyShared")
+# Workers that crash right after starting are restarted with a growing delay.
+_MAX_RESTART_DELAY = 60
+
+
+def run_listener(on_heartbeat: Callable[[], None] | None = None):
+    """Run the configured listener engine until it is stopped.
+
+    Args:
+        on_heartbeat: Called on every iteration of the receive loop.
+    """
+    # Imported here so a worker process only loads the engine it runs.
+    from app.app import EventListener
+    from app.async_app import AsyncEventListener
+
+    engine = ConfigParser().app_cfg.get("listener", {}).get("engine", "sync")
+    if engine == "asyncio":
+        listener = AsyncEventListener()
+        listener.on_heartbeat = on_heartbeat
+        asyncio.run(listener.start_listening())
+    else:
+        listener = EventListener()
+        listener.on_heartbeat = on_heartbeat
+        listener.start_listening()
+
+
+def _run_worker(index: int, heartbeats):
+    """Entry point of a worker process."""
+
+    def beat():
+        heartbeats[index] = time.time()
+
+    run_listener(beat)
+
+
+class Supervisor:
+    """Runs the listener in several worker processes on a shared subscription.
+
+    Every worker has its own Pulsar and database clients. The supervisor
+    restarts workers that exit or miss their heartbeat, forwards SIGTERM and
+    SIGINT to them, as well as the profiling signal, and serves the metrics
+    of all workers together.
+    """
+
+    def __init__(self, config_parser: ConfigParser, processes: int):
+        """Initialize the supervisor without starting any worker.
+
+        Args:
+            config_parser: The configuration.
+            processes: The number of worker processes.
+
+        Raises:
+            ValueError: If the subscription can't be shared by several consumers.
+        """
+        self.log = logging.get_logger(__name__, config=config_parser)
+        config = config_parser.app_cfg
+        subscription_type = config["pulsar"].get("subscription_type", "Exclusive")
+        if subscription_type not in _SHARED_SUBSCRIPTION_TYPES:
+            raise ValueError(
+                f"Running {processes} processes requires a Shared or KeyShared subscription, not {subscription_type}."
+            )
+        listener_config = config.get("listener", {})
+        self.processes = processes
+        self.shutdown_timeout = listener_config.get("shutdown_timeout", 30)
+        self.heartbeat_timeout = listener_config.get("heartbeat_timeout", 60)
+        self.metrics_config = config.get("metrics", {})
+        self.health_config = config.get("health", {})
+        profiling_config = config.get("profiling", {})
+        self.profiling_signal = (
+            signal.Signals[profiling_config.get("signal", "SIGUSR1")]
+            if profiling_config.get("enabled", False)
+            else None
+        )
+        self._context = multiprocessing.get_context("spawn")
+        self._heartbeats = self._context.RawArray("d", processes)
+        self._workers: list[multiprocessing.process.BaseProcess | None] = [
+            None
+        ] * processes
+        self._started_at = [0.0] * processes
+        self._started_wall = [0.0] * processes
+        self._restart_at = [0.0] * processes
+        self._restarts = [0] * processes
+        self._crashes = [0] * processes
+        self._stopping = threading.Event()
+
+    def stop(self):
+        """Stop the workers and the supervisor."""
+        self._stopping.set()
+
+    def run(self):
+        """Start the workers and keep them running until SIGTERM or SIGINT."""
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: self.stop())
+        if self.profiling_signal is not None:
+            signal.signal(
+                self.profiling_signal,
+                lambda signum, frame: self._forward_profiling_signal(),
+            )
+        metrics_dir = self._prepare_metrics_dir()
+        try:
+            metrics.start_multiprocess_metrics_server(self.metrics_config, self)
+            start_health_server(self.health_config, self.liveness, self.readiness)
+            for index in range(self.processes):
+                self._start(index)
+            self.log.info(f"Started {self.processes} worker processes.")
+            while not self._stopping.wait(1.0):
+                for index in range(self.processes):
+                    self._check(index)
+            self._stop_workers()
+        finally:
+            if metrics_dir is not None:
+                shutil.rmtree(metrics_dir, ignore_errors=True)
+
+    def _prepare_metrics_dir(self) -> str | None:
+        """Point the workers to a directory to share their metrics through.
+
+        Returns:
+            The directory if it was created here and must be removed afterwards.
+        """
+        metrics_dir = os.environ.get(metrics.MULTIPROCESS_DIR_ENV)
+        if metrics_dir:
+            # Values of a previous run must not be aggregated.
+            for path in Path(metrics_dir).glob("*.db"):
+                path.unlink()
+            return None
+        metrics_dir = tempfile.mkdtemp(prefix="sip-delivery-registrator-metrics-")
+        # Inherited by the worker processes.
+        os.environ[metrics.MULTIPROCESS_DIR_ENV] = metrics_dir
+        return metrics_dir
+
+    def _silent_for(self, index: int) -> float:
+        """The seconds since the last heartbeat of a worker.
+
+        Starting up counts as a heartbeat, so a worker gets the heartbeat
+        timeout to warm up.
+        """
+        return time.time() - max(self._heartbeats[index], self._started_wall[index])
+
+    def _start(self, index: int):
+        # A worker only beats once it warmed up and consumes.
+        self._heartbeats[index] = 0.0
+        self._started_wall[index] = time.time()
+        worker = self._context.Process(
+            target=_run_worker,
+            args=(index, self._heartbeats),
+            name=f"worker-{index}",
+        )
+        worker.start()
+        self._workers[index] = worker
+        self._started_at[index] = time.monotonic()
+
+    def _check(self, index: int):
+        """Restart a worker that exited or missed its heartbeat."""
+        worker = self._workers[index]
+        if worker is None:
+            if time.monotonic() >= self._restart_at[index]:
+                self._start(index)
+            return
+
+        if worker.is_alive():
+            silent_for = self._silent_for(index)
+            if silent_for <= self.heartbeat_timeout:
+                return
+            self.log.error(
+                f"Worker {index} (pid {worker.pid}) missed its heartbeat for {silent_for:.0f}s, restarting it."
+            )
+            worker.kill()
+            worker.join()
+        else:
+            self.log.error(
+                f"Worker {index} (pid {worker.pid}) exited with code {worker.exitcode}, restarting it."
+            )
+        metrics.mark_process_dead(worker.pid)
+        self._workers[index] = None
+
+        # A worker that ran for a while is restarted right away, one that
+        # keeps crashing with a growing delay.
+        if time.monotonic() - self._started_at[index] > _MAX_RESTART_DELAY:
+            self._crashes[index] = 0
+        delay = min(_MAX_RESTART_DELAY, 2 ** self._crashes[index] - 1)
+        self._crashes[index] += 1
+        self._restarts[index] += 1
+        self._restart_at[index] = time.monotonic() + delay
+
+    def _forward_profiling_signal(self):
+        """Start a capture in every worker that consumes.
+
+        A worker that didn't beat yet may not handle the signal, which would
+        terminate it, so it is skipped.
+        """
+        for index, worker in enumerate(self._workers):
+            if worker is None or not worker.is_alive():
+                continue
+            if self._heartbeats[index] == 0.0:
+                self.log.info(
+                    f"Worker {index} (pid {worker.pid}) is starting, not profiling it."
+                )
+                continue
+            os.kill(worker.pid, self.profiling_signal)
+
+    def _stop_workers(self):
+        """Forward the shutdown to the workers and wait until they have drained."""
+        workers = [worker for worker in self._workers if worker is not None]
+        self.log.info(f"Stopping {len(workers)} worker processes.")
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        # Give the workers their own shutdown deadline, and a little more.
+        deadline = time.monotonic() + self.shutdown_timeout + 5
+        for worker in workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+            if worker.is_alive():
+                self.log.error(
+                    f"Worker {worker.name} (pid {worker.pid}) did not stop in time, killing it."
+                )
+                worker.kill()
+                worker.join()
+        self.log.info("Stopped all worker processes.")
+
+    def liveness(self) -> tuple[bool, dict]:
+        """The supervisor is live while it runs; it restarts unhealthy workers itself."""
+        return True, {"live": True}
+
+    def readiness(self) -> tuple[bool, dict]:
+        """Ready when every worker warmed up and beats."""
+        workers = {}
+        for index, worker in enumerate(self._workers):
+            workers[str(index)] = (
+                worker is not None
+                and worker.is_alive()
+                and self._heartbeats[index] > 0
+                and self._silent_for(index) <= self.heartbeat_timeout
+            )
+        ready = all(workers.values())
+        return ready, {"ready": ready, "workers": workers}
+
+    def collect(self):
+        """Report the health of the workers; the supervisor is a Prometheus collector."""
+        alive = GaugeMetricFamily(
+            "sip_delivery_registrator_workers_alive",
+            "Worker processes that are running.",
+        )
+        alive.add_metric(
+            [],
+            sum(
+                1
+                for worker in self._workers
+                if worker is not None and worker.is_alive()
+            ),
+        )
+        yield alive
+
+        heartbeat_age = GaugeMetricFamily(
+            "sip_delivery_registrator_worker_heartbeat_age_seconds",
+            "Time since the last heartbeat of a worker process.",
+            labels=["worker"],
+        )
+        restarts = CounterMetricFamily(
+            "sip_delivery_registrator_worker_restarts",
+            "Restarts of a worker process.",
+            labels=["worker"],
+        )
+        for index in range(self.processes):
+            heartbeat_age.add_metric([str(index)], self._silent_for(index))
+            restarts.add_metric([str(index)], self._restarts[index])
+        yield heartbeat_age
+        yield restarts
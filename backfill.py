@@ -0,0 +1,58 @@
+import argparse
+from datetime import datetime
+
+from app.backfill import Backfill, read_file, read_topic
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Register the deliveries of historical events in bulk."
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--since",
+        type=datetime.fromisoformat,
+        help="Replay the topic from this ISO 8601 timestamp, in local time unless it has an offset.",
+    )
+    source.add_argument(
+        "--file",
+        help="Load the events from a file with one structured CloudEvent per line.",
+    )
+    parser.add_argument(
+        "--topic",
+        help="The topic to replay, defaults to pulsar.consumer_topic.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="The number of deliveries to register per COPY (default: 1000).",
+    )
+    parser.add_argument(
+        "--produce",
+        action="store_true",
+        help="Produce the outgoing events of the newly registered deliveries.",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=10,
+        help="The seconds between two progress lines (default: 10).",
+    )
+    args = parser.parse_args()
+
+    backfill = Backfill(
+        args.batch_size,
+        args.produce,
+        args.progress_interval,
+        replay=args.since is not None,
+    )
+    messages = (
+        read_file(args.file)
+        if args.file
+        else read_topic(
+            backfill.client,
+            args.topic or backfill.config["pulsar"]["consumer_topic"],
+            args.since,
+        )
+    )
+    backfill.run(messages)
@@ -0,0 +1,209 @@
+"""In-memory stand-ins for PulsarClient and DbClient.
+
+They implement the parts of the clients that the EventListener uses, with an
+optional latency per call to mimic the round-trips to Pulsar and Postgres.
+"""
+
+import time
+from collections import deque
+from collections.abc import Callable, Iterable
+from uuid import uuid4
+
+from cloudevents.events import CEMessageMode, Event, EventAttributes, PulsarBinding
+
+from app.services.db import RegistrationResult, SipDelivery
+from app.services.stores import MemoryStore
+
+
+def _wait(latency: float):
+    if latency > 0:
+        time.sleep(latency)
+
+
+class FakeMessage:
+    """A received Pulsar message."""
+
+    def __init__(self, data: bytes, properties: dict[str, str], event_timestamp: int):
+        self._data = data
+        self._properties = properties
+        self._event_timestamp = event_timestamp
+        self._message_id = uuid4().hex
+
+    def data(self) -> bytes:
+        return self._data
+
+    def value(self) -> bytes:
+        return self._data
+
+    def properties(self) -> dict[str, str]:
+        return self._properties
+
+    def event_timestamp(self) -> int:
+        return self._event_timestamp
+
+    def publish_timestamp(self) -> int:
+        return self._event_timestamp
+
+    def partition_key(self) -> str:
+        return ""
+
+    def ordering_key(self) -> str:
+        return ""
+
+    def message_id(self) -> str:
+        return self._message_id
+
+    def redelivery_count(self) -> int:
+        return 0
+
+    def topic_name(self) -> str:
+        return "benchmark"
+
+
+def build_message(
+    correlation_id: str,
+    payload_bytes: int = 0,
+    mode: CEMessageMode = CEMessageMode.BINARY,
+) -> FakeMessage:
+    """Serialize an s3.object.create event the way tests/containers/producer.py does.
+
+    Args:
+        correlation_id: The correlation_id of the event.
+        payload_bytes: The size of the extra, unused data in the S3 record.
+        mode: The content mode of the CloudEvent.
+    """
+    record = {
+        "eventVersion": "0.1",
+        "eventSource": "swarm:s3",
+        "eventTime": "2024-07-04 12:41:48,847",
+        "eventName": "ObjectCreated:MULTIPART_COMPLETE",
+        "userIdentity": {"principalId": "aanlevering+or-1111111"},
+        "requestParameters": {"sourceIPAddress": "127.0.0.1"},
+        "responseElements": {
+            "x-request-id": "126E12690C6A2976-06a943108c27f8239d4868cc6ebd5c5f",
+            "x-amz-request-id": "126E12690C6A2976-06a943108c27f8239d4868cc6ebd5c5f",
+        },
+        "s3": {
+            "domain": {
+                "name": "s3.endpoint",
+                "s3-endpoint": "bucketname.s3.endpoint",
+            },
+            "bucket": {
+                "name": "bucketname",
+                "ownerIdentity": {
+                    "principalId": "aanlevering+or-1111111",
+                    "orId": "OR-1111111",
+                },
+            },
+            "object": {"key": f"{correlation_id}.zip"},
+        },
+    }
+    if payload_bytes:
+        record["s3"]["object"]["metadata"] = "x" * payload_bytes
+    data = {"s3_message": {"Records": [record]}}
+
+    attr = EventAttributes(correlation_id=correlation_id, subject="subject")
+    event = Event(attr, data)
+    msg = PulsarBinding.to_protocol(event, mode)
+    return FakeMessage(msg.data, msg.attributes, event.get_event_time_as_int())
+
+
+class FakePulsarClient:
+    """Stand-in for PulsarClient that serves pre-serialized messages."""
+
+    def __init__(
+        self,
+        messages: Iterable[FakeMessage] = (),
+        receive_latency: float = 0.0,
+        produce_latency: float = 0.0,
+        batch_size: int = 100,
+    ):
+        """Initialize the client.
+
+        Args:
+            messages: The messages to receive, in order.
+            receive_latency: The seconds each receive takes.
+            produce_latency: The seconds each produce takes.
+            batch_size: The maximum number of messages per batch receive.
+        """
+        self.messages = deque(messages)
+        self.receive_latency = receive_latency
+        self.produce_latency = produce_latency
+        self.batch_size = batch_size
+        self.batch_receive_enabled = False
+        self.async_send_enabled = False
+        self.produced = 0
+        self.acked = 0
+        self.nacked = 0
+
+    def receive(self, timeout_millis: int | None = None) -> FakeMessage | None:
+        _wait(self.receive_latency)
+        return self.messages.popleft() if self.messages else None
+
+    def batch_receive(self) -> list[FakeMessage]:
+        _wait(self.receive_latency)
+        count = min(self.batch_size, len(self.messages))
+        return [self.messages.popleft() for _ in range(count)]
+
+    def produce_event(
+        self,
+        topic: str,
+        event: Event,
+        callback: Callable[[bool], None] | None = None,
+        sequence_id: int | None = None,
+    ):
+        PulsarBinding.to_protocol(event, CEMessageMode.STRUCTURED)
+        _wait(self.produce_latency)
+        self.produced += 1
+        if callback is not None:
+            callback(True)
+
+    def send_event(
+        self,
+        topic: str,
+        event: Event,
+        callback: Callable[[bool], None],
+        sequence_id: int | None = None,
+    ):
+        self.produce_event(topic, event, callback, sequence_id)
+
+    def acknowledge(self, msg):
+        self.acked += 1
+
+    def negative_acknowledge(self, msg):
+        self.nacked += 1
+
+    def fail(self, msg, error: Exception | None = None, permanent: bool = False):
+        self.negative_acknowledge(msg)
+
+    def sequence_id(self, msg, index: int = 0) -> int | None:
+        return None
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeDbClient(MemoryStore):
+    """Stand-in for DbClient: the in-memory store with a latency per (batch) insert."""
+
+    def __init__(self, insert_latency: float = 0.0):
+        """Initialize the client.
+
+        Args:
+            insert_latency: The seconds each (batch) insert takes.
+        """
+        super().__init__()
+        self.insert_latency = insert_latency
+
+    def register_sip_delivery(
+        self, sip_delivery: SipDelivery, fetch_existing: bool = True
+    ) -> RegistrationResult:
+        _wait(self.insert_latency)
+        return super().register_sip_delivery(sip_delivery, fetch_existing)
+
+    def insert_sip_deliveries(self, batch: list[SipDelivery]) -> list[SipDelivery]:
+        _wait(self.insert_latency)
+        return super().insert_sip_deliveries(batch)
@@ -0,0 +1,197 @@
+"""Benchmark the EventListener against in-memory stand-ins of Pulsar and Postgres.
+
+Usage:
+
+    $ python -m benchmarks.run --messages 10000 --duplicate-ratio 0.1
+
+Every run is appended to a JSONL results file, so runs can be compared over
+time with `--history`.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import UTC, datetime
+from pathlib import Path
+from uuid import uuid4
+
+from app.services.db import SipDelivery
+from benchmarks.fakes import FakeDbClient, FakePulsarClient, build_message
+
+RESULTS_FILE = Path(__file__).parent / "results" / "results.jsonl"
+
+# The ConfigParser resolves these from the environment; their values don't
+# matter because no real client is created.
+_ENV_DEFAULTS = {
+    "PULSAR_HOST": "localhost",
+    "PULSAR_PORT": "6650",
+    "REGISTRATOR_CONSUMER_TOPIC": "benchmark-in",
+    "REGISTRATOR_PRODUCER_TOPIC": "benchmark-out",
+    "DB_HOST": "localhost",
+    "DB_PORT": "5432",
+    "DB_NAME": "benchmark",
+    "DB_USERNAME": "benchmark",
+    "DB_PASSWORD": "benchmark",
+    "DB_TABLE": "sip_deliveries",
+}
+
+
+def _percentile(sorted_values: list[float], percentile: float) -> float:
+    index = min(len(sorted_values) - 1, round(percentile * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _build_listener(args: argparse.Namespace, count: int):
+    """Build an EventListener with stand-ins that serve `count` messages."""
+    # Imported here so the environment defaults are in place first.
+    from app.app import EventListener
+
+    correlation_ids = [str(uuid4()) for _ in range(count)]
+    db_client = FakeDbClient(insert_latency=args.db_latency_ms / 1000)
+    for correlation_id in correlation_ids[: round(count * args.duplicate_ratio)]:
+        db_client.deliveries[correlation_id] = SipDelivery(
+            correlation_id, "bucketname", f"{correlation_id}.zip", "s3.endpoint"
+        )
+    pulsar_client = FakePulsarClient(
+        (build_message(cid, args.payload_bytes) for cid in correlation_ids),
+        receive_latency=args.receive_latency_ms / 1000,
+        produce_latency=args.produce_latency_ms / 1000,
+        batch_size=args.batch_size,
+    )
+    listener = EventListener(db_client=db_client, pulsar_client=pulsar_client)
+    return listener, pulsar_client
+
+
+def _run(args: argparse.Namespace) -> dict:
+    listener, pulsar_client = _build_listener(args, args.messages)
+    step = listener.receive_messages if args.batch else listener.receive_message
+
+    latencies = []
+    started = time.perf_counter()
+    while pulsar_client.messages:
+        before = len(pulsar_client.messages)
+        step_started = time.perf_counter()
+        step()
+        elapsed = time.perf_counter() - step_started
+        handled = before - len(pulsar_client.messages)
+        latencies.extend([elapsed / handled] * handled)
+    duration = time.perf_counter() - started
+
+    # Tracing allocations slows everything down, so it gets a run of its own.
+    listener, pulsar_client = _build_listener(args, args.allocation_messages)
+    step = listener.receive_messages if args.batch else listener.receive_message
+    tracemalloc.start()
+    memory_before = tracemalloc.get_traced_memory()[0]
+    peaks = []
+    while pulsar_client.messages:
+        before = len(pulsar_client.messages)
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        step()
+        peak = tracemalloc.get_traced_memory()[1]
+        handled = before - len(pulsar_client.messages)
+        peaks.extend([(peak - current) / handled] * handled)
+    retained = tracemalloc.get_traced_memory()[0] - memory_before
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "messages_per_second": round(args.messages / duration, 1),
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 4),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 4),
+        "peak_bytes_per_message": round(statistics.fmean(peaks)),
+        "retained_bytes_per_message": round(retained / args.allocation_messages),
+        "produced": pulsar_client.produced,
+        "nacked": pulsar_client.nacked,
+    }
+
+
+def _print_history(results_file: Path):
+    if not results_file.exists():
+        print(f"No results in {results_file}")
+        return
+    print(
+        f"{'timestamp':<26} {'revision':<9} {'mode':<6} {'dup':>5} {'payload':>8} "
+        f"{'msg/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'B/msg':>8}"
+    )
+    with open(results_file, encoding="utf-8") as f:
+        for line in f:
+            run = json.loads(line)
+            params, results = run["parameters"], run["results"]
+            print(
+                f"{run['timestamp']:<26} {run['revision'] or '-':<9} "
+                f"{'batch' if params['batch'] else 'single':<6} "
+                f"{params['duplicate_ratio']:>5} {params['payload_bytes']:>8} "
+                f"{results['messages_per_second']:>10} {results['p50_ms']:>9} "
+                f"{results['p99_ms']:>9} {results['peak_bytes_per_message']:>8}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0)
+    parser.add_argument(
+        "--payload-bytes",
+        type=int,
+        default=0,
+        help="Extra, unused data added to the S3 record of each event.",
+    )
+    parser.add_argument("--batch", action="store_true", help="Use batch receive.")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--receive-latency-ms", type=float, default=0.0)
+    parser.add_argument("--db-latency-ms", type=float, default=0.0)
+    parser.add_argument("--produce-latency-ms", type=float, default=0.0)
+    parser.add_argument(
+        "--allocation-messages",
+        type=int,
+        default=1_000,
+        help="The number of messages in the (slower) allocation tracing run.",
+    )
+    parser.add_argument("--results-file", type=Path, default=RESULTS_FILE)
+    parser.add_argument(
+        "--history", action="store_true", help="Show the stored results and exit."
+    )
+    args = parser.parse_args()
+
+    if args.history:
+        _print_history(args.results_file)
+        return
+
+    for key, value in _ENV_DEFAULTS.items():
+        os.environ.setdefault(key, value)
+
+    run = {
+        "timestamp": datetime.now(UTC).isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "parameters": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("results_file", "history")
+        },
+        "results": _run(args),
+    }
+    args.results_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.results_file, "a", encoding="utf-8") as f:
+        f.write(json.dumps(run) + "\n")
+    print(json.dumps(run, indent=2))
+
+
+if __name__ == "__main__":
+    main()
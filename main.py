@@ -1,4 +1,25 @@
-from app.app import EventListener
+import argparse
+
+from viaa.configuration import ConfigParser
+
+from app.supervisor import Supervisor, run_listener
 
 if __name__ == "__main__":
-    EventListener().start_listening()
+    parser = argparse.ArgumentParser(
+        description="Register deliveries of incoming SIP packages."
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="The number of worker processes, defaults to listener.processes.",
+    )
+    args = parser.parse_args()
+
+    config_parser = ConfigParser()
+    processes = args.processes or config_parser.app_cfg.get("listener", {}).get(
+        "processes", 1
+    )
+    if processes > 1:
+        Supervisor(config_parser, processes).run()
+    else:
+        run_listener()
@@ -0,0 +1,4 @@
+from app.relay import OutboxRelay
+
+if __name__ == "__main__":
+    OutboxRelay().run()
@@ -0,0 +1,23 @@
+import pytest
+
+# The configuration resolves these from the environment; the unit tests
+# don't create real clients with them.
+ENV = {
+    "PULSAR_HOST": "localhost",
+    "PULSAR_PORT": "6650",
+    "REGISTRATOR_CONSUMER_TOPIC": "test-in",
+    "REGISTRATOR_PRODUCER_TOPIC": "test-out",
+    "DB_HOST": "localhost",
+    "DB_PORT": "5432",
+    "DB_NAME": "test",
+    "DB_USERNAME": "test",
+    "DB_PASSWORD": "test",
+    "DB_TABLE": "sip_deliveries",
+}
+
+
+@pytest.fixture
+def env(monkeypatch):
+    """Set the environment that config.yml refers to."""
+    for key, value in ENV.items():
+        monkeypatch.setenv(key, value)
@@ -1,3 +1,4 @@
+import copy
 import os
 from uuid import uuid4
 
@@ -16,7 +17,11 @@ class ProducerTest:
         self.client = pulsar.Client(f"pulsar://{self.pulsar_host}:{self.pulsar_port}")
         self.producer = self.client.create_producer(self.producer_topic)
 
-    def produce_event(self, correlation_id: str = str(uuid4())):
+    def produce_event(
+        self,
+        correlation_id: str = str(uuid4()),
+        object_keys: tuple[str, ...] = ("object_key.zip",),
+    ):
         data = {
             "s3_message": {
                 "Records": [
@@ -50,11 +55,20 @@ class ProducerTest:
             }
         }
 
+        # One record per object key
+        (record,) = data["s3_message"]["Records"]
+        data["s3_message"]["Records"] = []
+        for object_key in object_keys:
+            record = copy.deepcopy(record)
+            record["s3"]["object"]["key"] = object_key
+            data["s3_message"]["Records"].append(record)
+
         attr = EventAttributes(correlation_id=correlation_id, subject="subject")
         event = Event(attr, data)
         msg = PulsarBinding.to_protocol(event, CEMessageMode.BINARY)
         self.producer.send(
             msg.data,
             properties=msg.attributes,
+            partition_key=correlation_id,
             event_timestamp=event.get_event_time_as_int(),
         )
@@ -1,7 +1,21 @@
-from datetime import UTC, datetime
+import threading
+from datetime import UTC, date, datetime
 from uuid import uuid4
 
+import pulsar
+import pytest
 from cloudevents.events import PulsarBinding
+from psycopg.errors import CheckViolation
+
+from app.app import EventListener
+from app.services.db import (
+    OutboxEvent,
+    SipDelivery,
+    _conninfo,
+    _register_params,
+    _register_query,
+)
+from app.services.partitions import PartitionManager
 
 
 def test_receive_message(
@@ -135,3 +149,255 @@ def test_receive_message_duplicate_key(
     assert payload["s3_object_key"] == "object_key.zip"
     assert payload["s3_domain"] == "s3.endpoint"
     assert "message" in payload
+
+
+def test_receive_messages_batch_with_duplicate(
+    setup_schema,
+    db_client,
+    event_listener,
+    producer,
+    insert_sip_delivery,
+    outgoing_consumer,
+):
+    """
+    Flow batch with a duplicate:
+      - Pre-insert one of the records as test setup
+      - Send a new and a duplicate message
+      - Register them as one batch
+      - Assert a successful event for the new and a failed one for the duplicate
+    """
+    new_correlation_id = str(uuid4())
+    duplicate_correlation_id = str(uuid4())
+    insert_sip_delivery(duplicate_correlation_id)
+
+    producer.produce_event(new_correlation_id)
+    producer.produce_event(duplicate_correlation_id)
+
+    outcomes = {}
+    while len(outcomes) < 2:
+        event_listener.receive_messages()
+        try:
+            while True:
+                msg = outgoing_consumer.receive(timeout_millis=1000)
+                outgoing_consumer.acknowledge(msg)
+                event = PulsarBinding.from_protocol(msg)
+                correlation_id = event.get_attributes().get("correlation_id")
+                outcomes[correlation_id] = event.has_successful_outcome()
+        except pulsar.Timeout:
+            pass
+
+    assert outcomes == {new_correlation_id: True, duplicate_correlation_id: False}
+
+    # Assert both records exist exactly once
+    with db_client.pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT COUNT(*) FROM public.sip_deliveries WHERE correlation_id IN (%s, %s)",
+                (new_correlation_id, duplicate_correlation_id),
+            )
+            (count,) = cur.fetchone()
+            assert count == 2
+
+
+def test_receive_message_multiple_records(
+    setup_schema, db_client, event_listener, producer, outgoing_consumer
+):
+    """
+    Flow notification with multiple records:
+      - Consume a message with two records
+      - Persist a record for each
+      - Produce an event for each, the first with the incoming correlation_id
+    """
+    correlation_id = str(uuid4())
+
+    producer.produce_event(correlation_id, ("first.zip", "second.zip"))
+    event_listener.receive_message()
+
+    events = []
+    for _ in range(2):
+        msg = outgoing_consumer.receive(timeout_millis=5000)
+        outgoing_consumer.acknowledge(msg)
+        events.append(PulsarBinding.from_protocol(msg))
+
+    assert all(event.has_successful_outcome() for event in events)
+    assert [event.get_data()["s3_object_key"] for event in events] == [
+        "first.zip",
+        "second.zip",
+    ]
+    correlation_ids = [event.get_attributes().get("correlation_id") for event in events]
+    assert correlation_ids[0] == correlation_id
+    assert correlation_ids[1] != correlation_id
+
+    with db_client.pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT correlation_id, s3_object_key FROM public.sip_deliveries WHERE correlation_id IN (%s, %s)",
+                correlation_ids,
+            )
+            rows = {str(cid): key for cid, key in cur.fetchall()}
+    assert rows == {correlation_ids[0]: "first.zip", correlation_ids[1]: "second.zip"}
+
+    # A redelivery registers nothing new
+    producer.produce_event(correlation_id, ("first.zip", "second.zip"))
+    event_listener.receive_message()
+    for _ in range(2):
+        msg = outgoing_consumer.receive(timeout_millis=5000)
+        outgoing_consumer.acknowledge(msg)
+        assert not PulsarBinding.from_protocol(msg).has_successful_outcome()
+
+
+def test_start_listening_drains_and_shuts_down(
+    setup_schema, event_listener, producer, outgoing_consumer
+):
+    """
+    Flow graceful shutdown:
+      - Listen until stopped
+      - Assert the message was handled and the clients are closed
+      - Assert a new listener gets no redelivery
+    """
+    correlation_id = str(uuid4())
+    producer.produce_event(correlation_id)
+
+    threading.Timer(5, event_listener.stop).start()
+    event_listener.start_listening()
+
+    msg = outgoing_consumer.receive(timeout_millis=5000)
+    outgoing_consumer.acknowledge(msg)
+    event = PulsarBinding.from_protocol(msg)
+    assert event.get_attributes().get("correlation_id") == correlation_id
+    assert event_listener.db_client.pool.closed
+
+    next_listener = EventListener()
+    try:
+        assert next_listener.pulsar_client.receive(timeout_millis=2000) is None
+    finally:
+        next_listener.shutdown()
+
+
+def test_copy_sip_deliveries_skips_duplicates(
+    setup_schema, db_client, insert_sip_delivery
+):
+    """
+    Flow bulk load:
+      - Pre-insert one of the records as test setup
+      - COPY a new record twice and the existing one
+      - Assert the new record is inserted once and the others are reported
+    """
+    new_correlation_id = str(uuid4())
+    existing_correlation_id = insert_sip_delivery(str(uuid4()))
+    batch = [
+        SipDelivery(new_correlation_id, "bucketname", "first.zip", "domain"),
+        SipDelivery(existing_correlation_id, "bucketname", "other.zip", "domain"),
+        SipDelivery(new_correlation_id, "bucketname", "second.zip", "domain"),
+    ]
+
+    duplicates = db_client.copy_sip_deliveries(batch)
+
+    assert duplicates == batch[1:]
+    with db_client.pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT s3_object_key FROM public.sip_deliveries WHERE correlation_id = %s",
+                (new_correlation_id,),
+            )
+            assert cur.fetchall() == [("first.zip",)]
+
+    # The staging table is emptied with every transaction
+    assert db_client.copy_sip_deliveries(batch[:1]) == batch[:1]
+
+
+def test_outbox_registers_and_relays(setup_schema, db_client):
+    """
+    Flow outbox:
+      - Register a record together with its outgoing event
+      - Register it again; the duplicate doesn't write an event
+      - Relay the outbox and assert the event is marked as sent
+    """
+    correlation_id = str(uuid4())
+    sip_delivery = SipDelivery(correlation_id, "bucketname", "object_key.zip", "domain")
+    outbox_event = OutboxEvent(correlation_id, "subject", "success", {"a": 1})
+    db_client.create_outbox()
+
+    assert db_client.register_sip_delivery(
+        sip_delivery, outbox_event=outbox_event
+    ).inserted
+    assert not db_client.register_sip_delivery(
+        sip_delivery, outbox_event=outbox_event
+    ).inserted
+    assert db_client.outbox_backlog()[0] == 1
+
+    published = []
+
+    def publish(rows):
+        published.extend(rows)
+        return [row[0] for row in rows]
+
+    assert db_client.relay_outbox(10, publish) == 1
+    assert [row[1:] for row in published] == [
+        (correlation_id, "subject", "success", {"a": 1}, outbox_event.time)
+    ]
+    assert db_client.outbox_backlog()[0] == 0
+    assert db_client.relay_outbox(10, publish) == 0
+
+
+def test_partitioned_table_keeps_correlation_ids_unique(db_client):
+    """
+    Flow partitioning:
+      - Create a table partitioned by month and maintain it
+      - Register a correlation_id in one month and again in the next
+      - Assert the second registration is skipped
+      - Detach the first month and register it once more
+      - Assert it is inserted, as the detached correlation_ids are forgotten
+      - Assert a row outside the partitions is rejected
+    """
+    table = "deliveries_by_month"
+    with db_client.pool.connection() as conn:
+        conn.execute(
+            f"CREATE TABLE public.{table} (correlation_id text NOT NULL, "
+            "s3_bucket text NOT NULL, s3_object_key text NOT NULL, "
+            "last_event_type text NOT NULL, last_event_occurred_at timestamptz NOT NULL, "
+            "PRIMARY KEY (correlation_id, last_event_occurred_at)) "
+            "PARTITION BY RANGE (last_event_occurred_at);"
+        )
+    manager = PartitionManager(
+        _conninfo(db_client.db_config), table, {"premake_months": 1}, db_client.log
+    )
+    manager.maintain(date(2024, 1, 15))
+
+    correlation_id = str(uuid4())
+    query = _register_query(table, False)
+
+    def register(month: int) -> bool:
+        sip_delivery = SipDelivery(
+            correlation_id,
+            "bucketname",
+            "object_key.zip",
+            "domain",
+            last_event_occurred_at=datetime(2024, month, 10, tzinfo=UTC),
+        )
+        with db_client.pool.connection() as conn:
+            return (
+                conn.execute(query, _register_params(sip_delivery, False)).fetchone()
+                is not None
+            )
+
+    assert register(1)
+    assert not register(2)
+
+    manager.retention_months = 1
+    manager.maintain(date(2024, 3, 15))
+
+    with db_client.pool.connection() as conn:
+        partitions = conn.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass ORDER BY 1;",
+            (f"public.{table}",),
+        ).fetchall()
+    assert partitions == [
+        (f"{table}_p202402",),
+        (f"{table}_p202403",),
+        (f"{table}_p202404",),
+    ]
+    assert register(3)
+    with pytest.raises(CheckViolation, match="no partition"):
+        register(6)
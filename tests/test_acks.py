@@ -0,0 +1,166 @@
+from app.services.acks import (
+    Acknowledger,
+    CumulativeAcknowledger,
+    GroupedAcknowledger,
+    build_acknowledger,
+)
+
+
+class FakeMessageId:
+    def __init__(self, entry_id: int, partition: int = -1):
+        self._entry_id = entry_id
+        self._partition = partition
+
+    def ledger_id(self) -> int:
+        return 1
+
+    def entry_id(self) -> int:
+        return self._entry_id
+
+    def batch_index(self) -> int:
+        return -1
+
+    def partition(self) -> int:
+        return self._partition
+
+
+class FakeMessage:
+    def __init__(self, entry_id: int, partition: int = -1):
+        self._message_id = FakeMessageId(entry_id, partition)
+
+    def message_id(self) -> FakeMessageId:
+        return self._message_id
+
+
+class FakeConsumer:
+    def __init__(self):
+        self.acked = []
+        self.cumulative_acked = []
+        self.nacked = []
+
+    def acknowledge(self, msg):
+        self.acked.append(msg)
+
+    def acknowledge_cumulative(self, msg):
+        self.cumulative_acked.append(msg)
+
+    def negative_acknowledge(self, msg):
+        self.nacked.append(msg)
+
+
+class FakeLog:
+    def __init__(self):
+        self.messages = []
+
+    def info(self, message):
+        self.messages.append(message)
+
+    warning = error = info
+
+
+def test_grouped_acks_are_sent_by_count():
+    consumer = FakeConsumer()
+    acknowledger = GroupedAcknowledger(consumer, 3, 60_000, FakeLog())
+    msgs = [FakeMessage(i) for i in range(4)]
+
+    for msg in msgs[:2]:
+        acknowledger.acknowledge(msg)
+    assert consumer.acked == []
+
+    acknowledger.acknowledge(msgs[2])
+    assert consumer.acked == msgs[:3]
+
+    acknowledger.acknowledge(msgs[3])
+    acknowledger.close()
+    assert consumer.acked == msgs
+
+
+def test_cumulative_acks_up_to_the_last_contiguous_message():
+    consumer = FakeConsumer()
+    acknowledger = CumulativeAcknowledger(consumer, 100, 60_000, FakeLog())
+    msgs = [FakeMessage(i) for i in range(4)]
+    for msg in msgs:
+        acknowledger.track(msg)
+
+    acknowledger.acknowledge(msgs[0])
+    acknowledger.acknowledge(msgs[1])
+    acknowledger.acknowledge(msgs[3])
+    acknowledger.flush()
+    assert consumer.cumulative_acked == [msgs[1]]
+
+    acknowledger.acknowledge(msgs[2])
+    acknowledger.close()
+    assert consumer.cumulative_acked == [msgs[1], msgs[3]]
+    assert consumer.acked == []
+
+
+def test_cumulative_acks_never_pass_a_nacked_message():
+    consumer = FakeConsumer()
+    acknowledger = CumulativeAcknowledger(consumer, 100, 60_000, FakeLog())
+    msgs = [FakeMessage(i) for i in range(3)]
+    for msg in msgs:
+        acknowledger.track(msg)
+
+    acknowledger.acknowledge(msgs[0])
+    acknowledger.negative_acknowledge(msgs[1])
+    acknowledger.acknowledge(msgs[2])
+    acknowledger.flush()
+    assert consumer.cumulative_acked == [msgs[0]]
+    assert consumer.nacked == [msgs[1]]
+    # The messages behind the nacked one are acknowledged individually.
+    assert consumer.acked == [msgs[2]]
+
+    # The redelivery is acknowledged cumulatively again.
+    redelivered = FakeMessage(1)
+    acknowledger.track(redelivered)
+    acknowledger.acknowledge(redelivered)
+    acknowledger.close()
+    assert consumer.cumulative_acked == [msgs[0], redelivered]
+
+
+def test_cumulative_acks_behind_a_pending_message_are_capped():
+    consumer = FakeConsumer()
+    acknowledger = CumulativeAcknowledger(consumer, 10, 60_000, FakeLog())
+    head, *msgs = [FakeMessage(i) for i in range(1001)]
+    for msg in (head, *msgs):
+        acknowledger.track(msg)
+
+    # The head waits to be retried while the messages behind it are handled.
+    for msg in msgs:
+        acknowledger.acknowledge(msg)
+        assert acknowledger._waiting < 10
+    assert consumer.cumulative_acked == []
+    assert consumer.acked == msgs
+
+    acknowledger.negative_acknowledge(head)
+    redelivered = FakeMessage(0)
+    acknowledger.track(redelivered)
+    acknowledger.acknowledge(redelivered)
+    acknowledger.close()
+    assert consumer.cumulative_acked == [redelivered]
+    assert consumer.acked == msgs
+
+
+def test_cumulative_acks_per_partition():
+    consumer = FakeConsumer()
+    acknowledger = CumulativeAcknowledger(consumer, 100, 60_000, FakeLog())
+    first, second = FakeMessage(1, partition=0), FakeMessage(1, partition=1)
+    for msg in (first, second):
+        acknowledger.track(msg)
+        acknowledger.acknowledge(msg)
+
+    acknowledger.close()
+    assert consumer.cumulative_acked == [first, second]
+
+
+def test_cumulative_falls_back_to_grouped_on_shared_subscriptions():
+    log = FakeLog()
+    acknowledger = build_acknowledger(
+        FakeConsumer(), {"strategy": "cumulative"}, "KeyShared", log
+    )
+    acknowledger.close()
+
+    assert isinstance(acknowledger, GroupedAcknowledger)
+    assert isinstance(
+        build_acknowledger(FakeConsumer(), {}, "Exclusive", log), Acknowledger
+    )
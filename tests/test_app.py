@@ -1,4 +1,294 @@
-import pytest
+import threading
+import time
+
+from cloudevents.events import EventOutcome
+
+from app.app import EventListener
+from app.services.db import SipDelivery
+from benchmarks.fakes import FakeDbClient, FakePulsarClient, build_message
+
+
+class RaisingPulsarClient(FakePulsarClient):
+    """Fails every send before it is queued, as on a full producer queue."""
+
+    def produce_event(self, topic, event, callback=None, sequence_id=None):
+        raise RuntimeError("Producer queue is full")
+
+
+class RecordingPulsarClient(FakePulsarClient):
+    """Keeps the produced events."""
+
+    def __init__(self, messages=()):
+        super().__init__(messages)
+        self.events = []
+
+    def produce_event(self, topic, event, callback=None, sequence_id=None):
+        self.events.append(event)
+        super().produce_event(topic, event, callback, sequence_id)
+
+
+class StoppingPulsarClient(FakePulsarClient):
+    """Stops the listener once all messages were received."""
+
+    listener = None
+
+    def receive(self, timeout_millis=None):
+        msg = super().receive(timeout_millis)
+        if msg is None and self.listener is not None:
+            self.listener.stop()
+        return msg
+
+
+class KeyedMessage:
+    """Wraps a message with the given (partition) key."""
+
+    def __init__(self, msg, key: str):
+        self._msg = msg
+        self._key = key
+
+    def __getattr__(self, name):
+        return getattr(self._msg, name)
+
+    def partition_key(self) -> str:
+        return self._key
+
+
+class RecordingLog:
+    def __init__(self):
+        self.warnings = []
+        self.errors = []
+
+    def warning(self, message):
+        self.warnings.append(message)
+
+    def info(self, message):
+        pass
+
+    def error(self, message):
+        self.errors.append(message)
+
+
+class OutboxDbClient(FakeDbClient):
+    """Writes the outbox events along with the registrations, like DbClient."""
+
+    def __init__(self):
+        super().__init__()
+        self.outbox = []
+
+    def register_sip_delivery(
+        self, sip_delivery, fetch_existing=True, outbox_event=None
+    ):
+        result = super().register_sip_delivery(sip_delivery, fetch_existing)
+        if outbox_event is not None and result.inserted:
+            self.outbox.append(outbox_event)
+        return result
+
+    def add_to_outbox(self, outbox_events):
+        self.outbox.extend(outbox_events)
+
 
 def test_sanity_check():
-    assert True
\ No newline at end of file
+    assert True
+
+
+def test_failed_send_fails_the_message(env):
+    pulsar_client = RaisingPulsarClient([build_message("a")])
+    pulsar_client.async_send_enabled = True
+    listener = EventListener(db_client=FakeDbClient(), pulsar_client=pulsar_client)
+
+    listener.receive_message()
+
+    assert pulsar_client.acked == 0
+    assert pulsar_client.nacked == 1
+
+
+def test_outbox_replaces_producing(env):
+    db_client = OutboxDbClient()
+    db_client.deliveries["b"] = SipDelivery("b", "bucketname", "b.zip", "")
+    pulsar_client = FakePulsarClient([build_message("a"), build_message("b")])
+    listener = EventListener(db_client=db_client, pulsar_client=pulsar_client)
+    # The outbox requires DbClient, so it is switched on after the checks.
+    listener.outbox_enabled = True
+
+    listener.receive_message()
+    listener.receive_message()
+
+    assert pulsar_client.produced == 0
+    assert pulsar_client.acked == 2
+    assert [(event.correlation_id, event.outcome) for event in db_client.outbox] == [
+        ("a", EventOutcome.SUCCESS.value),
+        ("b", EventOutcome.FAIL.value),
+    ]
+
+
+def test_failed_outbox_write_of_a_fail_event_retries_the_message(env):
+    db_client = OutboxDbClient()
+    db_client.deliveries["a"] = SipDelivery("a", "bucketname", "a.zip", "")
+    msg = build_message("a")
+    pulsar_client = FakePulsarClient([msg, msg])
+    listener = EventListener(db_client=db_client, pulsar_client=pulsar_client)
+    listener.outbox_enabled = True
+    listener.emitted = listener._build_emitted_cache({"enabled": True})
+    add_to_outbox = db_client.add_to_outbox
+
+    def fail_once(outbox_events):
+        db_client.add_to_outbox = add_to_outbox
+        raise RuntimeError("Connection lost")
+
+    db_client.add_to_outbox = fail_once
+
+    listener.receive_message()
+    listener.receive_message()
+
+    # The FAIL event isn't atomic with the duplicate check: the message is
+    # retried and the check repeated.
+    assert pulsar_client.nacked == 1
+    assert pulsar_client.acked == 1
+    assert [(event.correlation_id, event.outcome) for event in db_client.outbox] == [
+        ("a", EventOutcome.FAIL.value)
+    ]
+
+
+def test_redelivered_message_is_not_emitted_again(env):
+    msg = build_message("a")
+    pulsar_client = FakePulsarClient([msg, msg])
+    listener = EventListener(db_client=FakeDbClient(), pulsar_client=pulsar_client)
+    listener.emitted = listener._build_emitted_cache({"enabled": True})
+
+    listener.receive_message()
+    listener.receive_message()
+
+    assert pulsar_client.produced == 1
+    assert pulsar_client.acked == 2
+    assert pulsar_client.nacked == 0
+
+
+def test_suppressed_fail_event_is_still_logged(env):
+    db_client = FakeDbClient()
+    db_client.deliveries["a"] = SipDelivery("a", "bucketname", "existing.zip", "")
+    msg = build_message("a")
+    pulsar_client = FakePulsarClient([msg, msg])
+    listener = EventListener(db_client=db_client, pulsar_client=pulsar_client)
+    listener.emitted = listener._build_emitted_cache({"enabled": True})
+    listener.log = RecordingLog()
+
+    listener.receive_message()
+    listener.receive_message()
+
+    assert pulsar_client.produced == 1
+    assert len(listener.log.errors) == 2
+    assert "already exists" in listener.log.errors[1]
+    assert "emitted already" in listener.log.errors[1]
+
+
+def test_duplicate_in_a_batch_fails_only_its_own_message(env):
+    db_client = FakeDbClient()
+    db_client.deliveries["b"] = SipDelivery("b", "bucketname", "b.zip", "")
+    pulsar_client = RecordingPulsarClient(
+        [build_message("a"), build_message("b"), build_message("c")]
+    )
+    pulsar_client.batch_receive_enabled = True
+    listener = EventListener(db_client=db_client, pulsar_client=pulsar_client)
+
+    listener.receive_messages()
+
+    assert [
+        (event.correlation_id, event.has_successful_outcome())
+        for event in pulsar_client.events
+    ] == [("a", True), ("b", False), ("c", True)]
+    assert "already exists" in pulsar_client.events[1].get_data()["message"]
+    assert pulsar_client.acked == 3
+    assert sorted(db_client.deliveries) == ["a", "b", "c"]
+
+
+def test_duplicate_fail_event_describes_the_existing_record(env):
+    db_client = FakeDbClient()
+    db_client.deliveries["a"] = SipDelivery("a", "bucketname", "existing.zip", "")
+    pulsar_client = RecordingPulsarClient([build_message("a")])
+    listener = EventListener(db_client=db_client, pulsar_client=pulsar_client)
+
+    listener.receive_message()
+
+    (event,) = pulsar_client.events
+    assert not event.has_successful_outcome()
+    assert "s3_object_key: existing.zip" in event.get_data()["message"]
+    assert pulsar_client.acked == 1
+
+
+def test_workers_handle_the_messages_of_a_correlation_id_in_order(env):
+    msgs = [build_message(f"id-{i % 5}") for i in range(50)]
+    positions = {msg.message_id(): position for position, msg in enumerate(msgs)}
+    pulsar_client = StoppingPulsarClient(msgs)
+    listener = EventListener(db_client=FakeDbClient(), pulsar_client=pulsar_client)
+    pulsar_client.listener = listener
+    handled = []
+
+    def process_message(msg, event):
+        # Give the other workers a chance to overtake.
+        time.sleep(0.001 * (positions[msg.message_id()] % 3))
+        handled.append(
+            (
+                event.correlation_id,
+                threading.current_thread().name,
+                positions[msg.message_id()],
+            )
+        )
+
+    listener.process_message = process_message
+    listener.listen_concurrently(workers=4, queue_size=2)
+
+    assert len(handled) == 50
+    for correlation_id in {correlation_id for correlation_id, _, _ in handled}:
+        threads, order = zip(
+            *[
+                (thread, position)
+                for handled_id, thread, position in handled
+                if handled_id == correlation_id
+            ]
+        )
+        assert len(set(threads)) == 1
+        assert list(order) == sorted(order)
+
+
+def test_shutdown_with_full_worker_queues_keeps_the_deadline(env):
+    pulsar_client = FakePulsarClient([build_message(f"id-{i}") for i in range(10)])
+    listener = EventListener(db_client=FakeDbClient(), pulsar_client=pulsar_client)
+    listener.shutdown_timeout = 0.2
+    listener.receive_timeout_ms = 10
+    release = threading.Event()
+    # The only worker is stuck, so its queue stays full.
+    listener.process_message = lambda msg, event: release.wait()
+    stopper = threading.Timer(0.1, listener.stop)
+    stopper.start()
+
+    started = time.monotonic()
+    try:
+        listener.listen_concurrently(workers=1, queue_size=1)
+        elapsed = time.monotonic() - started
+    finally:
+        release.set()
+        stopper.join()
+
+    assert elapsed < 1
+    # The message waiting for room in the queue is redelivered.
+    assert pulsar_client.nacked == 1
+
+
+def test_key_shared_warns_once_about_messages_not_keyed_by_correlation_id(env):
+    pulsar_client = FakePulsarClient(
+        [
+            KeyedMessage(build_message("a"), "a"),
+            KeyedMessage(build_message("b"), "other"),
+            KeyedMessage(build_message("c"), "other"),
+        ]
+    )
+    listener = EventListener(db_client=FakeDbClient(), pulsar_client=pulsar_client)
+    listener.key_shared = True
+    listener.log = RecordingLog()
+
+    for _ in range(3):
+        listener.receive_message()
+
+    assert len(listener.log.warnings) == 1
+    assert "'b'" in listener.log.warnings[0]
+    assert pulsar_client.acked == 3
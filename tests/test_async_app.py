@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from app import async_app
+from app.async_app import AsyncEventListener
+from app.services.stores import AsyncStore, MemoryStore
+from benchmarks.fakes import FakePulsarClient, build_message
+
+
+class RefusingPulsarClient(FakePulsarClient):
+    """Reports every send as not persisted by the broker."""
+
+    def produce_event(self, topic, event, callback=None, sequence_id=None):
+        callback(False)
+
+
+@pytest.fixture
+def store():
+    return MemoryStore()
+
+
+@pytest.fixture
+def listener_for(env, monkeypatch, store):
+    """Build an AsyncEventListener on the in-memory store and a fake Pulsar client."""
+
+    def build(pulsar_client: FakePulsarClient) -> AsyncEventListener:
+        monkeypatch.setattr(
+            async_app, "build_async_store", lambda config_parser: AsyncStore(store)
+        )
+        monkeypatch.setattr(
+            async_app, "PulsarClient", lambda config_parser: pulsar_client
+        )
+        return AsyncEventListener()
+
+    return build
+
+
+async def consume_all(listener: AsyncEventListener):
+    try:
+        while (msg := await listener.pulsar_client.receive(100)) is not None:
+            await listener.process_message(msg)
+    finally:
+        listener.pulsar_client.close()
+
+
+def test_message_is_registered_produced_and_acked(listener_for, store):
+    pulsar_client = FakePulsarClient([build_message("a")])
+    listener = listener_for(pulsar_client)
+
+    asyncio.run(consume_all(listener))
+
+    assert pulsar_client.produced == 1
+    assert pulsar_client.acked == 1
+    assert pulsar_client.nacked == 0
+    assert list(store.deliveries) == ["a"]
+
+
+def test_unpersisted_event_nacks_the_message(listener_for):
+    pulsar_client = RefusingPulsarClient([build_message("a")])
+    listener = listener_for(pulsar_client)
+
+    asyncio.run(consume_all(listener))
+
+    assert pulsar_client.acked == 0
+    assert pulsar_client.nacked == 1
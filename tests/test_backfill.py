@@ -0,0 +1,135 @@
+import pytest
+from cloudevents.events import CEMessageMode
+from pulsar import Result
+
+from app import backfill as backfill_module
+from app.backfill import Backfill, read_file
+from app.decoding import decode_message
+from app.services.db import SipDelivery
+from benchmarks.fakes import FakeDbClient, build_message
+
+
+class CopyingDbClient(FakeDbClient):
+    """Records the size of every bulk load."""
+
+    def __init__(self):
+        super().__init__()
+        self.copies = []
+
+    def copy_sip_deliveries(self, batch):
+        self.copies.append(len(batch))
+        return super().copy_sip_deliveries(batch)
+
+
+class FakeProducer:
+    """Confirms every send and keeps the correlation_ids of the events."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_async(self, data, callback, partition_key=None, **kwargs):
+        self.sent.append(partition_key)
+        callback(Result.Ok, None)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class RecordingLog:
+    def __init__(self):
+        self.infos = []
+        self.errors = []
+
+    def info(self, message, *args):
+        self.infos.append(message % args if args else message)
+
+    def error(self, message):
+        self.errors.append(message)
+
+
+def write_events(path, correlation_ids: list[str]) -> str:
+    """Write an exported events file: one structured CloudEvent per line."""
+    path.write_bytes(
+        b"\n".join(
+            build_message(correlation_id, mode=CEMessageMode.STRUCTURED).data()
+            for correlation_id in correlation_ids
+        )
+        + b"\n\n"
+    )
+    return str(path)
+
+
+@pytest.fixture
+def db_client(monkeypatch):
+    db_client = CopyingDbClient()
+    monkeypatch.setattr(backfill_module, "build_store", lambda config_parser: db_client)
+    return db_client
+
+
+@pytest.fixture
+def build_backfill(env, db_client):
+    def build(batch_size: int = 1000, producer=None) -> Backfill:
+        backfill = Backfill(batch_size, progress_interval=3600)
+        backfill.producer = producer
+        backfill.log = RecordingLog()
+        return backfill
+
+    return build
+
+
+def test_read_file_skips_empty_lines(tmp_path):
+    path = write_events(tmp_path / "events.jsonl", ["a", "b"])
+
+    assert len(list(read_file(path))) == 2
+
+
+@pytest.mark.parametrize("fast_decode", [False, True])
+def test_backfill_registers_the_events_of_a_file(
+    build_backfill, db_client, tmp_path, fast_decode
+):
+    path = write_events(tmp_path / "events.jsonl", ["a", "b"])
+    backfill = build_backfill()
+    backfill.fast_decode = fast_decode
+
+    backfill.run(read_file(path))
+
+    # A file line has no properties; both decoders read its attributes from
+    # the structured body, the fast one without falling back.
+    if fast_decode:
+        assert all(decode_message(msg) is not None for msg in read_file(path))
+    assert backfill.log.errors == []
+    assert backfill.read == 2
+    assert sorted(db_client.deliveries) == ["a", "b"]
+    assert db_client.deliveries["a"].s3_object_key == "a.zip"
+
+
+def test_backfill_registers_in_batches_of_the_batch_size(
+    build_backfill, db_client, tmp_path
+):
+    path = write_events(tmp_path / "events.jsonl", [f"id-{i}" for i in range(5)])
+
+    build_backfill(batch_size=2).run(read_file(path))
+
+    assert db_client.copies == [2, 2, 1]
+
+
+@pytest.mark.parametrize("produce", [False, True])
+def test_backfill_skips_and_reports_the_registered_deliveries(
+    build_backfill, db_client, tmp_path, produce
+):
+    db_client.deliveries["b"] = SipDelivery("b", "bucketname", "existing.zip", "")
+    path = write_events(tmp_path / "events.jsonl", ["a", "b", "c"])
+    producer = FakeProducer() if produce else None
+    backfill = build_backfill(producer=producer)
+
+    backfill.run(read_file(path))
+
+    assert db_client.deliveries["b"].s3_object_key == "existing.zip"
+    assert any("2 registered, 1 duplicates" in line for line in backfill.log.infos)
+    if produce:
+        # Only the newly registered deliveries get an outgoing event.
+        assert producer.sent == ["a", "c"]
+        assert backfill.failed_sends == 0
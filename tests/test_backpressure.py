@@ -0,0 +1,45 @@
+from app.backpressure import BackpressureController
+
+
+def build_controller(max_waiting: int | None = 2) -> BackpressureController:
+    return BackpressureController(
+        max_latency=0.5,
+        resume_latency=0.1,
+        max_waiting=max_waiting,
+        probe_interval=1.0,
+        smoothing=0.5,
+    )
+
+
+def test_pauses_on_high_latency_and_resumes_after_recovery():
+    controller = build_controller()
+    assert controller.delay(waiting=0) == 0.0
+
+    controller.observe(2.0)
+    assert controller.delay(waiting=0) == 1.0
+    assert controller.paused
+
+    # Still above the resume latency
+    controller.observe(0.0)
+    controller.observe(0.0)
+    assert controller.delay(waiting=0) == 1.0
+
+    controller.observe(0.0)
+    controller.observe(0.0)
+    assert controller.delay(waiting=0) == 0.0
+    assert not controller.paused
+
+
+def test_pauses_while_requests_wait_for_a_connection():
+    controller = build_controller()
+
+    assert controller.delay(waiting=3) == 1.0
+    assert controller.delay(waiting=3) == 1.0
+    assert controller.delay(waiting=0) == 0.0
+
+
+def test_waiting_requests_are_ignored_without_a_maximum():
+    controller = build_controller(max_waiting=None)
+
+    assert controller.delay(waiting=100) == 0.0
+    assert not controller.paused
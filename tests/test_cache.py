@@ -0,0 +1,84 @@
+from app.cache import BloomFilter, CorrelationIdCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_cache_hit_and_miss_counters():
+    cache = CorrelationIdCache(capacity=10)
+    cache.add("a")
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+
+def test_cache_evicts_least_recently_used():
+    cache = CorrelationIdCache(capacity=2)
+    cache.add("a")
+    cache.add("b")
+    assert "a" in cache  # "b" is now the least recently used
+    cache.add("c")
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert len(cache) == 2
+
+
+def test_cache_expires_after_ttl():
+    clock = FakeClock()
+    cache = CorrelationIdCache(capacity=10, ttl_seconds=60, clock=clock)
+    cache.add("a")
+
+    clock.now = 59
+    assert "a" in cache
+    clock.now = 61
+    assert "a" not in cache
+    assert len(cache) == 0
+
+
+def test_cache_with_bloom_filter_only_reports_added_ids():
+    cache = CorrelationIdCache(capacity=5, bloom_filter_error_rate=0.01)
+    for i in range(20):
+        cache.add(f"id-{i}")
+
+    # Older ids are evicted from the cache even if the filter still has them.
+    assert all(f"id-{i}" not in cache for i in range(15))
+    assert all(f"id-{i}" in cache for i in range(15, 20))
+    assert "unknown" not in cache
+
+
+def test_full_cache_rebuilds_its_bloom_filter_once_per_capacity():
+    cache = CorrelationIdCache(capacity=100, bloom_filter_error_rate=0.01)
+    rebuilds = 0
+    clear = cache.bloom_filter.clear
+
+    def counting_clear():
+        nonlocal rebuilds
+        rebuilds += 1
+        clear()
+
+    cache.bloom_filter.clear = counting_clear
+    for i in range(1000):
+        cache.add(f"id-{i}")
+
+    # Every rebuild re-adds the full cache; the filter has room for as many
+    # additions again before the next one.
+    assert rebuilds <= 1000 // 100
+    assert all(f"id-{i}" in cache for i in range(900, 1000))
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom_filter.add(str(i))
+
+    assert all(str(i) in bloom_filter for i in range(1000))
+    false_positives = sum(str(i) in bloom_filter for i in range(1000, 11000))
+    assert false_positives < 300
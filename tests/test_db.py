@@ -0,0 +1,159 @@
+from contextlib import contextmanager
+from datetime import UTC, datetime
+from uuid import UUID
+
+from app.services.db import (
+    DbClient,
+    OutboxEvent,
+    SipDelivery,
+    SipStatus,
+    _batch_duplicates,
+    _create_outbox_query,
+    _outbox_params,
+    _register_query,
+)
+
+
+def _sip_delivery(correlation_id: str, s3_object_key: str = "object_key.zip"):
+    return SipDelivery(correlation_id, "bucketname", s3_object_key, "s3.endpoint")
+
+
+def test_batch_duplicates_matches_the_canonical_uuid():
+    # A uuid column returns the lowercase, hyphenated form.
+    upper = _sip_delivery("0F8FAD5B-D9CB-469F-A165-70867728950E")
+    unhyphenated = _sip_delivery("7c9e6679742540de944be07fc1f90ae7")
+    rows = [(UUID(upper.correlation_id),), (UUID(unhyphenated.correlation_id),)]
+
+    assert _batch_duplicates([upper, unhyphenated], rows) == []
+
+
+def test_batch_duplicates_keeps_the_first_occurrence():
+    batch = [
+        _sip_delivery("a", "first.zip"),
+        _sip_delivery("b"),
+        _sip_delivery("a", "second.zip"),
+    ]
+
+    assert _batch_duplicates(batch, [("a",)]) == batch[1:]
+
+
+class FakeCursor:
+    """Returns the given rows for the insert and records the statements."""
+
+    def __init__(self, rows: list[tuple]):
+        self.rows = rows
+        self.executed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, query, params=None, prepare=None):
+        self.executed.append((query, params))
+
+    def executemany(self, query, params_seq):
+        self.executed.extend((query, params) for params in params_seq)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakePool:
+    """Hands out one connection with a FakeCursor."""
+
+    def __init__(self, cursor: FakeCursor):
+        self._cursor = cursor
+        self.commits = 0
+
+    @contextmanager
+    def connection(self):
+        yield self
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        self.commits += 1
+
+
+def build_db_client(rows: list[tuple]) -> DbClient:
+    db_client = DbClient.__new__(DbClient)
+    db_client.table = "sip_deliveries"
+    db_client._register_queries = {
+        fetch_existing: _register_query(db_client.table, fetch_existing)
+        for fetch_existing in (True, False)
+    }
+    db_client.outbox_table = "sip_deliveries_outbox"
+    db_client._outbox_insert_query = "INSERT INTO outbox"
+    db_client.pool = FakePool(FakeCursor(rows))
+    return db_client
+
+
+def test_insert_sip_deliveries_reports_the_skipped_rows():
+    batch = [_sip_delivery("a"), _sip_delivery("b"), _sip_delivery("c")]
+    db_client = build_db_client([("a",), ("c",)])
+
+    assert db_client.insert_sip_deliveries(batch) == [batch[1]]
+    ((query, params),) = db_client.pool.cursor().executed
+    assert "ON CONFLICT DO NOTHING" in query
+    assert len(params) == 15
+    assert db_client.pool.commits == 1
+
+
+def test_insert_sip_deliveries_writes_the_outbox_of_the_inserted_rows():
+    batch = [_sip_delivery("a"), _sip_delivery("b")]
+    outbox_events = [
+        OutboxEvent(sip_delivery.correlation_id, "subject", "success", {})
+        for sip_delivery in batch
+    ]
+    db_client = build_db_client([("b",)])
+
+    assert db_client.insert_sip_deliveries(batch, outbox_events) == [batch[0]]
+    outbox_params = [
+        params
+        for query, params in db_client.pool.cursor().executed
+        if query == "INSERT INTO outbox"
+    ]
+    assert [params[0] for params in outbox_params] == ["b"]
+
+
+def test_register_sip_delivery_returns_the_existing_record():
+    existing = (
+        False,
+        "bucketname",
+        "existing.zip",
+        None,
+        "in_progress",
+        None,
+        "sipin/sip.registered",
+        datetime.now(UTC),
+    )
+    db_client = build_db_client([existing])
+
+    result = db_client.register_sip_delivery(_sip_delivery("a"))
+
+    assert not result.inserted
+    assert result.existing.s3_object_key == "existing.zip"
+    assert result.existing.status == SipStatus.IN_PROGRESS
+
+
+def test_register_sip_delivery_reports_an_insert():
+    inserted = build_db_client([(True,) + (None,) * 7])
+    skipped = build_db_client([])
+
+    assert inserted.register_sip_delivery(_sip_delivery("a")).inserted
+    assert not skipped.register_sip_delivery(_sip_delivery("a"), False).inserted
+
+
+def test_outbox_keeps_the_time_of_the_event():
+    registered_at = datetime(2024, 7, 4, 12, 41, 48, tzinfo=UTC)
+    outbox_event = OutboxEvent("a", "subject", "fail", {}, registered_at)
+
+    assert _outbox_params(outbox_event)[-1] == registered_at
+    # A table created before the column existed gains it.
+    assert "ADD COLUMN IF NOT EXISTS event_time" in _create_outbox_query("outbox")
@@ -0,0 +1,136 @@
+import json
+
+import pytest
+from cloudevents.events import (
+    CEMessageMode,
+    Event,
+    EventAttributes,
+    EventOutcome,
+    PulsarBinding,
+)
+
+from app.decoding import decode_message
+
+DATA = {
+    "s3_message": {
+        "Records": [
+            {
+                "eventName": "ObjectCreated:MULTIPART_COMPLETE",
+                "s3": {
+                    "domain": {"name": "s3.endpoint"},
+                    "bucket": {"name": "bucketname"},
+                    "object": {"key": "object_key.zip"},
+                },
+            }
+        ]
+    }
+}
+
+
+class FakeMessage:
+    def __init__(self, data: bytes, properties: dict[str, str]):
+        self._data = data
+        self._properties = properties
+
+    def data(self) -> bytes:
+        return self._data
+
+    def properties(self) -> dict[str, str]:
+        return self._properties
+
+    def event_timestamp(self) -> int:
+        # Set by the producer, independent of the time of the CloudEvent.
+        return 1
+
+
+def test_decode_binary_mode():
+    msg = FakeMessage(
+        json.dumps(DATA).encode(),
+        {
+            "ce_correlation_id": "abc",
+            "ce_subject": "subject",
+            "ce_outcome": EventOutcome.SUCCESS.value,
+            "ce_time": "2024-07-04T12:41:48.847Z",
+        },
+    )
+
+    event = decode_message(msg)
+
+    assert event.correlation_id == "abc"
+    assert event.get_attributes()["subject"] == "subject"
+    assert event.has_successful_outcome()
+    assert event.get_event_time_as_int() == 1720096908847
+    assert event.get_data() == DATA
+
+
+def test_decode_structured_mode():
+    body = {
+        "correlation_id": "abc",
+        "subject": "subject",
+        "outcome": EventOutcome.FAIL.value,
+        "time": "2024-07-04T12:41:48.847+00:00",
+        "data": DATA,
+    }
+
+    event = decode_message(FakeMessage(json.dumps(body).encode(), {}))
+
+    assert event.correlation_id == "abc"
+    assert not event.has_successful_outcome()
+    assert event.get_event_time_as_int() == 1720096908847
+    assert event.get_data() == DATA
+
+
+def test_decode_falls_back_on_malformed_messages():
+    properties = {
+        "ce_correlation_id": "abc",
+        "ce_outcome": EventOutcome.SUCCESS.value,
+        "ce_time": "2024-07-04T12:41:48.847Z",
+    }
+    missing_key = {"s3_message": {"Records": [{"s3": {"bucket": {"name": "b"}}}]}}
+
+    assert decode_message(FakeMessage(b"not json", properties)) is None
+    assert (
+        decode_message(FakeMessage(json.dumps(missing_key).encode(), properties))
+        is None
+    )
+    assert decode_message(FakeMessage(json.dumps(DATA).encode(), {})) is None
+    assert (
+        decode_message(
+            FakeMessage(
+                json.dumps(DATA).encode(),
+                {"ce_correlation_id": "abc", "ce_outcome": "unknown"},
+            )
+        )
+        is None
+    )
+
+    # Without a time (zone) the full decoder decides.
+    for time in (None, "yesterday", "2024-07-04T12:41:48.847"):
+        assert (
+            decode_message(
+                FakeMessage(json.dumps(DATA).encode(), {**properties, "ce_time": time})
+            )
+            is None
+        )
+
+
+@pytest.mark.parametrize("mode", [CEMessageMode.BINARY, CEMessageMode.STRUCTURED])
+def test_decode_reads_what_the_binding_encodes(mode):
+    event = Event(
+        EventAttributes(
+            correlation_id="abc", subject="subject", outcome=EventOutcome.SUCCESS
+        ),
+        DATA,
+    )
+    msg = PulsarBinding.to_protocol(event, mode)
+
+    decoded = decode_message(FakeMessage(msg.data, msg.attributes))
+
+    assert decoded is not None
+    assert decoded.get_attributes() == {
+        "correlation_id": "abc",
+        "subject": "subject",
+        "outcome": EventOutcome.SUCCESS.value,
+    }
+    assert decoded.get_event_time_as_int() == event.get_event_time_as_int()
+    assert decoded.get_data() == DATA
@@ -0,0 +1,77 @@
+import json
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from app.health import HealthCheck, start_health_server
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ready_after_warm_up_while_dependencies_are_healthy():
+    health = HealthCheck(liveness_timeout=60, clock=FakeClock())
+    database_healthy = True
+    health.checks = {"database": lambda: database_healthy}
+
+    assert not health.readiness()[0]
+
+    health.warmed_up()
+    ready, details = health.readiness()
+    assert ready
+    assert details["database"]
+
+    database_healthy = False
+    assert not health.readiness()[0]
+
+
+def test_not_live_when_the_receive_loop_is_silent():
+    clock = FakeClock()
+    health = HealthCheck(liveness_timeout=60, clock=clock)
+
+    clock.now = 30
+    assert health.liveness()[0]
+
+    health.beat()
+    clock.now = 91
+    assert not health.liveness()[0]
+
+
+def test_not_ready_without_recent_messages_when_configured():
+    clock = FakeClock()
+    health = HealthCheck(liveness_timeout=60, max_message_age=300, clock=clock)
+    health.warmed_up()
+
+    clock.now = 200
+    health.processed()
+    clock.now = 400
+    assert health.readiness()[0]
+
+    clock.now = 501
+    ready, details = health.readiness()
+    assert not ready
+    assert details["seconds_since_message"] == 301
+
+
+def test_health_server_answers_the_probes():
+    health = HealthCheck(liveness_timeout=60)
+    server = start_health_server(
+        {"enabled": True, "address": "127.0.0.1", "port": 0},
+        health.liveness,
+        health.readiness,
+    )
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urlopen(f"{url}/health/live") as response:
+            assert json.load(response)["live"]
+        with pytest.raises(HTTPError) as error:
+            urlopen(f"{url}/health/ready")
+        assert error.value.code == 503
+    finally:
+        server.shutdown()
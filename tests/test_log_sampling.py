@@ -0,0 +1,61 @@
+from app.log_sampling import SampledLog, ThroughputSummary
+
+
+class FakeLog:
+    def __init__(self):
+        self.lines = []
+
+    def info(self, message):
+        self.lines.append(message)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_sampled_log_logs_one_out_of_n():
+    log = FakeLog()
+    sampled_log = SampledLog(log, sample_every=3)
+
+    for index in range(7):
+        sampled_log.info("Line %d.", index)
+
+    assert log.lines == ["Line 0.", "Line 3.", "Line 6."]
+    assert sampled_log.pop_suppressed() == 4
+    assert sampled_log.pop_suppressed() == 0
+
+
+def test_sampled_log_rate_limit():
+    log = FakeLog()
+    clock = FakeClock()
+    sampled_log = SampledLog(log, max_per_second=2, clock=clock)
+
+    for _ in range(5):
+        sampled_log.info("Line.")
+    assert len(log.lines) == 2
+
+    clock.now = 0.5
+    sampled_log.info("Line.")
+    sampled_log.info("Line.")
+    assert len(log.lines) == 3
+    assert sampled_log.suppressed == 4
+
+
+def test_throughput_summary():
+    clock = FakeClock()
+    summary = ThroughputSummary(clock)
+    summary.count("registered", 8)
+    summary.count("duplicates")
+    summary.count("failed")
+
+    clock.now = 10.0
+    assert summary.report(suppressed=5) == (
+        "Handled 10 in 10s (1.0/s): 8 registered, 1 duplicates, 0 dropped, 1 failed; "
+        "5 log lines suppressed."
+    )
+    clock.now = 20.0
+    assert summary.report().startswith("Handled 0 in 10s (0.0/s)")
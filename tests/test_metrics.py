@@ -0,0 +1,67 @@
+import pytest
+from prometheus_client import CollectorRegistry
+
+from app import metrics
+from app.app import EventListener
+from benchmarks.fakes import FakeDbClient, FakePulsarClient, build_message
+
+STAGE_COUNT = "sip_delivery_registrator_stage_seconds_count"
+MESSAGES = "sip_delivery_registrator_messages_total"
+OUTGOING_EVENTS = "sip_delivery_registrator_outgoing_events_total"
+
+
+class Snapshot:
+    """The values of the metrics in a registry, to compare with later ones."""
+
+    def __init__(self, registry: CollectorRegistry):
+        self.registry = registry
+        self.values = self._values()
+
+    def _values(self) -> dict[tuple, float]:
+        return {
+            (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+            for metric in self.registry.collect()
+            for sample in metric.samples
+        }
+
+    def increase(self, name: str, **labels) -> float:
+        """How much a sample increased since the snapshot."""
+        key = (name, tuple(sorted(labels.items())))
+        return self._values().get(key, 0.0) - self.values.get(key, 0.0)
+
+
+@pytest.fixture
+def registry():
+    """A registry with only the metrics of the message handling.
+
+    The metrics themselves are global, so the tests compare their values
+    before and after handling.
+    """
+    registry = CollectorRegistry()
+    for collector in (metrics.STAGE_SECONDS, metrics.MESSAGES, metrics.OUTGOING_EVENTS):
+        registry.register(collector)
+    return registry
+
+
+def test_stage_times_into_its_histogram(registry):
+    snapshot = Snapshot(registry)
+
+    with metrics.Stage("test").time():
+        pass
+
+    assert snapshot.increase(STAGE_COUNT, stage="test") == 1
+
+
+def test_handling_messages_updates_the_stages_and_outcomes(env, registry):
+    pulsar_client = FakePulsarClient([build_message("a"), build_message("a")])
+    listener = EventListener(db_client=FakeDbClient(), pulsar_client=pulsar_client)
+    snapshot = Snapshot(registry)
+
+    listener.receive_message()
+    listener.receive_message()
+
+    for stage in ("receive", "decode", "db_insert", "produce"):
+        assert snapshot.increase(STAGE_COUNT, stage=stage) == 2
+    assert snapshot.increase(MESSAGES, outcome="success") == 1
+    assert snapshot.increase(MESSAGES, outcome="duplicate") == 1
+    assert snapshot.increase(OUTGOING_EVENTS, action="emitted") == 2
@@ -0,0 +1,34 @@
+from datetime import date
+
+from app.services.partitions import (
+    _add_months,
+    _expired_partitions,
+    _month_partitions,
+)
+
+
+def test_add_months_crosses_years():
+    assert _add_months(date(2024, 11, 1), 3) == date(2025, 2, 1)
+    assert _add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+
+
+def test_month_partitions():
+    assert _month_partitions("sip_deliveries", date(2024, 12, 1), 1) == [
+        ("sip_deliveries_p202412", date(2024, 12, 1), date(2025, 1, 1)),
+        ("sip_deliveries_p202501", date(2025, 1, 1), date(2025, 2, 1)),
+    ]
+
+
+def test_expired_partitions_only_takes_ended_monthly_partitions():
+    names = [
+        "sip_deliveries_p202403",
+        "sip_deliveries_p202401",
+        "sip_deliveries_p202402",
+        "sip_deliveries_default",
+        "other_p202401",
+    ]
+
+    assert _expired_partitions("sip_deliveries", names, date(2024, 3, 1)) == [
+        "sip_deliveries_p202401",
+        "sip_deliveries_p202402",
+    ]
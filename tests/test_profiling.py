@@ -0,0 +1,104 @@
+import time
+from unittest.mock import MagicMock
+
+from app import metrics, profiling
+from app.profiling import MessageTrace, Profiler, SlowestMessages
+
+
+def _profiler(tmp_path, **config) -> Profiler:
+    return Profiler(
+        {
+            "enabled": True,
+            "duration_seconds": 0.2,
+            "sample_interval_ms": 5,
+            "output_dir": str(tmp_path),
+            "slowest_messages": 2,
+            **config,
+        },
+        MagicMock(),
+    )
+
+
+def _wait_for_capture(profiler: Profiler, timeout: float = 5, loop: bool = True):
+    deadline = time.monotonic() + timeout
+    while profiler._running and time.monotonic() < deadline:
+        if loop:
+            profiler.checkpoint()
+        time.sleep(0.01)
+    assert not profiler._running
+
+
+def test_idle_profiler_doesnt_trace_messages(tmp_path):
+    profiler = _profiler(tmp_path)
+
+    with profiler.timed_message("message") as trace:
+        metrics.DB_INSERT.observe(0.01)
+
+    assert trace is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_slowest_messages_keeps_the_slowest():
+    slowest = SlowestMessages(2)
+    for label, elapsed in (("a", 0.3), ("b", 0.1), ("c", 0.5), ("d", 0.2)):
+        trace = MessageTrace(label)
+        trace.elapsed = elapsed
+        slowest.add(trace)
+
+    assert [trace.label for trace in slowest.slowest()] == ["c", "a"]
+
+
+def test_capture_writes_stacks_and_slowest_messages(tmp_path):
+    profiler = _profiler(tmp_path)
+
+    name = profiler.trigger()
+    assert profiler.trigger() is None
+    for correlation_id, seconds in (("fast", 0.001), ("slow", 0.05)):
+        with profiler.timed_message(correlation_id) as trace:
+            with metrics.DB_INSERT.time():
+                time.sleep(seconds)
+            with profiler.timed_message("nested") as nested:
+                assert nested is None
+        assert trace.stages["db_insert"] >= seconds
+    _wait_for_capture(profiler)
+
+    assert (tmp_path / f"{name}.folded").read_text().strip()
+    assert "samples of all threads" in (tmp_path / f"{name}.samples.txt").read_text()
+    slowest = (tmp_path / f"{name}.slowest.txt").read_text().splitlines()
+    assert [line.split()[1] for line in slowest] == ["slow:", "fast:"]
+    assert "db_insert=" in slowest[0]
+    # Idle again after the capture
+    with profiler.timed_message("message") as trace:
+        assert trace is None
+
+
+def test_cprofile_capture_profiles_the_loop(tmp_path):
+    profiler = _profiler(tmp_path, mode="cprofile")
+
+    name = profiler.trigger()
+    _wait_for_capture(profiler)
+
+    assert (tmp_path / f"{name}.prof").exists()
+    assert "function calls" in (tmp_path / f"{name}.cprofile.txt").read_text()
+
+
+def test_cprofile_capture_starts_afresh_after_the_loop_stalled(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "_CPROFILE_STOP_TIMEOUT", 0.1)
+    profiler = _profiler(tmp_path, mode="cprofile")
+
+    stalled = profiler.trigger()
+    # The loop starts cProfile, then stalls until after the capture.
+    profiler.checkpoint()
+    _wait_for_capture(profiler, loop=False)
+
+    assert not (tmp_path / f"{stalled}.prof").exists()
+    assert profiler._cprofile is None
+    # A stalled loop that resumes doesn't profile any more.
+    profiler.checkpoint()
+    assert profiler._cprofile is None
+
+    name = profiler.trigger()
+    _wait_for_capture(profiler)
+
+    assert name.endswith("-cprofile")
+    assert (tmp_path / f"{name}.prof").exists()
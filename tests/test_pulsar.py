@@ -0,0 +1,347 @@
+import asyncio
+import threading
+
+import pytest
+from cloudevents.events import Event, EventAttributes, EventOutcome
+from pulsar import CompressionType, Result
+
+from app.retry import RetryPolicy, Scheduler
+from app.services.pulsar import (
+    AsyncPulsarClient,
+    PendingAck,
+    PulsarClient,
+    _producer_settings,
+    _sequence_id,
+)
+
+
+class FakePulsarClient:
+    def __init__(self):
+        self.acked = []
+        self.nacked = []
+
+    def acknowledge(self, msg):
+        self.acked.append(msg)
+
+    def fail(self, msg, error=None, permanent=False):
+        self.nacked.append(msg)
+
+
+def test_pending_ack_waits_for_all_sends():
+    client = FakePulsarClient()
+    pending_ack = PendingAck(client, "msg")
+    first = pending_ack.expect()
+    second = pending_ack.expect()
+
+    pending_ack.done()
+    first(True)
+    assert client.acked == []
+
+    second(True)
+    assert client.acked == ["msg"]
+    assert client.nacked == []
+
+
+def test_pending_ack_nacks_when_a_send_fails():
+    client = FakePulsarClient()
+    pending_ack = PendingAck(client, "msg")
+    callback = pending_ack.expect()
+
+    pending_ack.done()
+    callback(False)
+
+    assert client.acked == []
+    assert client.nacked == ["msg"]
+
+
+def test_producer_settings():
+    settings = _producer_settings(
+        {"compression": "LZ4", "batching": {"enabled": True, "max_messages": 500}}
+    )
+
+    assert settings["compression_type"] == CompressionType.LZ4
+    assert settings["batching_enabled"]
+    assert settings["batching_max_messages"] == 500
+    assert settings["batching_max_publish_delay_ms"] == 10
+    assert settings["max_pending_messages"] == 1000
+
+
+def test_producer_settings_unknown_compression():
+    with pytest.raises(ValueError):
+        _producer_settings({"compression": "GZIP"})
+
+
+class FakeMessageId:
+    def __init__(self, ledger_id, entry_id, batch_index=-1):
+        self._ids = (ledger_id, entry_id, batch_index)
+
+    def ledger_id(self):
+        return self._ids[0]
+
+    def entry_id(self):
+        return self._ids[1]
+
+    def batch_index(self):
+        return self._ids[2]
+
+
+def test_sequence_ids_increase_with_the_message_position():
+    sequence_ids = [
+        _sequence_id(FakeMessageId(1, 5), 0),
+        _sequence_id(FakeMessageId(1, 5), 1),
+        _sequence_id(FakeMessageId(1, 6, 0), 0),
+        _sequence_id(FakeMessageId(1, 6, 1), 0),
+        _sequence_id(FakeMessageId(2, 0), 0),
+    ]
+
+    assert sequence_ids == sorted(set(sequence_ids))
+
+
+def test_sequence_ids_are_refused_beyond_their_bits():
+    largest = _sequence_id(FakeMessageId(2**27 - 1, 2**20 - 1, 2**10 - 2), 63)
+
+    assert largest == 2**63 - 1
+    assert _sequence_id(FakeMessageId(2**27, 0), 0) is None
+    assert _sequence_id(FakeMessageId(1, 2**20), 0) is None
+    assert _sequence_id(FakeMessageId(1, 5, 2**10 - 1), 0) is None
+    assert _sequence_id(FakeMessageId(1, 5), 64) is None
+
+
+class FakeLog:
+    def error(self, message):
+        pass
+
+
+class FakeProducer:
+    """Records the sequence ids; confirms the sends unless held."""
+
+    def __init__(self, hold: bool = False, last_sequence_id: int = -1):
+        self.hold = hold
+        self.sent = []
+        self.callbacks = []
+        self._last_sequence_id = last_sequence_id
+
+    def last_sequence_id(self) -> int:
+        return self._last_sequence_id
+
+    def send_async(self, data, callback, sequence_id=None, **kwargs):
+        self.sent.append(sequence_id)
+        if self.hold:
+            self.callbacks.append(callback)
+        else:
+            callback(Result.Ok, None)
+
+
+def _deduplicating_client(
+    hold: bool = False,
+) -> tuple[PulsarClient, FakeProducer, FakeProducer]:
+    named, unnamed = FakeProducer(hold), FakeProducer(hold)
+    client = PulsarClient.__new__(PulsarClient)
+    client.pulsar_config = {"producer_topic": "out"}
+    client.producer_name = "registrator"
+    client.producers = {"out": named}
+    client._producers_lock = threading.Lock()
+    client._unsequenced_producer = unnamed
+    client._last_sequence_id = -1
+    client._sequence_lock = threading.Lock()
+    client.log = FakeLog()
+    return client, named, unnamed
+
+
+def _event() -> Event:
+    return Event(
+        EventAttributes(
+            type="out",
+            source="test",
+            subject="subject",
+            correlation_id="correlation_id",
+            outcome=EventOutcome.SUCCESS,
+        ),
+        {},
+    )
+
+
+def test_redelivered_message_is_produced_without_its_sequence_id():
+    client, named, unnamed = _deduplicating_client()
+    failed = _sequence_id(FakeMessageId(1, 5), 0)
+    later = _sequence_id(FakeMessageId(1, 6), 0)
+
+    client.produce_event("out", _event(), sequence_id=failed)
+    client.produce_event("out", _event(), sequence_id=later)
+    # The first message failed after its event was sent, and is redelivered.
+    client.produce_event("out", _event(), sequence_id=failed)
+    client.produce_event("out", _event(), sequence_id=None)
+
+    assert named.sent == [failed, later]
+    # The broker would drop an id below the last one; the unnamed producer
+    # assigns its own.
+    assert unnamed.sent == [None, None]
+
+
+class FakeProducerFactory:
+    """Creates the named producer with the last sequence id the broker kept."""
+
+    def __init__(self, named: FakeProducer):
+        self.named = named
+
+    def create_producer(self, topic, producer_name=None, **kwargs):
+        return self.named if producer_name is not None else FakeProducer()
+
+
+def test_restarted_client_continues_from_the_persisted_sequence_id():
+    persisted = _sequence_id(FakeMessageId(1, 6), 0)
+    client, _, unnamed = _deduplicating_client()
+    named = FakeProducer(last_sequence_id=persisted)
+    client.client = FakeProducerFactory(named)
+    client.producers = {}
+    client.producer_settings = {}
+    nacked = _sequence_id(FakeMessageId(1, 5), 0)
+    later = _sequence_id(FakeMessageId(1, 7), 0)
+
+    client._get_producer("out")
+    # A message nacked before the restart is redelivered from below the
+    # last id the broker persisted.
+    client.produce_event("out", _event(), sequence_id=nacked)
+    client.produce_event("out", _event(), sequence_id=later)
+
+    assert named.sent == [later]
+    assert unnamed.sent == [None]
+
+
+def test_a_pending_send_doesnt_hold_up_the_next_one():
+    client, named, _ = _deduplicating_client(hold=True)
+    first = threading.Thread(
+        target=client.produce_event,
+        args=("out", _event()),
+        kwargs={"sequence_id": 1},
+    )
+    first.start()
+    # The first send waits for the broker, without holding the sequence lock.
+    while not named.callbacks:
+        first.join(0.01)
+    client.produce_event(
+        "out", _event(), callback=lambda succeeded: None, sequence_id=2
+    )
+
+    assert named.sent == [1, 2]
+    assert first.is_alive()
+    for callback in named.callbacks:
+        callback(Result.Ok, None)
+    first.join(5)
+    assert not first.is_alive()
+
+
+def test_failed_blocking_send_raises():
+    client, named, _ = _deduplicating_client(hold=True)
+    errors = []
+
+    def produce():
+        try:
+            client.produce_event("out", _event(), sequence_id=1)
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=produce)
+    thread.start()
+    while not named.callbacks:
+        thread.join(0.01)
+    named.callbacks[0](Result.Timeout, None)
+    thread.join(5)
+
+    assert len(errors) == 1
+
+
+class ThreadRecordingProducer:
+    def __init__(self):
+        self.threads = []
+
+    def send(self, data, **kwargs):
+        self.threads.append(threading.current_thread().name)
+
+
+class FakeAcknowledger:
+    def __init__(self):
+        self.acked = []
+        self.done = threading.Event()
+
+    def acknowledge(self, msg):
+        self.acked.append(msg)
+        self.done.set()
+
+
+class FakeMessage:
+    def redelivery_count(self):
+        return 0
+
+    def properties(self):
+        return {}
+
+    def data(self):
+        return b"{}"
+
+    def topic_name(self):
+        return "in"
+
+    def message_id(self):
+        return "1:5:-1"
+
+    def partition_key(self):
+        return "correlation_id"
+
+    def event_timestamp(self):
+        return 0
+
+
+def test_fail_from_a_send_callback_dead_letters_on_the_retry_thread():
+    producer = ThreadRecordingProducer()
+    client = PulsarClient.__new__(PulsarClient)
+    client.log = FakeLog()
+    client.producers = {"in-DLQ": producer}
+    client.dead_letter_topic = "in-DLQ"
+    client.retry_policy = RetryPolicy(1, initial_backoff=1.0, max_backoff=1.0)
+    client._retries = Scheduler("retry", FakeLog())
+    client.acknowledger = FakeAcknowledger()
+    msg = FakeMessage()
+
+    callback = threading.Thread(
+        target=client.fail, args=(msg, RuntimeError("send failed")), name="io"
+    )
+    callback.start()
+    callback.join()
+
+    assert client.acknowledger.done.wait(5)
+    assert producer.threads == ["retry"]
+    assert client.acknowledger.acked == [msg]
+    client._retries.close()
+
+
+class ConfirmingProducer:
+    """Confirms every asynchronous send right away."""
+
+    def __init__(self):
+        self.sent = 0
+
+    def send_async(self, data, callback, **kwargs):
+        self.sent += 1
+        callback(Result.Ok, None)
+
+
+def test_async_produce_is_capped_without_the_thread_semaphore():
+    producer = ConfirmingProducer()
+    client = PulsarClient.__new__(PulsarClient)
+    client.log = FakeLog()
+    client.pulsar_config = {"producer_topic": "out"}
+    client.producer_name = None
+    client.producers = {"out": producer}
+    # The cap of the sync path is exhausted; acquiring it would block the loop.
+    client._in_flight = threading.BoundedSemaphore(1)
+    client._in_flight.acquire()
+    async_client = AsyncPulsarClient.__new__(AsyncPulsarClient)
+    async_client.pulsar_client = client
+
+    async def produce():
+        async_client._in_flight = asyncio.Semaphore(1)
+        return await asyncio.wait_for(async_client.produce_event("out", _event()), 5)
+
+    assert asyncio.run(produce())
+    assert producer.sent == 1
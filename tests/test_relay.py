@@ -0,0 +1,93 @@
+import logging
+from datetime import UTC, datetime, timedelta
+
+from pulsar import Result
+
+from app.relay import OutboxRelay
+
+REGISTERED_AT = datetime(2024, 7, 4, 12, 41, 48, 847000, tzinfo=UTC)
+
+
+class FakeOutbox:
+    """Keeps the outbox rows in memory, like DbClient.relay_outbox."""
+
+    def __init__(self, count: int):
+        self.rows = [
+            (
+                row_id,
+                f"id-{row_id}",
+                "subject",
+                "success",
+                {"a": row_id},
+                REGISTERED_AT + timedelta(seconds=row_id),
+            )
+            for row_id in range(1, count + 1)
+        ]
+        self.sent: set[int] = set()
+
+    def relay_outbox(self, limit, publish):
+        rows = [row for row in self.rows if row[0] not in self.sent][:limit]
+        sent = publish(rows) if rows else []
+        self.sent.update(sent)
+        return len(sent)
+
+
+class FakeProducer:
+    """Confirms the sends on flush, with the given result per row."""
+
+    def __init__(self, results: dict[int, Result] | None = None):
+        self.results = results
+        self.callbacks = []
+        self.timestamps = []
+
+    def send_async(self, data, callback, event_timestamp=None, **kwargs):
+        self.callbacks.append(callback)
+        self.timestamps.append(event_timestamp)
+
+    def flush(self):
+        if self.results is None:
+            # The broker never answers.
+            return
+        for row_id, callback in enumerate(self.callbacks, start=1):
+            callback(self.results.get(row_id, Result.Ok), None)
+        self.callbacks = []
+
+
+def build_relay(outbox: FakeOutbox, producer: FakeProducer) -> OutboxRelay:
+    relay = OutboxRelay.__new__(OutboxRelay)
+    relay.log = logging.getLogger(__name__)
+    relay.topic = "outgoing"
+    relay.batch_size = 10
+    relay.send_timeout = 0.05
+    relay.db_client = outbox
+    relay.producer = producer
+    return relay
+
+
+def test_relay_marks_only_the_confirmed_rows_as_sent():
+    outbox = FakeOutbox(3)
+    relay = build_relay(outbox, FakeProducer({2: Result.Timeout}))
+
+    assert relay.relay_batch() == 2
+    assert outbox.sent == {1, 3}
+
+
+def test_relay_marks_nothing_without_confirmation():
+    outbox = FakeOutbox(2)
+    relay = build_relay(outbox, FakeProducer())
+
+    assert relay.relay_batch() == 0
+    assert outbox.sent == set()
+
+
+def test_relay_publishes_the_events_with_their_registration_time():
+    outbox = FakeOutbox(2)
+    producer = FakeProducer({})
+    relay = build_relay(outbox, producer)
+
+    relay.relay_batch()
+
+    assert producer.timestamps == [
+        int((REGISTERED_AT + timedelta(seconds=row_id)).timestamp() * 1000)
+        for row_id in (1, 2)
+    ]
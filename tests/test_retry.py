@@ -0,0 +1,50 @@
+import threading
+
+from psycopg import OperationalError
+
+from app.retry import InvalidMessageError, RetryPolicy, Scheduler
+
+
+class FakeLog:
+    def error(self, message):
+        pass
+
+
+def test_backoff_grows_exponentially_up_to_the_maximum():
+    policy = RetryPolicy(max_attempts=5, initial_backoff=1.0, max_backoff=5.0)
+
+    assert [policy.backoff(attempt) for attempt in range(1, 5)] == [1.0, 2.0, 4.0, 5.0]
+
+
+def test_only_transient_errors_are_retried():
+    policy = RetryPolicy(max_attempts=3, initial_backoff=1.0, max_backoff=5.0)
+
+    assert policy.should_retry(1, OperationalError("connection lost"))
+    assert policy.should_retry(2, None)
+    assert not policy.should_retry(3, OperationalError("connection lost"))
+    assert not policy.should_retry(1, InvalidMessageError("no records"))
+    # A bug is retried rather than dead-lettering every message right away.
+    assert policy.should_retry(1, KeyError("s3_message"))
+
+
+def test_scheduler_runs_functions_in_order_of_due_time():
+    scheduler = Scheduler("test", FakeLog())
+    calls = []
+    done = threading.Event()
+
+    scheduler.call_later(0.05, lambda: (calls.append("late"), done.set()))
+    scheduler.call_later(0.0, lambda: calls.append("early"))
+
+    assert done.wait(5)
+    assert calls == ["early", "late"]
+    scheduler.close()
+
+
+def test_scheduler_runs_pending_functions_on_close():
+    scheduler = Scheduler("test", FakeLog())
+    calls = []
+    scheduler.call_later(60, lambda: calls.append("pending"))
+
+    scheduler.close()
+
+    assert calls == ["pending"]
@@ -0,0 +1,92 @@
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+from app.services.db import DuplicateKeyError, SipDelivery
+from app.services.stores import AsyncStore, MemoryStore, SqliteStore
+
+
+def _sip_delivery(correlation_id: str, s3_object_key: str = "object_key.zip"):
+    return SipDelivery(correlation_id, "bucketname", s3_object_key, "s3.endpoint")
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        store = MemoryStore()
+    else:
+        store = SqliteStore(str(tmp_path / "store.sqlite3"), "sip_deliveries")
+    yield store
+    store.close()
+
+
+def test_register_sip_delivery_reports_duplicates(store):
+    assert store.register_sip_delivery(_sip_delivery("a")).inserted
+
+    result = store.register_sip_delivery(_sip_delivery("a", "other.zip"))
+
+    assert not result.inserted
+    assert result.existing.s3_object_key == "object_key.zip"
+    assert result.existing.s3_domain == ""
+    assert store.register_sip_delivery(_sip_delivery("a"), False).existing is None
+    with pytest.raises(DuplicateKeyError):
+        store.insert_sip_delivery(_sip_delivery("a"))
+
+
+def test_insert_sip_deliveries_keeps_the_first(store):
+    store.register_sip_delivery(_sip_delivery("a"))
+    batch = [
+        _sip_delivery("b", "first.zip"),
+        _sip_delivery("a"),
+        _sip_delivery("b", "second.zip"),
+    ]
+
+    assert store.insert_sip_deliveries(batch) == batch[1:]
+    assert store.register_sip_delivery(_sip_delivery("b")).existing.s3_object_key == (
+        "first.zip"
+    )
+
+
+def test_sqlite_store_commits_on_close(tmp_path):
+    path = str(tmp_path / "store.sqlite3")
+    store = SqliteStore(path, "sip_deliveries", commit_every=100)
+    store.register_sip_delivery(_sip_delivery("a"))
+    store.close()
+
+    store = SqliteStore(path, "sip_deliveries")
+    assert not store.register_sip_delivery(_sip_delivery("a")).inserted
+    store.close()
+
+
+def test_sqlite_store_rejects_invalid_rows(tmp_path):
+    store = SqliteStore(str(tmp_path / "store.sqlite3"), "sip_deliveries")
+    sip_delivery = _sip_delivery("a")
+    sip_delivery.s3_bucket = None
+
+    with pytest.raises(sqlite3.IntegrityError):
+        store.register_sip_delivery(sip_delivery)
+    store.close()
+
+
+def test_async_store_calls_a_blocking_store_off_the_event_loop(tmp_path):
+    store = SqliteStore(str(tmp_path / "store.sqlite3"), "sip_deliveries")
+    async_store = AsyncStore(store, blocking=True)
+    threads = []
+    register = store.register_sip_delivery
+
+    def register_sip_delivery(sip_delivery, fetch_existing=True):
+        threads.append(threading.current_thread())
+        return register(sip_delivery, fetch_existing)
+
+    store.register_sip_delivery = register_sip_delivery
+
+    async def register_and_close():
+        result = await async_store.register_sip_delivery(_sip_delivery("a"))
+        await async_store.close()
+        return result
+
+    assert asyncio.run(register_and_close()).inserted
+    (thread,) = threads
+    assert thread is not threading.main_thread()
@@ -0,0 +1,194 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+from viaa.configuration import ConfigParser
+
+from app import metrics, supervisor
+from app.supervisor import Supervisor
+
+
+class FakeClock:
+    """Stands in for the time module: wall clock and monotonic clock together."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+class FakeProcess:
+    """A worker process that runs until it is told to exit."""
+
+    pids = iter(range(100, 1000))
+
+    def __init__(self, target, args, name):
+        self.name = name
+        self.pid = None
+        self.exitcode = None
+        self.started = False
+        self.killed = False
+
+    def start(self):
+        self.started = True
+        self.pid = next(self.pids)
+
+    def is_alive(self) -> bool:
+        return self.started and self.exitcode is None
+
+    def exit(self, code: int = 1):
+        self.exitcode = code
+
+    def kill(self):
+        self.killed = True
+        self.exit(-9)
+
+    def terminate(self):
+        self.exit(0)
+
+    def join(self, timeout=None):
+        pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(supervisor, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def config_parser(env):
+    config_parser = ConfigParser()
+    config_parser.app_cfg["pulsar"]["subscription_type"] = "Shared"
+    config_parser.app_cfg["listener"]["heartbeat_timeout"] = 60
+    return config_parser
+
+
+@pytest.fixture
+def build_supervisor(config_parser, clock):
+    def build(processes: int = 1) -> Supervisor:
+        built = Supervisor(config_parser, processes)
+        built._context = SimpleNamespace(Process=FakeProcess)
+        return built
+
+    return build
+
+
+def test_non_shared_subscription_is_rejected(config_parser):
+    config_parser.app_cfg["pulsar"]["subscription_type"] = "Exclusive"
+
+    with pytest.raises(ValueError):
+        Supervisor(config_parser, 2)
+
+
+def test_crashing_worker_is_restarted_with_a_growing_delay(build_supervisor, clock):
+    sup = build_supervisor()
+    sup._start(0)
+    delays = []
+
+    for _ in range(4):
+        crashed = sup._workers[0]
+        crashed.exit()
+        sup._check(0)
+        assert sup._workers[0] is None
+        delays.append(sup._restart_at[0] - clock.now)
+        if delays[-1] > 0:
+            # Not restarted before the delay.
+            sup._check(0)
+            assert sup._workers[0] is None
+            clock.now += delays[-1]
+        sup._check(0)
+        assert sup._workers[0] is not crashed
+        assert sup._workers[0].is_alive()
+
+    assert delays == [0, 1, 3, 7]
+    assert sup._restarts[0] == 4
+
+
+def test_worker_that_ran_for_a_while_is_restarted_right_away(build_supervisor, clock):
+    sup = build_supervisor()
+    sup._start(0)
+    sup._crashes[0] = 5
+    clock.now += 61
+
+    sup._workers[0].exit()
+    sup._check(0)
+
+    assert sup._restart_at[0] == clock.now
+
+
+def test_worker_that_misses_its_heartbeat_is_killed_and_restarted(
+    build_supervisor, clock
+):
+    sup = build_supervisor()
+    sup._start(0)
+    silent = sup._workers[0]
+    sup._heartbeats[0] = clock.now
+
+    clock.now += 60
+    sup._check(0)
+    assert sup._workers[0] is silent
+
+    clock.now += 1
+    sup._check(0)
+    assert silent.killed
+    sup._check(0)
+    assert sup._workers[0] is not silent
+    assert sup._restarts[0] == 1
+
+
+def test_ready_when_every_worker_beats(build_supervisor, clock):
+    sup = build_supervisor(processes=2)
+    for index in range(2):
+        sup._start(index)
+
+    # Not ready before the workers warmed up and beat.
+    assert sup.readiness() == (
+        False,
+        {"ready": False, "workers": {"0": False, "1": False}},
+    )
+
+    sup._heartbeats[0] = sup._heartbeats[1] = clock.now
+    assert sup.readiness() == (True, {"ready": True, "workers": {"0": True, "1": True}})
+
+    clock.now += 30
+    sup._heartbeats[1] = clock.now
+    clock.now += 31
+    assert sup.readiness() == (
+        False,
+        {"ready": False, "workers": {"0": False, "1": True}},
+    )
+
+    sup._heartbeats[0] = clock.now
+    sup._workers[1].exit()
+    assert not sup.readiness()[0]
+
+
+def test_prepare_metrics_dir_clears_the_values_of_a_previous_run(
+    build_supervisor, monkeypatch, tmp_path
+):
+    (tmp_path / "counter_123.db").write_bytes(b"")
+    (tmp_path / "notes.txt").write_text("kept")
+    monkeypatch.setenv(metrics.MULTIPROCESS_DIR_ENV, str(tmp_path))
+
+    assert build_supervisor()._prepare_metrics_dir() is None
+    assert [path.name for path in tmp_path.iterdir()] == ["notes.txt"]
+
+
+def test_prepare_metrics_dir_creates_a_directory_for_the_workers(
+    build_supervisor, monkeypatch
+):
+    monkeypatch.setenv(metrics.MULTIPROCESS_DIR_ENV, "")
+
+    metrics_dir = build_supervisor()._prepare_metrics_dir()
+
+    try:
+        assert os.path.isdir(metrics_dir)
+        assert os.environ[metrics.MULTIPROCESS_DIR_ENV] == metrics_dir
+    finally:
+        os.rmdir(metrics_dir)